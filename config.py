@@ -10,11 +10,64 @@ ADB_PATH = "adb/adb.exe"
 ADB_TIMEOUT = 15  # seconds
 ADB_RETRY_ATTEMPTS = 3
 
+# Device presence comes from one long-lived track-devices stream (see utils/device_tracker.py)
+DEVICE_TRACKING_ENABLED = True
+ADB_SERVER_HOST = "127.0.0.1"
+
+# adb servers sharing the device I/O (see utils/adb_servers.py); one port = a single server
+ADB_SERVER_PORTS = [5037]
+ADB_DEVICE_SERVERS = {}  # serial -> port; unlisted devices are spread by a hash of the serial
+
 # ==================== IMAGE RECOGNITION SETTINGS ====================
+# Resolution the templates and coordinates were captured at; other screens are rescaled
+BASE_RESOLUTION = (1280, 720)
 TEMPLATE_MATCHING_THRESHOLD = 0.9  # 0.0 to 1.0 (higher = more strict)
 IMAGE_CAPTURE_DELAY = 2 # seconds between screenshots
+# "raw": uncompressed screencap read into pooled frames (no PNG encode/decode, see utils/frame_pool.py);
+# "png": compressed, about 4x less adb traffic for devices on slow links
+CAPTURE_FORMAT = "raw"
+FRAME_POOL_SIZE = 3  # reusable frames kept per device
+# Device ticks are spread over IMAGE_CAPTURE_DELAY instead of running in lockstep (see utils/scheduler.py)
+SCHEDULER_JITTER = 0.25  # random extra delay, as a share of one device's slot in the interval
+SCHEDULER_MAX_EXPENSIVE_FLOWS = 2  # devices in farm search / explore at once, 0 = unlimited
+SCHEDULER_TURN_TIMEOUT = 60.0  # seconds a turned-away device keeps its place in line without asking again
 TEMPLATE_SEARCH_TIMEOUT = 10  # seconds to wait for objects
 
+# Template metadata (tap anchors of trimmed templates, see utils/template_tools.py)
+TEMPLATE_MANIFEST_PATH = "images/templates.json"
+
+# Precompiled template pack, built with `make templates` (see utils/template_pack.py)
+TEMPLATE_PACK_ENABLED = True
+TEMPLATE_PACK_PATH = "images/templates.pack"
+TEMPLATE_PACK_RESOLUTIONS = [(1920, 1080), (1600, 900), (960, 540)]  # variants prebuilt besides the base
+
+# Pixel probes checked before template matching (see utils/probe.py)
+# Off until images/probes.json is derived from real screenshots with `python -m utils.template_tools derive-probe`
+PROBES_ENABLED = False
+PROBE_MANIFEST_PATH = "images/probes.json"
+
+# Search a small window around the previous hit of a template before the full frame
+LOCATION_CACHE_ENABLED = True
+LOCATION_CACHE_MARGIN = 24  # pixels around the previous match
+LOCATION_CACHE_MAX_MISSES = 3  # misses in a row before the window is skipped until the next full-frame hit
+
+# Large templates are matched through the frame's DFT, computed once per frame (see utils/fft_matcher.py)
+# Off until measured on the target machine: run `python -m utils.fft_matcher bench` and use its suggested area
+FFT_MATCHING_ENABLED = False
+FFT_MATCH_MIN_TEMPLATE_AREA = 4000  # template pixels; about a quarter of the shipped templates are larger
+FFT_SPECTRUM_CACHE_SIZE = 16  # template spectra kept (frame-sized, several MB each)
+
+# Adaptive timeouts learned from how long each (task, step) wait really takes
+ADAPTIVE_TIMEOUTS = True
+ADAPTIVE_TIMEOUT_PERCENTILE = 99  # percentile of observed wait times
+ADAPTIVE_TIMEOUT_FACTOR = 1.5  # learned timeout = percentile * factor
+ADAPTIVE_TIMEOUT_FLOOR = 2.0  # seconds, learned timeouts never go below this
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 20  # samples needed before the default is replaced
+ADAPTIVE_TIMEOUT_MAX_SCALE = 2.0  # learned timeout may grow up to default * scale
+LATENCY_HISTORY_SIZE = 200  # samples kept per device and step
+LATENCY_SAVE_INTERVAL = 50  # save after this many new samples
+LATENCY_FILE_PATH = "data/step_latency.json"
+
 # ==================== TASK SETTINGS ====================
 # Delays between task operations (in seconds)
 FARM_DELAY = 2.0
@@ -22,6 +75,9 @@ EXPLORE_DELAY = 3.0
 TRAIN_DELAY = 1.5
 RECRUITMENT_DELAY = 2.0
 
+# Flow definitions (see utils/flow.py)
+FLOW_DIRECTORY = "data/flows"
+
 # Task iteration limits
 MAX_TASK_ITERATIONS = 1000
 TASK_RETRY_DELAY = 2.0
@@ -182,6 +238,12 @@ LOG_FILENAME_PREFIX = "ld_tool"
 # ==================== ERROR HANDLING SETTINGS ====================
 MAX_ERROR_RETRIES = 3
 ERROR_RETRY_DELAY = 2.0
+ADB_BACKOFF_MAX = 30.0  # cap for the jittered backoff after failed device calls
+# Per-device circuit breaker around adb calls (see utils/error_handler.py)
+CIRCUIT_FAILURE_THRESHOLD = 3  # consecutive failed adb calls before the circuit opens
+CIRCUIT_RESET_TIMEOUT = 5.0  # seconds the circuit stays open before one probe call
+CIRCUIT_MAX_RESET_TIMEOUT = 120.0  # cap for the open time, which doubles on every failed probe
+ADB_SERVER_RESTART_INTERVAL = 300.0  # seconds between restarts of one adb server triggered by failing devices
 SHOW_ERROR_DIALOGS = True
 CONTINUE_ON_ERROR = True
 
@@ -191,7 +253,7 @@ FILTER_LOCALHOST_DEVICES = True
 LOCALHOST_PATTERNS = []
 
 # Device connection settings
-DEVICE_CHECK_INTERVAL = 5.0  # seconds
+DEVICE_CHECK_INTERVAL = 5.0  # seconds between `adb devices` polls when the tracking stream is down
 DEVICE_RECONNECT_ATTEMPTS = 3
 
 # ==================== STATE MANAGEMENT SETTINGS ====================
@@ -208,16 +270,67 @@ GAME_EXPLORE_CHECK_DIRECTORY = "./images/explore_check"
 GAME_ALL_ARMIES_IMAGE = "./images/AllArmies.png"
 GAME_DISCONNECTED_IMAGE = "./images/disconnected.png"
 
+# March slot indicators (images/armies/army_N.png)
+ARMY_STATUS_ROI = None  # (x, y, w, h) of the march panel, None = calibrate from the first hit
+ARMY_STATUS_ROI_MARGIN = (60, 160)  # half width/height of a calibrated region around a hit
+ARMY_STATUS_RECALIBRATE_TICKS = 100  # re-check the full frame every N reads
+
+# March schedule (see utils/march_schedule.py): army slots are only read when a march is due back
+MARCH_TRACKING = True
+MARCH_FILE_PATH = "data/march_durations.json"
+MARCH_HISTORY_SIZE = 20  # learned durations kept per device and resource
+MARCH_MIN_SAMPLES = 3  # durations needed before a march gets a due time
+MARCH_ESTIMATE_PERCENTILE = 25  # percentile of the learned durations used as the estimate
+MARCH_DUE_FACTOR = 0.95  # check slightly before the estimate so it can also shrink
+MARCH_POLL_INTERVAL = 10.0  # seconds between slot checks for overdue or not yet learned marches
+MARCH_MAX_AGE = 6 * 3600  # seconds after which a march never seen returning is forgotten
+
 # ==================== ADVANCED SETTINGS ====================
 # Performance settings
 ENABLE_PERFORMANCE_MONITORING = True
 PERFORMANCE_LOG_INTERVAL = 60  # seconds
 
+# Shared thread pools (see utils/executor.py): workers per named pool
+EXECUTOR_POOLS = {
+    "device": 8,  # one long-running worker per started device; grows when more devices start
+    "cpu": max(2, os.cpu_count() or 2),  # template matching fan-out
+    "io": 4 + len(ADB_SERVER_PORTS),  # ADB and disk side work, plus one device tracking stream per server
+}
+EXECUTOR_MAX_QUEUE = 64  # jobs waiting per pool before submissions are rejected
+PARALLEL_TEMPLATE_MATCHING = True  # match a template directory on the cpu pool, first hit wins
+CANCEL_POLL_INTERVAL = 0.5  # seconds; how often a sleeping worker re-checks for a disabled task
+
+# CPU budget (see utils/cpu_budget.py; `python -m utils.cpu_budget bench` to tune)
+OPENCV_THREADS = 1  # threads inside one cv2 call; matches already run one per worker. None = OpenCV default
+BLAS_THREADS = 1  # OpenMP/BLAS threads behind numpy, applied before numpy loads; 0 = library default
+CPU_AFFINITY = None  # cores for the whole process, e.g. "0-7"; None = all cores
+POOL_AFFINITY = {}  # pool name -> cores, e.g. {"cpu": "2-7", "io": "0-1"} (Linux only)
+
+# Fleet-wide admission limits shared by all devices (see utils/governor.py); 0 = unlimited
+GOVERNOR_CAPTURES_PER_SECOND = 10.0  # screenshots started per second across all devices
+GOVERNOR_CAPTURE_BURST = 4  # captures allowed back to back after a quiet period
+GOVERNOR_MAX_DECODES = max(1, (os.cpu_count() or 2) // 2)  # concurrent PNG decodes
+GOVERNOR_MAX_MATCHES = os.cpu_count() or 2  # concurrent template matches
+
 # Debug settings
 SAVE_SCREENSHOTS = False
 SCREENSHOT_DIRECTORY = "screenshots"
+SCREENSHOT_RING_SIZE = 5  # recent frames kept in memory per device, written on error/timeout/demand
+SCREENSHOT_MIN_DUMP_INTERVAL = 30.0  # seconds between two automatic dumps of the same device
 ENABLE_VERBOSE_LOGGING = True
 
+# Structured trace events (see utils/trace.py); match logs are formatted off the device threads
+TRACE_FILE = False  # also write every recorded event to TRACE_DIRECTORY as JSON lines
+TRACE_DIRECTORY = "traces"
+TRACE_SAMPLE_RATES = {"match.miss": 0.05, "match.probe": 0.05}  # share of events kept; unlisted events: all
+TRACE_QUEUE_SIZE = 10000  # queued events before the oldest are dropped
+TRACE_FLUSH_INTERVAL = 0.5  # seconds between writer passes
+
+# Sampling profiler (off until requested from the GUI or --profile)
+PROFILER_SAMPLE_RATE = 100  # samples per second
+PROFILER_DURATION = 30  # seconds per profiling window
+PROFILE_DIRECTORY = "profiles"
+
 # ==================== VALIDATION FUNCTIONS ====================
 def validate_config():
     """Validate configuration settings"""
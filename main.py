@@ -1,7 +1,11 @@
+import config
+from utils import cpu_budget
+# Before cv2/numpy load: their thread pools read the environment once
+cpu_budget.configure_environment()
+
 import tkinter as tk
 from tkinter import ttk, messagebox
-import threading
-import time
+import argparse
 import logging
 import traceback
 import os
@@ -9,11 +13,23 @@ from datetime import datetime
 
 import cv2
 
-import config
 from utils.HouseManager import HouseManager, load_data  
 from utils.AdbProcess import AdbProcess
-from utils.Detect import Detect
+from utils.Detect import Detect, get_location_cache_stats
 from utils.state_manager import StateManager
+from utils.profiler import SamplingProfiler, device_thread_name
+from utils.clock import system_clock
+from utils.latency_tracker import LatencyTracker
+from utils.army_status import ArmyStatusDetector
+from utils.executor import CancelToken, PoolSaturatedError, TaskCancelled, get_executor, stop_token
+from utils.adb_servers import get_adb_servers
+from utils.device_tracker import get_device_tracker
+from utils.error_handler import backoff_delay, get_device_health
+from utils.governor import get_governor
+from utils.scheduler import get_scheduler
+from utils.screenshot_archiver import get_screenshot_archiver
+from utils.trace import get_tracer
+from utils.march_schedule import get_march_schedule
 from task.train import TroopTrainer
 from task.explore import Explore
 from task.farm import Farm
@@ -81,16 +97,27 @@ class AdbApp(tk.Tk):
     def _init_components(self, adb_path):
         """Initialize core components with error handling"""
         try:
-            self.adbProcess = AdbProcess(adb_path=adb_path)
+            self.clock = system_clock
+            self.adbProcess = AdbProcess(adb_path=adb_path, clock=self.clock)
             self.home_manager = HouseManager(adb_process=self.adbProcess)
             
             # Initialize state manager
             self.state_manager = StateManager()
+            self.profiler = SamplingProfiler()
+            self.latency_tracker = LatencyTracker() if config.ADAPTIVE_TIMEOUTS else None
+            self.executor = get_executor()
+            self.scheduler = get_scheduler()
+            if len(config.ADB_SERVER_PORTS) > 1:
+                # Extra servers need their network devices connected before tracking them
+                get_adb_servers().start_all()
+            self.device_tracker = get_device_tracker()
+            if config.DEVICE_TRACKING_ENABLED:
+                self.device_tracker.start()
             
             # Initialize device-related variables
             self.device_tasks = {}
             self.current_device = None
-            self.device_threads = {}
+            self.device_workers = {}  # device -> CancelToken of its running task loop
             self.device_paused = {}
             self.farm_priority = {}
             self.current_farm_index = {}
@@ -252,6 +279,17 @@ class AdbApp(tk.Tk):
             self.reset_button = tk.Button(state_frame, text="🔄 Reset States", command=self.reset_device_states)
             self.reset_button.pack(side="left", padx=5)
 
+            # Profile button
+            profile_frame = tk.Frame(self)
+            profile_frame.pack(pady=5)
+
+            self.profile_button = tk.Button(profile_frame, text="🔥 Profile", command=self.profile_current_device)
+            self.profile_button.pack(side="left", padx=5)
+
+            # Screenshot button: writes the device's last frames (SAVE_SCREENSHOTS)
+            self.screenshot_button = tk.Button(profile_frame, text="📷 Screenshots", command=self.save_current_device_screenshots)
+            self.screenshot_button.pack(side="left", padx=5)
+
             # Log display
             self.log_text = tk.Text(self, height=config.LOG_DISPLAY_HEIGHT, width=config.LOG_DISPLAY_WIDTH)
             self.log_text.pack(pady=5, padx=10)
@@ -377,7 +415,8 @@ class AdbApp(tk.Tk):
             # Clear all device states
             self.device_paused.clear()
             self.device_tasks.clear()
-            self.device_threads.clear()
+            for device in list(self.device_workers):
+                self._stop_device_worker(device)
             self.farm_priority.clear()
             self.current_farm_index.clear()
             
@@ -407,7 +446,38 @@ class AdbApp(tk.Tk):
             debug_info += f"Button Text: {self.pause_button.cget('text')}\n"
             debug_info += f"Device Paused States: {self.device_paused}\n"
             debug_info += f"Device Tasks: {self.device_tasks}\n"
-            debug_info += f"Device Threads: {list(self.device_threads.keys())}\n"
+            debug_info += f"Device Workers: {list(self.device_workers.keys())}\n"
+            for name, m in self.executor.metrics().items():
+                debug_info += (f"Pool {name}: {m['active']}/{m['workers']} active, {m['queued']} queued, "
+                               f"peak {m['peak_active']}/{m['peak_queued']}, {m['threads_created']} threads, "
+                               f"saturated {m['saturated_seconds']}s, rejected {m['rejected']}\n")
+            for name, g in get_governor().metrics().items():
+                debug_info += (f"Governor {name}: limit {g['limit']}, {g['waiting']} waiting (peak {g['peak_waiting']}), "
+                               f"{g['waited']}/{g['acquired']} waited, p95 {g['p95_wait'] * 1000:.0f} ms, "
+                               f"max {g['max_wait'] * 1000:.0f} ms\n")
+            s = self.scheduler.metrics()
+            debug_info += (f"Scheduler: {s['devices']} devices, expensive flows {s['running']} "
+                           f"(limit {s['limit']}, peak {s['peak_running']}), waiting {s['waiting']}, "
+                           f"{s['turned_away']} turned away\n")
+            m = get_march_schedule().metrics()
+            debug_info += (f"Marches: {m['pending']} out, {m['dispatched']} sent, {m['returned']} back, "
+                           f"army checks {m['checks']} made / {m['skipped']} skipped\n")
+            if self.current_device:
+                debug_info += f"Marches of {self.current_device}: {get_march_schedule().pending(self.current_device)}\n"
+            t = get_tracer().metrics()
+            debug_info += (f"Trace: {t['emitted']} events ({t['sampled_out']} sampled out, {t['dropped']} dropped), "
+                           f"{t['queued']} queued, {t['logged']} logged, {t['written']} written to file\n")
+            a = get_screenshot_archiver().metrics()
+            if a["enabled"]:
+                debug_info += (f"Screenshots: {a['recorded']} kept, {a['duplicates']} duplicates skipped, "
+                               f"{a['dumps']} dumps ({a['written']} files), {a['rate_limited']} rate limited, "
+                               f"{a['dropped']} dropped\n")
+            for device, h in sorted(get_device_health().metrics().items()):
+                debug_info += (f"Circuit {device}: {h['state']}, {h['consecutive_failures']} failing, "
+                               f"retry in {h['retry_in']}s, {h['failures']}/{h['calls']} failed, "
+                               f"{h['rejected']} skipped, {h['trips']} trips\n")
+            for template, stats in sorted(get_location_cache_stats().items()):
+                debug_info += f"Cache {os.path.basename(template)}: {stats['hits']}/{stats['lookups']} ({stats['hit_rate']:.0%})\n"
             
             self.log_message(debug_info, "INFO")
             messagebox.showinfo("Debug Info", debug_info)
@@ -433,9 +503,8 @@ class AdbApp(tk.Tk):
                 self.pause_button.config(text="▶️ Bắt đầu")
                 self.log_message(f"Tạm dừng tasks cho device: {device}")
                 
-                # Stop task thread for this device only
-                if device in self.device_threads:
-                    del self.device_threads[device]
+                # Stop task loop for this device only
+                if self._stop_device_worker(device):
                     self.log_message(f"Đã dừng task thread cho device: {device}")
             else:
                 # Starting tasks for this device only
@@ -444,11 +513,9 @@ class AdbApp(tk.Tk):
                 
                 # Start task thread for this device only if not already running and has active tasks
                 active_tasks = [task for task, var in self.tasks.items() if var.get()]
-                if active_tasks and device not in self.device_threads:
-                    t = threading.Thread(target=self.run_device_tasks, args=(device,), daemon=True)
-                    self.device_threads[device] = t
-                    t.start()
-                    self.log_message(f"Đã khởi động task thread cho device: {device}")
+                if active_tasks and device not in self.device_workers:
+                    if self._start_device_worker(device):
+                        self.log_message(f"Đã khởi động task thread cho device: {device}")
                 elif not active_tasks:
                     self.log_message(f"Không có task nào được chọn cho device: {device}")
                     # Keep the button as "Tạm dừng" but don't start thread
@@ -547,15 +614,12 @@ class AdbApp(tk.Tk):
 
                 # Don't automatically start task thread - only start when pause button is pressed
                 # Task thread management is handled in toggle_pause method
-                if device not in self.device_threads and not self.device_paused.get(device, True):
+                if device not in self.device_workers and not self.device_paused.get(device, True):
                     self.log_message(f"Starting task thread for device: {device}")
-                    t = threading.Thread(target=self.run_device_tasks, args=(device,), daemon=True)
-                    self.device_threads[device] = t
-                    t.start()
-                elif device in self.device_threads and self.device_paused.get(device, True):
-                    # Stop task thread if device is paused
-                    if device in self.device_threads:
-                        del self.device_threads[device]
+                    self._start_device_worker(device)
+                elif device in self.device_workers and self.device_paused.get(device, True):
+                    # Stop task loop if device is paused
+                    if self._stop_device_worker(device):
                         self.log_message(f"Stopped task thread for paused device: {device}")
                     
         except Exception as e:
@@ -597,141 +661,287 @@ class AdbApp(tk.Tk):
                 return res_type
         return None
 
-    def run_device_tasks(self, device):
+    def _start_device_worker(self, device):
+        """Run the device task loop on the shared device pool"""
+        # A device loop holds its worker until the device stops: never queue one behind the others
+        self.executor.pool("device").ensure_capacity()
+
+        token = stop_token.child()
+        self.device_workers[device] = token
+        try:
+            self.executor.submit("device", self.run_device_tasks, device, token,
+                                 token=token, thread_name=device_thread_name(device))
+        except PoolSaturatedError as e:
+            del self.device_workers[device]
+            self.log_message(f"Cannot start tasks for {device}: {e}", "ERROR")
+            return False
+        return True
+
+    def _stop_device_worker(self, device):
+        """Cancel a device task loop; it exits at its next check"""
+        token = self.device_workers.pop(device, None)
+        if token is None:
+            return False
+        token.cancel()
+        return True
+
+    def run_device_tasks(self, device, token: CancelToken):
         """Run device tasks with comprehensive error handling"""
+        adb_process = None
+        img = None
         try:
             self.log_message(f"Starting task execution for device: {device}")
+            self.profiler.notify_thread_started(device_thread_name(device))
             
-            adb_process = AdbProcess(adb_path="adb/adb.exe")
+            # Every wait of this worker goes through a clock that stops once the token is cancelled
+            adb_process = AdbProcess(adb_path=self.adbProcess.adb_path, clock=self.clock, cancel_token=token)
+            clock = adb_process.clock
             detect = Detect(adb=adb_process)
+            detect.device_id = device
+            detect.latency_tracker = self.latency_tracker
             train = TroopTrainer(adb_process=adb_process, detect=detect, device=device)
             explorer = Explore(adb_process=adb_process, detect=detect)
             farm = Farm(adb_process=adb_process, detect=detect)
             built = Built(adb_process=adb_process, detect=detect)
             recruitment = Recruitment(adb_process=adb_process, detect=detect)
+            army_detector = ArmyStatusDetector(detect)
+
+            # Detect the screen resolution once; templates and coordinates are rescaled for it
+            screen_size = adb_process.get_screen_size(device)
+            if screen_size:
+                detect.set_resolution(*screen_size, device=device)
+
+            # Start on this device's own phase of the capture interval, not in step with the others
+            self.scheduler.register(device)
+            self.scheduler.wait_for_tick(device, clock)
             
-            while any(self.device_tasks.get(device, {}).values()):
+            errors_in_row = 0
+            while not token.cancelled and any(self.device_tasks.get(device, {}).values()):
                 try:   
                     if self.device_paused.get(device, True):  # Default to True (paused)
-                        time.sleep(0.5)
+                        clock.sleep(0.5)
                         continue
 
-                    # Update device references
-                    houses = load_data().get(device, {}).get("houses", [])
-                    
-                    # Capture screenshot
-                    img = adb_process.capture(device)
-                    if img is None:
-                        self.log_message(f"Failed to capture screenshot from {device}", "ERROR")
-                        time.sleep(2)
+                    if self.device_tracker.is_connected(device) is False:
+                        self.log_message(f"{device} is offline, waiting for it to reconnect", "WARNING")
+                        while self.device_tracker.is_connected(device) is False:
+                            clock.sleep(1)
+                        self.log_message(f"{device} is back online")
                         continue
+
+                    # A drop interrupts whatever the device is doing; the check above then waits for it
+                    with clock.stop_when(lambda: self.device_tracker.is_connected(device) is False):
+                        # Update device references
+                        houses = load_data().get(device, {}).get("houses", [])
                     
-                    # Check for disconnection
-                    disconnected_pos = detect.find_object_position(img, "./images/disconnected.png")
-                    if disconnected_pos:
-                        self.log_message(f"Disconnection detected on {device}, attempting to reconnect")
-                        adb_process.tap(device, 638, 471)
-                        detect.wait_until_found(device, "./images/home.png", timeout=100)
-                        time.sleep(0.5)
-                        continue
-                    # Check for login
-                    other_login = detect.find_object_position(img, "./images/other_login.png")
-                    if other_login:
-                        self.log_message(f"'Other Login' screen detected on {device}, attempting to log in")
-                        confirm = detect.wait_until_found(device, "./images/confirm.png")
-                        time.sleep(300)
-                        adb_process.tap(device, *confirm)
-                        continue
-                    # Always check
-                    pos_always = detect.find_object_directory(img, "./images/always_check")
-                    if pos_always:
-                        adb_process.tap(device, *pos_always)
-                        detect.wait_until_found(device, "./images/home.png")
-                        time.sleep(0.5)
-                        continue
-                    goback_pos = detect.find_object_position(img, "./images/goback.png")
-                    if goback_pos:
-                        adb_process.tap(device, *goback_pos)
-                        detect.wait_until_found(device, "./images/home.png")
-                        time.sleep(0.5)
-                        continue
+                        # Capture screenshot; the previous pass is over, its frame can be refilled
+                        adb_process.release_frame(device, img)
+                        img = None
+                        img = adb_process.capture(device)
+                        if img is None:
+                            self.log_message(f"Failed to capture screenshot from {device}", "ERROR")
+                            clock.sleep(adb_process.failure_delay(device))
+                            continue
+                        if screen_size is None:
+                            # wm size unavailable: trust the frame itself
+                            screen_size = (img.shape[1], img.shape[0])
+                            detect.set_resolution(*screen_size, device=device)
+                    
+                        # Check for disconnection
+                        disconnected_pos = detect.find_object_position(img, "./images/disconnected.png", device=device)
+                        if disconnected_pos:
+                            self.log_message(f"Disconnection detected on {device}, attempting to reconnect")
+                            adb_process.tap(device, *detect.screen.point(*config.GAME_DISCONNECT_BUTTON))
+                            detect.wait_until_found(device, "./images/home.png", timeout=100,
+                                                    step=("main", "reconnect_home"))
+                            clock.sleep(0.5)
+                            continue
+                        # Check for login
+                        other_login = detect.find_object_position(img, "./images/other_login.png", device=device)
+                        if other_login:
+                            self.log_message(f"'Other Login' screen detected on {device}, attempting to log in")
+                            confirm = detect.wait_until_found(device, "./images/confirm.png", step=("main", "other_login_confirm"))
+                            clock.sleep(300)
+                            adb_process.tap(device, *confirm)
+                            continue
+                        # Always check
+                        pos_always = detect.find_object_directory(img, "./images/always_check", device=device)
+                        if pos_always:
+                            adb_process.tap(device, *pos_always)
+                            detect.wait_until_found(device, "./images/home.png", step=("main", "always_check_home"))
+                            clock.sleep(0.5)
+                            continue
+                        goback_pos = detect.find_object_position(img, "./images/goback.png", device=device)
+                        if goback_pos:
+                            adb_process.tap(device, *goback_pos)
+                            detect.wait_until_found(device, "./images/home.png", step=("main", "goback_home"))
+                            clock.sleep(0.5)
+                            continue
+
+                        tasks = self.device_tasks[device]           
+                        # Each task stops within one poll interval once it is unticked
+                        # Recruitment
+                        if tasks.get("recruitment"):
+                            with clock.stop_when(lambda: self._task_disabled(device, "recruitment")):
+                                recruitment.houses = houses
+                                recruitment.device_id = device
+                                recruitment.perform_action_recruitment(img)
+
+                        # Training
+                        if tasks.get("train"):
+                            with clock.stop_when(lambda: self._task_disabled(device, "train")):
+                                train.device = device
+                                train.houses = houses
+                                train.auto_train_units(img)
+                        if tasks.get("built"):
+                            with clock.stop_when(lambda: self._task_disabled(device, "built")):
+                                built.houses = houses
+                                built.device_id = device
+                                built_check = detect.check_object_exists(img, "images/built/check_build.png", device=device)
+                                if built_check:
+                                    built.perform_action_build()
+                        # Explore / Cave
+                        if tasks.get("explore") or tasks.get("cave"):
+                            with clock.stop_when(lambda: self._task_disabled(device, "explore", "cave")):
+                                # Explorer setup
+                                explorer.houses = houses
+                                explorer.device_id = device
+                                if detect.check_object_exists_directory(img, "./images/explore_check"):
+                                    # Only a few devices explore at once; the others retry next pass
+                                    with self.scheduler.expensive_flow(device, "explore") as admitted:
+                                        if admitted:
+                                            if tasks.get("explore") and tasks.get("cave"):
+                                                explorer.perform_action_explore_and_cave_probe()
+                                            elif tasks.get("explore"):
+                                                explorer.perform_action_sequence()
+                                            elif tasks.get("cave"):
+                                                explorer.perform_action_cave_probe()
 
-                    tasks = self.device_tasks[device]           
-                    # Recruitment
-                    if tasks.get("recruitment"):
-                        recruitment.houses = houses
-                        recruitment.device_id = device
-                        recruitment.perform_action_recruitment(img)
-
-                    # Training
-                    if tasks.get("train"):
-                        train.device = device
-                        train.houses = houses
-                        train.auto_train_units(img)
-                    if tasks.get("built"):
-                        built.houses = houses
-                        built.device_id = device
-                        built_check = detect.check_object_exists(img, "images/built/check_build.png")
-                        if built_check:
-                            built.perform_action_build()
-                    # Explore / Cave
-                    if tasks.get("explore") or tasks.get("cave"):
-                        # Explorer setup
-                        explorer.houses = houses
-                        explorer.device_id = device
-                        if detect.check_object_exists_directory(img, "./images/explore_check"):
-                            if tasks.get("explore") and tasks.get("cave"):
-                                explorer.perform_action_explore_and_cave_probe()
-                            elif tasks.get("explore"):
-                                explorer.perform_action_sequence()
-                            elif tasks.get("cave"):
-                                explorer.perform_action_cave_probe()
-
-                    # Farming
-                    if tasks.get("farm"):
-                        farm_check = detect.check_object_exists_directory(img, "./images/farm/check")
-                        farm.device_id = device
-                        
-                        if farm_check is False:
-                            farm.perform_action_using_up()
-                        army_count = tasks.get("army_count")
-                        next_resource = self.get_next_farm_type(device, tasks)
-
-                        if not next_resource:
-                            pass
-                        else:
-                            army_pos_1 = detect.find_object_position(img, "./images/armies/army_1.png")
-                            army_pos_2 = detect.find_object_position(img, "./images/armies/army_2.png")
-                            army_pos_3 = detect.find_object_position(img, "./images/armies/army_3.png")
-                            army_pos_4 = detect.find_object_position(img, "./images/armies/army_4.png")
-                            if army_pos_1 is None and army_count == 1:
-                                farm.perform_action_farm(next_resource)
-                            elif army_pos_2 is None and army_count == 2:
-                                farm.perform_action_farm(next_resource)
-                            elif army_pos_3 is None and army_count == 3:
-                                farm.perform_action_farm(next_resource)
-                            elif army_pos_4 is None and army_count == 4:
-                                farm.perform_action_farm(next_resource)
-                            else:
-                                # nếu cả 2 đều có army hoặc army_count khác (>2) -> bạn có thể mở rộng logic ở đây
-                                # ví dụ: khi army_count > 2 tìm các ảnh army_3.png... (nếu cần)
-                                pass
-                    time.sleep(config.IMAGE_CAPTURE_DELAY)
+                        # Farming
+                        if tasks.get("farm"):
+                            with clock.stop_when(lambda: self._task_disabled(device, "farm")):
+                                farm_check = detect.check_object_exists_directory(img, "./images/farm/check")
+                                farm.device_id = device
+                            
+                                if farm_check is False:
+                                    farm.perform_action_using_up()
+                                army_count = tasks.get("army_count")
+                                next_resource = self.get_next_farm_type(device, tasks)
+
+                                # Only the slot for army_count matters: one match in the march panel region,
+                                # and only once the march schedule expects an army back
+                                if next_resource and farm.army_check_due(army_count):
+                                    slot_free = army_detector.is_slot_free(img, army_count)
+                                    farm.army_checked(army_count, slot_free)
+                                    if slot_free:
+                                        with self.scheduler.expensive_flow(device, "farm") as admitted:
+                                            if admitted:
+                                                farm.perform_action_farm(next_resource)
+                        errors_in_row = 0
+                        self.scheduler.wait_for_tick(device, clock)
                     
+                except TaskCancelled:
+                    if token.cancelled:
+                        break
+                    # A task was unticked or the device dropped; re-check both on the next pass
+                    self.log_message(f"Interrupted the running task on {device}")
                 except Exception as e:
                     logger.error(traceback.format_exc())
-                    time.sleep(config.ERROR_RETRY_DELAY)  # Wait before retrying
+                    get_screenshot_archiver().dump(device, f"error_{type(e).__name__}")
+                    clock.sleep(backoff_delay(errors_in_row))  # Wait longer after each error in a row
+                    errors_in_row += 1
+            self.log_message(f"All tasks stopped for device {device}")
+            if self.latency_tracker:
+                self.latency_tracker.save()
+            self._log_location_cache_stats()
+            self._release_device_worker(device, token)
+
+        except TaskCancelled:
+            # Cancelled outside a task, e.g. while waiting after an error
             self.log_message(f"All tasks stopped for device {device}")
-            del self.device_threads[device]
+            self._release_device_worker(device, token)
             
         except Exception as e:
             error_msg = f"Critical error in device task execution for {device}: {e}"
             self.log_message(error_msg, "ERROR")
             logger.error(traceback.format_exc())
             
-            # Clean up thread reference
-            if device in self.device_threads:
-                del self.device_threads[device]
+            # Clean up worker reference
+            self._release_device_worker(device, token)
+
+        finally:
+            # The frame of the last pass, still held when the loop stopped
+            if adb_process is not None:
+                adb_process.release_frame(device, img)
+
+    def _task_disabled(self, device, *names):
+        """True once none of the named tasks is ticked for the device"""
+        tasks = self.device_tasks.get(device, {})
+        return not any(tasks.get(name) for name in names)
+
+    def _release_device_worker(self, device, token):
+        """Forget a finished loop unless the device was restarted meanwhile"""
+        if self.device_workers.get(device) is token:
+            del self.device_workers[device]
+        if device not in self.device_workers:
+            self.scheduler.unregister(device)
+
+    def profile_current_device(self):
+        """Sample the current device's worker thread and write a flame graph profile"""
+        try:
+            device = self.current_device
+            if not device:
+                messagebox.showwarning("Warning", "Vui lòng chọn device trước")
+                return
+
+            thread_name = device_thread_name(device)
+            if self.profiler.is_running(thread_name):
+                self.profiler.stop(thread_name)
+                self.log_message(f"Stopping profiler for device: {device}")
+                return
+
+            if self.profiler.request(thread_name):
+                self.log_message(f"Profiling {device} for {config.PROFILER_DURATION}s -> {config.PROFILE_DIRECTORY}/")
+            else:
+                self.log_message(f"Profiler armed, will start when {device} tasks start")
+
+        except Exception as e:
+            error_msg = f"Failed to start profiler: {e}"
+            self.log_message(error_msg, "ERROR")
+            logger.error(traceback.format_exc())
+
+    def save_current_device_screenshots(self):
+        """Write the current device's recent frames to SCREENSHOT_DIRECTORY"""
+        try:
+            device = self.current_device
+            if not device:
+                messagebox.showwarning("Warning", "Vui lòng chọn device trước")
+                return
+            archiver = get_screenshot_archiver()
+            if not archiver.enabled:
+                self.log_message("Screenshots are disabled (config.SAVE_SCREENSHOTS)", "WARNING")
+                return
+
+            count = archiver.dump(device, "manual", force=True)
+            if count:
+                self.log_message(f"Saving {count} screenshots of {device} -> {config.SCREENSHOT_DIRECTORY}/")
+            else:
+                self.log_message(f"No screenshots of {device} to save yet", "WARNING")
+
+        except Exception as e:
+            error_msg = f"Failed to save screenshots: {e}"
+            self.log_message(error_msg, "ERROR")
+            logger.error(traceback.format_exc())
+
+    def _log_location_cache_stats(self):
+        """Log how often the last-hit location cache avoided a full-frame match"""
+        stats = get_location_cache_stats()
+        lookups = sum(s["lookups"] for s in stats.values())
+        hits = sum(s["hits"] for s in stats.values())
+        if lookups:
+            logger.info(f"Location cache: {hits}/{lookups} lookups served near the last hit ({hits / lookups:.0%})")
+        for template, s in sorted(stats.items(), key=lambda item: -item[1]["lookups"]):
+            logger.info(f"  {template}: {s['hits']}/{s['lookups']} ({s['hit_rate']:.0%})")
 
     def show_state_info(self):
         """Show information about saved states"""
@@ -803,9 +1013,20 @@ class AdbApp(tk.Tk):
             logger.error(traceback.format_exc())
             messagebox.showerror("Error", error_msg)
 
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description=config.WINDOW_TITLE)
+    parser.add_argument("--profile", metavar="DEVICE",
+                        help="sample the worker thread of DEVICE and write a collapsed-stack profile")
+    parser.add_argument("--profile-seconds", type=float, default=config.PROFILER_DURATION,
+                        help="length of the profiling window in seconds")
+    return parser.parse_args()
+
 # ---- Chạy ứng dụng GUI ----
 if __name__ == "__main__":
     try:
+        args = parse_args()
+
         # Validate configuration first
         config_errors = config.validate_config()
         if config_errors:
@@ -817,10 +1038,15 @@ if __name__ == "__main__":
         
         logger.info("Starting Rise of Kingdoms Tool...")
         logger.info("Configuration loaded successfully")
+        cpu_budget.apply_cpu_budget()
         
         app = AdbApp(adb_path=config.ADB_PATH)
+        if args.profile:
+            app.profiler.request(device_thread_name(args.profile), args.profile_seconds)
         logger.info("Application started successfully")
         app.mainloop()
+        # Wake every device worker so none keeps capturing while the process exits
+        stop_token.cancel()
         
     except Exception as e:
         logger.error(f"Failed to start application: {e}")
@@ -1,15 +1,7 @@
-import time
-
 from utils.AdbProcess import AdbProcess
 from utils.Detect import Detect
-
-ACTION_IMAGES = [
-    "./images/dotham_1.png",
-    "./images/dotham_2.png",
-    "./images/dotham_3.png",
-    "./images/send.png",
-    "./images/goback.png"
-]
+from utils.clock import Clock
+from utils.flow import FlowEngine
 
 ACTION_IMAGES_CAVE_EXPLORE = [
     "./images/dotham_2.png",
@@ -25,16 +17,19 @@ ACTION_IMAGES_CAVE_PROBE = [
 ]
 
 class Explore:
-    def __init__(self, adb_process: AdbProcess, detect: Detect, device_id=None, houses=None):
+    def __init__(self, adb_process: AdbProcess, detect: Detect, device_id=None, houses=None, clock: Clock = None):
         """
         :param adb_process: Instance of AdbProcess to interact with the device.
         :param device_id: ID of the device to perform actions on.
         :param detect: Instance of Detect to find objects on the screen.
+        :param clock: Clock used for sleeps, defaults to the one of detect.
         """
         self.detect = detect
+        self.clock = clock or detect.clock
         self.adb_process = adb_process
         self.device_id = device_id
         self.houses = houses or []
+        self.flow_engine = FlowEngine(adb_process, detect, clock=self.clock)
 
     def _tap_by_template_list(self, image_list: list):
         """Dò tìm và tap theo danh sách ảnh template."""
@@ -42,7 +37,7 @@ class Explore:
             pos = self.detect.wait_until_found(self.device_id, image_path)
             if pos:
                 self.adb_process.tap(self.device_id, *pos)
-                time.sleep(0.3)
+                self.clock.sleep(0.3)
             else:
                 return
 
@@ -54,9 +49,9 @@ class Explore:
         else:
             print("❌ Không tìm thấy tọa độ Trinh sát, không thể dò mây.")
             return
-        time.sleep(0.5)
-        self._tap_by_template_list(ACTION_IMAGES)
-        time.sleep(5)
+        self.clock.sleep(0.5)
+        self.flow_engine.run("explore", self.device_id)
+        self.clock.sleep(5)
 
     def perform_action_cave_probe(self):
         coord = next((h for h in self.houses if h["name"] == "Trinh sát"), None)
@@ -66,25 +61,12 @@ class Explore:
         else:
             print("❌ Không tìm thấy tọa độ Trinh sát, không thể dò mây.")
             return
-        time.sleep(0.5)
+        self.clock.sleep(0.5)
 
-        cave_probe_pos = self.detect.wait_until_found(self.device_id, "./images/dotham_1.png")
-        if cave_probe_pos:
-            self.adb_process.tap(self.device_id, *cave_probe_pos)
-        else:
-            print("❌ Không tìm thấy dotham_1.png")
+        # dotham_1 -> 2 tọa độ cố định -> cave_probe_4 -> send -> goback
+        if not self.flow_engine.run("cave_probe", self.device_id):
             return
-
-        time.sleep(0.85)
-        # Tap vào 2 tọa độ cố định (nếu cần, bạn có thể tìm template thay vì hardcode)
-        self.adb_process.tap(self.device_id, 750, 212)  # CAVE_PROBE 2
-        time.sleep(0.85)
-        self.adb_process.tap(self.device_id, 993, 605)  # CAVE_PROBE 3
-        time.sleep(0.85)
-
-        # Thực hiện các bước còn lại
-        self._tap_by_template_list(ACTION_IMAGES_CAVE_PROBE)
-        time.sleep(5)
+        self.clock.sleep(5)
 
     def perform_action_explore_and_cave_probe(self):
         coord = next((h for h in self.houses if h["name"] == "Trinh sát"), None)
@@ -94,7 +76,7 @@ class Explore:
         else:
             print("❌ Không tìm thấy tọa độ Trinh sát, không thể dò mây.")
             return
-        time.sleep(0.5)
+        self.clock.sleep(0.5)
 
         cave_probe_pos = self.detect.wait_until_found(self.device_id, "./images/dotham_1.png")
         if cave_probe_pos:
@@ -102,16 +84,22 @@ class Explore:
         else:
             print("❌ Không tìm thấy dotham_1.png")
             return
-        time.sleep(0.8)
-        cave_explore_pos = self.detect.wait_until_found(self.device_id, "./images/cave_explore.png",timeout=5, threshold=0.98)
+        self.clock.sleep(0.8)
+        cave_explore_pos = self.detect.wait_until_found(self.device_id, "./images/cave_explore.png",timeout=5, threshold=0.98,
+                                                     step=("explore", "cave_explore"))
         img = self.adb_process.capture(self.device_id)
-        cave_d2_pos = self.detect.find_object_position(img, "./images/d2.png", threshold=0.99)
+        try:
+            cave_d2_pos = self.detect.find_object_position(img, "./images/d2.png", threshold=0.99,
+                                                           device=self.device_id)
+        finally:
+            self.adb_process.release_frame(self.device_id, img)
         if cave_explore_pos and cave_d2_pos == None:
             # Tap vào 2 tọa độ cố định (nếu cần, bạn có thể tìm template thay vì hardcode)
-            self.adb_process.tap(self.device_id, 750, 212)  # CAVE_PROBE 2
-            time.sleep(0.85)
-            self.adb_process.tap(self.device_id, 993, 605)  # CAVE_PROBE 3
-            time.sleep(0.85)
+            self.adb_process.run_input_script(self.device_id, [
+                ("tap", *self.detect.screen.point(750, 212)),  # CAVE_PROBE 2
+                ("sleep", 1.15),
+                ("tap", *self.detect.screen.point(993, 605)),  # CAVE_PROBE 3
+            ], settle=1.15)
             self._tap_by_template_list(ACTION_IMAGES_CAVE_PROBE)
         else:
             self._tap_by_template_list(ACTION_IMAGES_CAVE_EXPLORE)
@@ -1,129 +1,41 @@
-import threading
-import time
 from utils.AdbProcess import AdbProcess
 from utils.Detect import Detect
+from utils.clock import Clock
+from utils.flow import FlowEngine
+from utils.march_schedule import MarchSchedule, get_march_schedule
 
 class Farm:
-    def __init__(self, adb_process: AdbProcess, detect: Detect, device_id=None):
+    def __init__(self, adb_process: AdbProcess, detect: Detect, device_id=None, clock: Clock = None,
+                 marches: MarchSchedule = None):
         self.adb_process = adb_process
         self.detect = detect
         self.device_id = device_id
-    
+        self.clock = clock or detect.clock
+        self.marches = marches or get_march_schedule()
+        self.flow_engine = FlowEngine(adb_process, detect, clock=self.clock)
+
+    def perform_action_using_up(self, img=None):
+        """Use a gathering speed-up item (flow: data/flows/farm_using_up.json)."""
+        return self.flow_engine.run("farm_using_up", self.device_id, frame=img)
+
+    def perform_action_farm(self, resource="food", img=None):
         """
-        Perform search farm action by detecting and tapping on the search icon.
-        This method is similar to perform_farm_action but specifically for searching farms.
+        Perform search farm action by detecting and tapping on specific icons
+        (flow: data/flows/farm_gather.json).
         Parameters:
         resource (str): The type of resource to search for, e.g., "food", "wood", "stone", gold.
+        img: Optional screenshot that is still current, used for the first step.
+        A march that was sent is added to the march schedule.
         """
-    def perform_action_using_up(self):
-        image_paths = {
-            "bag": "images/bag.png",
-            "up": "images/farm/up.png",
-            "farm_8": "images/farm/farm_8.png",
-            "farm_24": "images/farm/farm_24.png",
-            "using": "images/farm/using.png",
-            "close": "images/always_check/close.png"
-        }
-        def tap_wait(image_key):
-            coords = self.detect.wait_until_found(self.device_id, image_paths[image_key])
-            if not coords:
-                return None
-            self.adb_process.tap(self.device_id, *coords)
-            return True
-        for key in ["bag", "up"]:
-            if tap_wait(key) is None:
-                return
-        stop_event = threading.Event()
-        def find_8():
-            if self.detect.wait_until_found(self.device_id, image_paths["farm_8"]):
-                if not stop_event.is_set():
-                    stop_event.set()
-                    for key in ["farm_8", "using", "close"]:
-                        if tap_wait(key) is None:
-                            return
-
-        def find_24():
-            if self.detect.wait_until_found(self.device_id, image_paths["farm_24"]):
-                if not stop_event.is_set():
-                    stop_event.set()
-                    for key in ["farm_24", "using", "close"]:
-                        if tap_wait(key) is None:
-                            return
-
-        t1 = threading.Thread(target=find_8)
-        t2 = threading.Thread(target=find_24)
-
-        t1.start()
-        t2.start()
-
-        t1.join()
-        t2.join()        
-        
-        
-    def perform_action_farm(self, resource="food", delay=0.8):
-        """Perform search farm action by detecting and tapping on specific icons."""
-        
-        image_paths = {
-            "home": "images/home.png",
-            "search": "images/search.png",
-            "resource": f"images/farm/{resource}.png",
-            "searching": "images/searching.png",
-            "gather_btn": "images/farm/GatherButton.png",
-            "matching": "images/matching.png",
-            "resource_gather_btn": "images/resource_gather_button.png",
-            "matched": "images/matched.png",
-            "goback": "images/goback.png"
-        }
-
-        def tap_wait(image_key):
-            coords = self.detect.wait_until_found(self.device_id, image_paths[image_key])
-            if not coords:
-                return None
-            if image_key == "matching":
-                self.adb_process.tap(self.device_id, 640, 360)
-            else:
-                self.adb_process.tap(self.device_id, *coords)
-            time.sleep(delay)
-            return True
-
-        # --- các bước ban đầu ---
-        for key in ["home", "search", "resource", "searching", "gather_btn"]:
-            if tap_wait(key) is None:
-                return
-
-        # --- chạy matching và resource_gather_btn song song ---
-        stop_event = threading.Event()
-
-        def find_matching():
-            if self.detect.wait_until_found(self.device_id, image_paths["matching"]):
-                if not stop_event.is_set():
-                    stop_event.set()
-                    self.adb_process.tap(self.device_id, 640, 360)
-                    time.sleep(delay)
-                    tap_wait("goback")
-                    self.detect.wait_until_found(self.device_id, "images/home.png")
-
-        def find_gather_btn():
-            if self.detect.wait_until_found(self.device_id, image_paths["resource_gather_btn"]):
-                if not stop_event.is_set():
-                    stop_event.set()
-                    tap_wait("resource_gather_btn")
-                    coords = self.detect.wait_until_found(self.device_id, "./images/farm/rm_farm.png")
-                    if coords is not None:
-                        self.adb_process.tap(self.device_id, *coords)
-                    if tap_wait("matched") is not None:
-                        tap_wait("goback")
-                        self.detect.wait_until_found(self.device_id, "images/home.png")
-
-        t1 = threading.Thread(target=find_matching)
-        t2 = threading.Thread(target=find_gather_btn)
-
-        t1.start()
-        t2.start()
-
-        t1.join()
-        t2.join()
-
-
-
-
+        result = self.flow_engine.run("farm_gather", self.device_id, params={"resource": resource}, frame=img)
+        if result:
+            self.marches.dispatched(self.device_id, resource)
+        return result
+
+    def army_check_due(self, army_count):
+        """True if a march may be back, so the army slots are worth reading on this tick"""
+        return self.marches.check_due(self.device_id, army_count)
+
+    def army_checked(self, army_count, slot_free):
+        """Report the slot check that army_check_due() asked for"""
+        self.marches.observed(self.device_id, army_count, slot_free)
@@ -1,33 +1,34 @@
-import time
 import cv2
 from utils.AdbProcess import AdbProcess
 from utils.Detect import Detect
+from utils.clock import Clock
 
 
 class TroopTrainer:
-    def __init__(self, adb_process: AdbProcess, detect: Detect, device, houses=None):
+    def __init__(self, adb_process: AdbProcess, detect: Detect, device, houses=None, clock: Clock = None):
         self.adbProcess = adb_process
         self.detect = detect
+        self.clock = clock or detect.clock
         self.device = device
         self.houses = houses or []
 
     def _tap_twice(self, pos: tuple):
-        self.adbProcess.tap(self.device, *pos)
-        time.sleep(0.8)
-        self.adbProcess.tap(self.device, *pos)
+        # One adb round-trip; same 1.1s spacing as two tap() calls with a 0.8s pause
+        self.adbProcess.run_input_script(self.device, [("tap", *pos), ("sleep", 1.1), ("tap", *pos)])
 
     def _tap_template_and_train(self, template_path: str, train_xe= False):
-        pos_tap = self.detect.wait_until_found(self.device, template=template_path, timeout=10)
+        pos_tap = self.detect.wait_until_found(self.device, template=template_path, timeout=10,
+                                              step=("train", template_path.rsplit("/", 1)[-1]))
         if pos_tap:
             self.adbProcess.tap(self.device, *pos_tap)
-        time.sleep(0.5)
+        self.clock.sleep(0.5)
         if train_xe:
             xe_pos = self.detect.wait_until_found(self.device, "./images/t1_train.png")
             if xe_pos:
                 self.adbProcess.tap(self.device, *xe_pos)
-        time.sleep(0.7)
-        self.adbProcess.tap(self.device, 985, 592)  # Tap on "Train" button
-        time.sleep(0.5)
+        self.clock.sleep(0.7)
+        self.adbProcess.tap(self.device, *self.detect.screen.point(985, 592))  # Tap on "Train" button
+        self.clock.sleep(0.5)
 
     def _train_unit(self, house_name: str, template_path: str, label: str):
         coords = next((h for h in self.houses if h["name"] == house_name), None)
@@ -82,4 +83,4 @@ class TroopTrainer:
             if existed:
                 print(f"Phát hiện {unit['name']} — bắt đầu huấn luyện.")
                 unit["train_func"]()
-                time.sleep(1)
\ No newline at end of file
+                self.clock.sleep(1)
\ No newline at end of file
@@ -1,24 +1,61 @@
 import subprocess
+import threading
 import cv2
 import numpy as np
 import logging
 import traceback
-import time
+
+import config
+from utils.adb_servers import AdbServers, get_adb_servers
+from utils.clock import CancellableClock, Clock, system_clock
+from utils.executor import CancelToken, PoolSaturatedError, get_executor
+from utils.frame_pool import FramePool
+from utils.governor import get_governor
+from utils.screenshot_archiver import get_screenshot_archiver
+from utils.device_tracker import get_device_tracker
+from utils.error_handler import ErrorHandler, backoff_delay, get_device_health
 
 logger = logging.getLogger(__name__)
 
 class AdbProcess:
-    def __init__(self, adb_path="adb/adb.exe"):
-        self.adb_path = adb_path
+    # adb binaries already verified in this process; every device thread builds its own AdbProcess
+    _verified_paths = set()
+    _verified_lock = threading.Lock()
+
+    def __init__(self, adb_path=None, clock: Clock = None, cancel_token: CancelToken = None,
+                 servers: AdbServers = None):
+        self.adb_path = adb_path or config.ADB_PATH
+        # Every device command goes through the adb server owning the device
+        if servers is None:
+            servers = get_adb_servers() if self.adb_path == config.ADB_PATH else AdbServers(self.adb_path)
+        self.servers = servers
+        self.health = get_device_health()
+        self.governor = get_governor()
+        self.archiver = get_screenshot_archiver()
+        self._frame_pools = {}  # device -> FramePool of its raw captures
+        self._frame_listeners = []
+        self._png_devices = set()  # devices whose raw screencap format is not supported
+        self.error_handler = ErrorHandler()
+        self.clock = clock or system_clock
+        # Server restarts are shared by every device on the server: never cut them half way
+        self._uncancellable_clock = self.clock
+        if cancel_token is not None:
+            # Detect and the tasks take this clock, so the token reaches every wait
+            self.clock = CancellableClock(self.clock, cancel_token)
         self._test_adb_connection()
 
     def _test_adb_connection(self):
-        """Test if ADB is accessible and working"""
+        """Test if ADB is accessible and working (once per adb binary)"""
+        with AdbProcess._verified_lock:
+            if self.adb_path in AdbProcess._verified_paths:
+                return
         try:
             result = subprocess.run([self.adb_path, "version"], 
                                   capture_output=True, text=True, timeout=10)
             if result.returncode == 0:
                 logger.info(f"ADB initialized successfully: {result.stdout.strip()}")
+                with AdbProcess._verified_lock:
+                    AdbProcess._verified_paths.add(self.adb_path)
             else:
                 logger.error(f"ADB version check failed: {result.stderr}")
         except FileNotFoundError:
@@ -31,38 +68,87 @@ class AdbProcess:
             logger.error(f"Failed to test ADB connection: {e}")
             raise
 
+    def _run_device_command(self, device_id, operation, *args, timeout=None, text=False):
+        """
+        Run one adb command for a device through its circuit breaker.
+        Returns the CompletedProcess, or None if the call failed or the circuit is open
+        (an open circuit returns at once, without spawning adb).
+        """
+        breaker = self.health.breaker(device_id)
+        if not breaker.allow():
+            return None
+        try:
+            result = subprocess.run(self.servers.command(device_id, *args), capture_output=True, text=text,
+                                    timeout=timeout or config.ADB_TIMEOUT)
+        except (subprocess.TimeoutExpired, OSError) as e:
+            self._record_failure(device_id, operation, e)
+            return None
+        except BaseException:
+            breaker.cancel_probe()  # cancelled: no verdict, the next call may probe again
+            raise
+        if result.returncode != 0:
+            stderr = result.stderr if text else result.stderr.decode("utf-8", "replace")
+            self._record_failure(device_id, operation, RuntimeError(stderr.strip() or f"exit code {result.returncode}"))
+            return None
+        breaker.record_success()
+        return result
+
+    def _record_failure(self, device_id, operation, error):
+        breaker = self.health.breaker(device_id)
+        if not breaker.record_failure():
+            logger.debug(f"{operation} failed on {device_id}: {error}")
+            return
+        logger.warning(f"{operation} keeps failing on {device_id} ({error}), "
+                       f"pausing its adb calls for {breaker.retry_in():.1f}s")
+        if get_device_tracker().is_known(device_id) is False:
+            return  # unplugged or closed: nothing to recover, the tracker reports its return
+        try:
+            # Recover off the device thread; the open circuit keeps callers away meanwhile
+            get_executor().submit("io", self.error_handler.handle_device_error, device_id, error, operation, self,
+                                  thread_name=f"adb-recovery-{device_id}")
+        except PoolSaturatedError as e:
+            logger.warning(f"Skipping recovery of {device_id}: {e}")
+
+    def failure_delay(self, device_id):
+        """Seconds a device loop should wait after a failed call: until the next probe, else a jittered backoff"""
+        breaker = self.health.breaker(device_id)
+        return breaker.retry_in() or backoff_delay(breaker.failures - 1)
+
     def tap(self, device_id, x, y):
         """Tap on device screen"""
-        try:
-            command = [self.adb_path, "-s", device_id, "shell", "input", "tap", str(x), str(y)]
-            subprocess.run(command, capture_output=True)
-            time.sleep(0.3)
-        except:
-            pass
+        self.clock.check_cancelled()
+        if self._run_device_command(device_id, "tap", "shell", "input", "tap", str(x), str(y)) is not None:
+            self.clock.sleep(0.3)
 
 
     def get_connected_devices(self):
         """Get list of connected devices with error handling and logging"""
+        tracker = get_device_tracker()
+        if tracker.ready:
+            # The tracker's table is current, no need to list devices again
+            return tracker.connected_devices()
         try:
             logger.debug("Getting connected devices...")
-            
-            result = subprocess.run([self.adb_path, "devices"], 
-                                  capture_output=True, text=True, timeout=15)
-            
-            if result.returncode != 0:
-                error_msg = f"Failed to get devices list: {result.stderr}"
-                logger.error(error_msg)
-                return []
-            
-            lines = result.stdout.strip().splitlines()[1:]  # Skip header line
             devices = []
-            
-            for line in lines:
-                if "device" in line and not line.strip().startswith("*"):
-                    device_id = line.split()[0]
-                    devices.append(device_id)
-                    logger.debug(f"Found device: {device_id}")
-            
+
+            # Emulators are listed by every server, network devices only by their owner
+            for port in self.servers.ports:
+                result = subprocess.run(self.servers.server_command(port, "devices"),
+                                      capture_output=True, text=True, timeout=15)
+
+                if result.returncode != 0:
+                    error_msg = f"Failed to get devices list from adb server {port}: {result.stderr}"
+                    logger.error(error_msg)
+                    continue
+
+                lines = result.stdout.strip().splitlines()[1:]  # Skip header line
+                for line in lines:
+                    if "device" in line and not line.strip().startswith("*"):
+                        device_id = line.split()[0]
+                        if device_id not in devices:
+                            devices.append(device_id)
+                            logger.debug(f"Found device: {device_id}")
+
             logger.info(f"Found {len(devices)} connected device(s)")
             return devices
             
@@ -81,21 +167,186 @@ class AdbProcess:
             return []
 
     def capture(self, device_id):
-        """Capture screenshot from device and return as OpenCV image"""
+        """
+        Capture screenshot from device and return as OpenCV image.
+        Raw captures come from the device's frame pool; hand them back with release_frame().
+        """
+        self.clock.check_cancelled()
+        self.governor.admit_capture(device_id, self.clock)
+        frame = None
+        if config.CAPTURE_FORMAT == "raw" and device_id not in self._png_devices:
+            frame = self._capture_raw(device_id)
+        if frame is None and (config.CAPTURE_FORMAT != "raw" or device_id in self._png_devices):
+            frame = self._capture_png(device_id)
+        if frame is not None:
+            self.archiver.record(device_id, frame)
+        return frame
+
+    def _capture_png(self, device_id):
+        result = self._run_device_command(device_id, "capture", "exec-out", "screencap", "-p")
+        if result is None or not result.stdout:
+            return None
         try:
-            command = [self.adb_path, "-s", device_id, "exec-out", "screencap", "-p"]
-            result = subprocess.run(command, capture_output=True)
+            with self.governor.decode(device_id, self.clock):
+                return cv2.imdecode(np.frombuffer(result.stdout, np.uint8), cv2.IMREAD_COLOR)
+        except Exception:
+            return None
 
-            if result.returncode != 0 or not result.stdout:
-                return None
+    def _capture_raw(self, device_id):
+        """Uncompressed screencap read straight into pooled buffers (see utils/frame_pool.py)"""
+        breaker = self.health.breaker(device_id)
+        if not breaker.allow():
+            return None
+        try:
+            return self._read_raw_capture(device_id, breaker)
+        except BaseException:
+            breaker.cancel_probe()  # cancelled (e.g. waiting for a decode slot): no verdict
+            raise
 
-            return cv2.imdecode(np.frombuffer(result.stdout, np.uint8), cv2.IMREAD_COLOR)
-        except:
+    def _read_raw_capture(self, device_id, breaker):
+        pool = self.frame_pool(device_id)
+        try:
+            process = subprocess.Popen(self.servers.command(device_id, "exec-out", "screencap"),
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            self._record_failure(device_id, "capture", e)
             return None
 
+        # A hung adb is killed after ADB_TIMEOUT, which ends the read
+        watchdog = threading.Timer(config.ADB_TIMEOUT, process.kill)
+        watchdog.start()
+        frame, unsupported = None, None
+        try:
+            with pool.read_raw(process.stdout) as read:
+                if read is not None:
+                    with self.governor.decode(device_id, self.clock):
+                        frame = pool.to_bgr(*read)
+                    if frame is None:
+                        unsupported = read[1]
+            stderr = b"" if unsupported is not None else process.stderr.read()
+        finally:
+            watchdog.cancel()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+        if unsupported is not None:
+            logger.warning(f"Raw screencap format {unsupported} of {device_id} is not supported, using PNG")
+            self._png_devices.add(device_id)
+            breaker.record_success()
+            return None
+        if frame is None:
+            message = stderr.decode("utf-8", "replace").strip()
+            self._record_failure(device_id, "capture",
+                                 RuntimeError(message or f"short raw screencap (exit code {process.returncode})"))
+            return None
+        breaker.record_success()
+        return frame
+
+    def frame_pool(self, device_id) -> FramePool:
+        pool = self._frame_pools.get(device_id)
+        if pool is None:
+            pool = self._frame_pools.setdefault(device_id, FramePool())
+            pool.add_release_listener(self._frame_released)
+        return pool
+
+    def release_frame(self, device_id, frame):
+        """Give a captured frame back for reuse; call once nothing uses it any more"""
+        pool = self._frame_pools.get(device_id)
+        if pool is not None:
+            pool.release(frame)
+
+    def add_frame_release_listener(self, listener):
+        """listener(frame) runs before a released frame can be refilled (caches keyed by frame identity)"""
+        self._frame_listeners.append(listener)
+
+    def _frame_released(self, frame):
+        for listener in self._frame_listeners:
+            listener(frame)
+
+    @staticmethod
+    def build_input_script(actions):
+        """
+        Turn a gesture group into one device-side shell script.
+        Actions: ("tap", x, y), ("swipe", x1, y1, x2, y2[, ms]), ("long_press", x, y[, ms])
+        and ("sleep", seconds). Returns (script, seconds the script takes at least).
+        """
+        commands = []
+        duration = 0.0
+        for action in actions:
+            kind, args = action[0], list(action[1:])
+            if kind != "sleep":
+                args = [int(round(a)) for a in args]
+            if kind == "tap" and len(args) == 2:
+                commands.append(f"input tap {args[0]} {args[1]}")
+            elif kind == "swipe" and len(args) in (4, 5):
+                ms = args[4] if len(args) == 5 else 300
+                commands.append(f"input swipe {args[0]} {args[1]} {args[2]} {args[3]} {ms}")
+                duration += ms / 1000.0
+            elif kind == "long_press" and len(args) in (2, 3):
+                # A long press is a swipe that does not move
+                ms = args[2] if len(args) == 3 else 800
+                commands.append(f"input swipe {args[0]} {args[1]} {args[0]} {args[1]} {ms}")
+                duration += ms / 1000.0
+            elif kind == "sleep" and len(args) == 1:
+                if args[0] > 0:
+                    commands.append(f"sleep {args[0]:g}")
+                    duration += args[0]
+            else:
+                raise ValueError(f"Unknown input action: {action}")
+        return "; ".join(commands), duration
+
+    def run_input_script(self, device_id, actions, settle=0.3):
+        """
+        Run taps, swipes, long presses and waits in a single adb round-trip.
+        Returns True once the device has executed the whole script; waits inside the
+        script run on the device and cannot be cancelled half way.
+        :param settle: seconds to sleep afterwards, like tap() does after one tap.
+        """
+        script, duration = self.build_input_script(actions)
+        if not script:
+            return True
+        self.clock.check_cancelled()
+        result = self._run_device_command(device_id, "input script", "shell", script, text=True,
+                                          timeout=duration + config.ADB_TIMEOUT)
+        if result is None:
+            logger.warning(f"Input script failed on {device_id}")
+            return False
+        self.clock.sleep(settle)
+        return True
+
+
+    def get_screen_size(self, device_id):
+        """Get (width, height) of the device screen in landscape orientation, None on failure"""
+        try:
+            result = self._run_device_command(device_id, "wm size", "shell", "wm", "size", text=True, timeout=10)
+            if result is None:
+                logger.warning(f"wm size failed on {device_id}")
+                return None
+
+            # "Physical size: 1280x720" optionally followed by "Override size: ..."
+            sizes = {}
+            for line in result.stdout.splitlines():
+                if ":" in line and "x" in line:
+                    kind, value = line.split(":", 1)
+                    width, height = value.strip().split("x")
+                    sizes[kind.strip().lower()] = (int(width), int(height))
+            size = sizes.get("override size") or sizes.get("physical size")
+            if size is None:
+                return None
+            # The game runs in landscape, wm reports the natural orientation
+            return max(size), min(size)
+        except Exception as e:
+            logger.error(f"Error reading screen size of {device_id}: {e}")
+            return None
 
     def is_device_connected(self, device_id):
         """Check if a specific device is still connected"""
+        connected = get_device_tracker().is_connected(device_id)
+        if connected is not None:
+            return connected
         try:
             devices = self.get_connected_devices()
             return device_id in devices
@@ -103,29 +354,33 @@ class AdbProcess:
             logger.error(f"Error checking device connection for {device_id}: {e}")
             return False
 
-    def restart_adb_server(self):
-        """Restart ADB server to resolve connection issues"""
+    def reconnect_device(self, device_id):
+        """Reconnect one device: `adb connect` for network devices, `adb reconnect` for the others"""
         try:
-            logger.info("Restarting ADB server...")
-            
-            # Kill ADB server
-            subprocess.run([self.adb_path, "kill-server"], 
-                         capture_output=True, timeout=10)
-            
-            # Wait a moment
-            time.sleep(2)
-            
-            # Start ADB server
-            subprocess.run([self.adb_path, "start-server"], 
-                         capture_output=True, timeout=10)
-            
-            # Wait for server to be ready
-            time.sleep(3)
-            
-            logger.info("ADB server restarted successfully")
-            return True
-            
+            port = self.servers.port_for(device_id)
+            if ":" in device_id:
+                command = self.servers.server_command(port, "connect", device_id)
+            else:
+                command = self.servers.command(device_id, "reconnect")
+            result = subprocess.run(command, capture_output=True, text=True, timeout=config.ADB_TIMEOUT)
+            logger.info(f"Reconnect {device_id}: {(result.stdout or result.stderr).strip()}")
+            return result.returncode == 0
         except Exception as e:
-            error_msg = f"Failed to restart ADB server: {e}"
-            logger.error(error_msg)
-            return False
\ No newline at end of file
+            logger.error(f"Failed to reconnect {device_id}: {e}")
+            return False
+
+    def restart_adb_server(self, device_id=None):
+        """
+        Restart ADB server to resolve connection issues.
+        With a device only the server owning it is restarted, so devices on the
+        other servers keep running, and at most once per ADB_SERVER_RESTART_INTERVAL
+        (every device on that server drops while it restarts); without one every
+        server is restarted right away.
+        """
+        if device_id is not None:
+            port = self.servers.port_for(device_id)
+            return self.servers.restart(port, [device_id], clock=self._uncancellable_clock)
+        restarted = True
+        for port in self.servers.ports:
+            restarted = self.servers.restart(port, clock=self._uncancellable_clock, force=True) and restarted
+        return restarted
@@ -3,58 +3,239 @@ import numpy as np
 import logging
 import traceback
 import os
+import threading
 import time
+from concurrent.futures import as_completed
+import config
 from utils import AdbProcess
+from utils.clock import Clock
+from utils.template_store import get_template_store, is_template_file
+from utils.probe import get_probe_set
+from utils.fft_matcher import FFTMatcher
+from utils.executor import CancelToken, PoolSaturatedError, get_executor
+from utils.governor import get_governor
+from utils.screenshot_archiver import get_screenshot_archiver
+from utils.trace import get_tracer
+from utils.resolution import ScreenProfile, base_profile, set_device_resolution
 
 logger = logging.getLogger(__name__)
 
+# Match results are trace events; their log lines are formatted on the trace writer thread
+tracer = get_tracer()
+tracer.log_format("match.found", logger, logging.INFO,
+                  lambda e: f"Found {os.path.basename(e['template'])}: conf={e['confidence']:.3f}, time={e['seconds']:.4f}s")
+tracer.log_format("match.exists", logger, logging.INFO,
+                  "Object found in template {template} with confidence {confidence:.3f}, time={seconds:.4f}s")
+tracer.log_format("match.miss", logger, logging.DEBUG,
+                  "No match found for template {template}. Best match: {confidence:.3f}, threshold: {threshold}")
+tracer.log_format("match.probe", logger, logging.DEBUG,
+                  lambda e: f"Probe for {e['template']}: {'present' if e['verdict'] else 'absent'}")
+
+# Last match position (top-left) and window misses since, per (device, template); per-template cache counters.
+# Every device thread reads and writes both, so they share one lock.
+_last_hits = {}
+_location_stats = {}
+_location_lock = threading.Lock()
+
+
+def get_location_cache_stats():
+    """
+    Tỉ lệ trúng của bộ nhớ vị trí cho từng mẫu.
+    :return: {template: {"lookups", "hits", "hit_rate"}}; hits là số lần không cần so khớp toàn khung hình.
+    """
+    with _location_lock:
+        return {
+            template: {
+                "lookups": stats["lookups"],
+                "hits": stats["hits"],
+                "hit_rate": stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0,
+            }
+            for template, stats in _location_stats.items()
+        }
+
+
+def _last_hit(key):
+    with _location_lock:
+        entry = _last_hits.get(key)
+    return entry[0] if entry is not None else None
+
+
+def _remember_hit(key, location):
+    with _location_lock:
+        _last_hits[key] = (location, 0)
+
+
+def _forget_after_miss(key):
+    """Một lần trượt nữa quanh vị trí cũ; bỏ vị trí sau LOCATION_CACHE_MAX_MISSES lần trượt liên tiếp."""
+    with _location_lock:
+        entry = _last_hits.get(key)
+        if entry is None:
+            return
+        misses = entry[1] + 1
+        if misses >= config.LOCATION_CACHE_MAX_MISSES:
+            del _last_hits[key]
+        else:
+            _last_hits[key] = (entry[0], misses)
+
+
+def _count_location_lookup(template, hit):
+    with _location_lock:
+        stats = _location_stats.setdefault(template, {"lookups": 0, "hits": 0})
+        stats["lookups"] += 1
+        if hit:
+            stats["hits"] += 1
+
 class Detect:
-    def __init__(self, adb: AdbProcess):
+    def __init__(self, adb: AdbProcess, clock: Clock = None):
         self.adb = adb
+        self.clock = clock or adb.clock
+        self.latency_tracker = None  # optional LatencyTracker for adaptive timeouts
+        self.templates = get_template_store()
+        self.probes = get_probe_set() if config.PROBES_ENABLED else None
+        self.screen = base_profile()  # resolution of the device this instance matches for
+        self.fft_matcher = FFTMatcher() if config.FFT_MATCHING_ENABLED else None
+        if self.fft_matcher is not None:
+            # Pooled frames are refilled in place: drop the spectrum of a released one
+            adb.add_frame_release_listener(self.fft_matcher.invalidate)
+        self.executor = get_executor() if config.PARALLEL_TEMPLATE_MATCHING else None
+        self.governor = get_governor()
+        self.device_id = None  # key for the governor's per-device fairness
         logger.info("Detect class initialized successfully")
 
-    def check_object_exists(self, image, template, threshold=0.9):
+    def _load_template(self, template):
+        """
+        Đọc ảnh mẫu (kèm mask và điểm neo) một lần từ kho mẫu dùng chung.
+        :param template: Đường dẫn ảnh mẫu (string).
+        :return: Template hoặc None nếu không đọc được.
+        """
+        return self.templates.get(template, self.screen)
+
+    def set_resolution(self, width, height, device=None) -> ScreenProfile:
+        """
+        Đặt độ phân giải màn hình của thiết bị; mẫu và tọa độ sẽ được co giãn theo.
+        :param width: Chiều rộng (pixel).
+        :param height: Chiều cao (pixel).
+        :param device: Device ID để ghi nhớ độ phân giải cho các thành phần khác.
+        :return: ScreenProfile đang dùng.
+        """
+        if device is not None:
+            self.screen = set_device_resolution(device, width, height)
+        else:
+            self.screen = ScreenProfile(width, height)
+        if not self.screen.is_base:
+            logger.info(f"Using {self.screen} for {device or 'detector'}")
+        return self.screen
+
+    def _match(self, image, template, region=None):
+        """
+        Chạy matchTemplate cho một mẫu.
+        :param region: (x0, y0, x1, y1) chỉ so khớp trong vùng này; kết quả tính theo gốc của vùng.
+        :return: (Template, ma trận kết quả) hoặc (None, None) nếu không thể so khớp.
+        """
+        if image is None:
+            logger.error("Input image is None")
+            return None, None
+
+        if template is None:
+            logger.error("Template path is None")
+            return None, None
+
+        template_img = self._load_template(template)
+        if template_img is None:
+            return None, None
+
+        if region is not None:
+            x0, y0, x1, y1 = region
+            image = image[y0:y1, x0:x1]
+
+        if image.shape[0] < template_img.shape[0] or image.shape[1] < template_img.shape[1]:
+            logger.warning(f"Image too small for template {template}. Image: {image.shape}, Template: {template_img.shape}")
+            return None, None
+
+        # Fleet-wide cap on concurrent matches, shared fairly between devices
+        with self.governor.match(self.device_id or id(self), self.clock):
+            if region is None and self.fft_matcher is not None and self.fft_matcher.wants(template_img):
+                # Large template on the full frame: reuse the frame's DFT across templates
+                return template_img, self.fft_matcher.match(image, template_img)
+
+            if template_img.mask is None:
+                return template_img, cv2.matchTemplate(image, template_img.image, cv2.TM_CCOEFF_NORMED)
+
+            # Masked matching ignores background pixels; flat windows give inf/nan scores
+            result = cv2.matchTemplate(image, template_img.image, cv2.TM_CCOEFF_NORMED, mask=template_img.mask)
+            np.nan_to_num(result, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+            return template_img, result
+
+    def _best_match(self, image, template, threshold, device=None):
+        """
+        Vị trí khớp tốt nhất của mẫu.
+        Khi biết device, thử trước một cửa sổ nhỏ quanh vị trí khớp lần trước và chỉ
+        so khớp toàn khung hình nếu trượt. Sau LOCATION_CACHE_MAX_MISSES lần không thấy
+        mẫu liên tiếp, bỏ qua cửa sổ cho đến khi so khớp toàn khung hình thấy lại.
+        :return: (Template, độ tin cậy, (x, y) góc trên trái) hoặc (None, None, None).
+        """
+        use_cache = device is not None and config.LOCATION_CACHE_ENABLED and image is not None
+        key = (device, template)
+        last = _last_hit(key) if use_cache else None
+
+        if last is not None:
+            template_img = self._load_template(template)
+            if template_img is not None:
+                margin = config.LOCATION_CACHE_MARGIN
+                h, w = template_img.shape[:2]
+                x0, y0 = max(0, last[0] - margin), max(0, last[1] - margin)
+                x1 = min(image.shape[1], last[0] + w + margin)
+                y1 = min(image.shape[0], last[1] + h + margin)
+                _, result = self._match(image, template, region=(x0, y0, x1, y1))
+                if result is not None:
+                    _, confidence, _, (bx, by) = cv2.minMaxLoc(result)
+                    if confidence >= threshold:
+                        _count_location_lookup(template, True)
+                        _remember_hit(key, (bx + x0, by + y0))
+                        return template_img, confidence, (bx + x0, by + y0)
+
+        template_img, result = self._match(image, template)
+        if use_cache:
+            _count_location_lookup(template, False)
+        if result is None:
+            return None, None, None
+
+        _, confidence, _, location = cv2.minMaxLoc(result)
+        if use_cache:
+            if confidence >= threshold:
+                _remember_hit(key, location)
+            elif last is not None:
+                _forget_after_miss(key)
+        return template_img, confidence, location
+
+    def check_object_exists(self, image, template, threshold=0.9, device=None):
         """
         Kiểm tra xem đối tượng có tồn tại trong ảnh hay không.
         :param image: Ảnh gốc (numpy array).
         :param template: Mẫu cần tìm (numpy array).
         :param threshold: Ngưỡng tương đồng để xác định sự tồn tại.
+        :param device: Device ID, bật tìm kiếm quanh vị trí khớp lần trước.
         :return: True nếu đối tượng tồn tại, ngược lại False.
         """
         start_time = time.time()
         try:
-            if image is None:
-                logger.error("Input image is None")
-                return False
-                
-            if template is None:
-                logger.error("Template path is None")
-                return False
-            
-            # Check if template file exists
-            if not os.path.exists(template):
-                logger.error(f"Template file not found: {template}")
-                return False
-            
-            # Load template image
-            template_img = cv2.imread(template, cv2.IMREAD_COLOR)
+            # Pixel probe first; the template is only matched when the probe is inconclusive
+            if self.probes is not None and image is not None and template is not None:
+                verdict = self.probes.check(image, template)
+                if verdict is not None:
+                    if tracer.wants("match.probe"):
+                        tracer.emit("match.probe", device, template=template, verdict=verdict)
+                    return verdict
+
+            template_img, max_val, _ = self._best_match(image, template, threshold, device)
             if template_img is None:
-                logger.error(f"Failed to load template image: {template}")
                 return False
-            
-            # Perform template matching
-            result = cv2.matchTemplate(image, template_img, cv2.TM_CCOEFF_NORMED)
-            max_val = np.max(result)
-            
-            logger.debug(f"Template matching result for {template}: max_val={max_val:.3f}, threshold={threshold}")
-            
-            exists = np.any(result >= threshold)
-            inference_time = time.time() - start_time
-            if exists:
-                logger.debug(f"Object found in template {template} with confidence {max_val:.3f}, time={inference_time:.4f}s")
-                logger.info(f"Object found in template {template} with confidence {max_val:.3f}, time={inference_time:.4f}s")
-            else:
-                logger.debug(f"Object not found in template {template}, best match: {max_val:.3f}")         
+
+            exists = max_val >= threshold
+            event = "match.exists" if exists else "match.miss"
+            if tracer.wants(event):
+                tracer.emit(event, device, template=template, confidence=float(max_val), threshold=threshold,
+                            seconds=time.time() - start_time)
             return exists
             
         except Exception as e:
@@ -63,12 +244,13 @@ class Detect:
             logger.error(traceback.format_exc())
             return False
 
-    def check_object_exists_directory(self, image, template_dir, threshold=0.9):
+    def check_object_exists_directory(self, image, template_dir, threshold=0.9, device=None):
         """
         Kiểm tra xem đối tượng có tồn tại trong ảnh dựa trên các mẫu trong thư mục.
         :param image: Ảnh gốc (numpy array).
         :param template_dir: Thư mục chứa các mẫu (string).
         :param threshold: Ngưỡng tương đồng để xác định sự tồn tại.
+        :param device: Device ID, bật tìm kiếm quanh vị trí khớp lần trước.
         :return: True nếu ít nhất một mẫu tồn tại, ngược lại False.
         """
         try:
@@ -82,16 +264,12 @@ class Detect:
             
             logger.debug(f"Checking objects in directory: {template_dir}")
             
-            for filename in os.listdir(template_dir):
-                if filename.lower().endswith((".png", ".jpg", ".jpeg")):
-                    template_path = os.path.join(template_dir, filename)
-                    try:
-                        if self.check_object_exists(image, template_path, threshold):
-                            logger.debug(f"Object found using template: {filename}")
-                            return True
-                    except Exception as e:
-                        logger.warning(f"Error checking template {filename}: {e}")
-                        continue
+            templates = [os.path.join(template_dir, filename) for filename in os.listdir(template_dir)
+                         if is_template_file(filename)]
+            found = self._first_existing(image, templates, threshold, device)
+            if found is not None:
+                logger.debug(f"Object found using template: {os.path.basename(found)}")
+                return True
             
             logger.debug(f"No objects found in directory: {template_dir}")
             return False
@@ -102,12 +280,44 @@ class Detect:
             logger.error(traceback.format_exc())
             return False
 
-    def find_object_directory(self, image, template_dir, threshold=0.9):
+    def _first_existing(self, image, templates, threshold, device):
+        """
+        Mẫu đầu tiên tồn tại trong ảnh. Các mẫu được so khớp song song trên pool "cpu";
+        khi một mẫu khớp, các mẫu chưa chạy bị hủy ngay.
+        :return: Đường dẫn mẫu tìm thấy hoặc None.
+        """
+        def check(template_path):
+            try:
+                return self.check_object_exists(image, template_path, threshold, device)
+            except Exception as e:
+                logger.warning(f"Error checking template {template_path}: {e}")
+                return False
+
+        if self.executor is None or len(templates) < 2:
+            return next((path for path in templates if check(path)), None)
+
+        token = CancelToken()
+        futures = {}
+        try:
+            for path in templates:
+                futures[self.executor.submit("cpu", check, path, token=token)] = path
+        except PoolSaturatedError:
+            token.cancel()  # drop what was queued and match on this thread
+            return next((path for path in templates if check(path)), None)
+
+        for future in as_completed(futures):
+            if future.result():
+                token.cancel()
+                return futures[future]
+        return None
+
+    def find_object_directory(self, image, template_dir, threshold=0.9, device=None):
         """
         Tìm vị trí của đối tượng trong ảnh dựa trên các mẫu trong thư mục.
         :param image: Ảnh gốc (numpy array).
         :param template_dir: Thư mục chứa các mẫu (string).
         :param threshold: Ngưỡng tương đồng để xác định vị trí.
+        :param device: Device ID, bật tìm kiếm quanh vị trí khớp lần trước.
         :return: Vị trí tâm (x, y) tròn chính giữa của đối tượng nếu tìm thấy, ngược lại None.
         """
         try:
@@ -122,10 +332,10 @@ class Detect:
             logger.debug(f"Finding objects in directory: {template_dir}")
             
             for filename in os.listdir(template_dir):
-                if filename.lower().endswith((".png", ".jpg", ".jpeg")):
+                if is_template_file(filename):
                     template_path = os.path.join(template_dir, filename)
                     try:
-                        position = self.find_object_position(image, template_path, threshold)
+                        position = self.find_object_position(image, template_path, threshold, device)
                         if position is not None:
                             logger.debug(f"Object found using template {filename} at position {position}")
                             return position
@@ -142,59 +352,35 @@ class Detect:
             logger.error(traceback.format_exc())
             return None
 
-    def find_object_position(self, image, template, threshold=0.9):
+    def find_object_position(self, image, template, threshold=0.9, device=None):
         """
         Tìm vị trí của đối tượng trong ảnh dựa trên mẫu.
         :param image: Ảnh gốc (numpy array).
         :param template: Mẫu cần tìm (numpy array).
         :param threshold: Ngưỡng tương đồng để xác định vị trí.
+        :param device: Device ID, bật tìm kiếm quanh vị trí khớp lần trước.
         :return: Vị trí tâm (x, y) tròn chính giữa của đối tượng nếu tìm thấy, ngược lại None.
         """
         start_time = time.time()
         try:
-            if image is None:
-                logger.error("Input image is None")
-                return None
-                
-            if template is None:
-                logger.error("Template path is None")
-                return None
-            
-            # Check if template file exists
-            if not os.path.exists(template):
-                logger.error(f"Template file not found: {template}")
-                return None
-            
-            # Load template image
-            template_img = cv2.imread(template, cv2.IMREAD_COLOR)
+            # Best match (highest confidence), near the previous hit first
+            template_img, confidence, location = self._best_match(image, template, threshold, device)
             if template_img is None:
-                logger.error(f"Failed to load template image: {template}")
-                return None
-            
-            # Check image dimensions
-            if image.shape[0] < template_img.shape[0] or image.shape[1] < template_img.shape[1]:
-                logger.warning(f"Image too small for template {template}. Image: {image.shape}, Template: {template_img.shape}")
                 return None
-            
-            # Perform template matching
-            result = cv2.matchTemplate(image, template_img, cv2.TM_CCOEFF_NORMED)
-            yloc, xloc = np.where(result >= threshold)
-            
-            if len(xloc) == 0 or len(yloc) == 0:
-                max_val = np.max(result)
-                logger.debug(f"No match found for template {template}. Best match: {max_val:.3f}, threshold: {threshold}")
+
+            best_x, best_y = location
+            if confidence < threshold:
+                if tracer.wants("match.miss"):
+                    tracer.emit("match.miss", device, template=template, confidence=float(confidence),
+                                threshold=threshold, seconds=time.time() - start_time)
                 return None
-            
-            # Find the best match (highest confidence)
-            best_idx = np.argmax(result)
-            best_y, best_x = np.unravel_index(best_idx, result.shape)
-            confidence = result[best_y, best_x]
-            
-            # Calculate center position
-            x = int(best_x + template_img.shape[1] / 2)
-            y = int(best_y + template_img.shape[0] / 2)
-            inference_time = time.time() - start_time
-            logger.info(f"Found {template.split('/')[-1]}: conf={confidence:.3f}, time={inference_time:.4f}s")
+
+            # Tap position: template anchor (center unless the template was trimmed)
+            x = int(best_x + template_img.anchor[0])
+            y = int(best_y + template_img.anchor[1])
+            if tracer.wants("match.found"):
+                tracer.emit("match.found", device, template=template, confidence=float(confidence),
+                            x=x, y=y, seconds=time.time() - start_time)
             return (x, y)
             
         except Exception as e:
@@ -203,19 +389,72 @@ class Detect:
             logger.error(traceback.format_exc())
             return None
 
-    def wait_until_found(self, device, template, threshold=0.9, timeout=10):
+    def find_all(self, image, template, threshold=0.9, max_results=None):
+        """
+        Tìm tất cả vị trí của đối tượng trong ảnh (ví dụ: mọi ô tài nguyên sau khi tìm kiếm).
+        Các đỉnh chồng lấn được loại bằng non-maximum suppression.
+        :param image: Ảnh gốc (numpy array).
+        :param template: Mẫu cần tìm (string).
+        :param threshold: Ngưỡng tương đồng để xác định vị trí.
+        :param max_results: Số kết quả tối đa, None = không giới hạn.
+        :return: Danh sách (x, y, confidence) theo độ tin cậy giảm dần.
+        """
+        try:
+            template_img, result = self._match(image, template)
+            if result is None:
+                return []
+
+            h, w = template_img.shape[:2]
+            # A peak is a point above the threshold that is the maximum of its template-sized window
+            local_max = cv2.dilate(result, cv2.getStructuringElement(cv2.MORPH_RECT, (w, h)))
+            ys, xs = np.nonzero((result >= threshold) & (result >= local_max))
+            if len(xs) == 0:
+                return []
+
+            scores = result[ys, xs]
+            order = np.argsort(-scores, kind="stable")
+            xs, ys, scores = xs[order], ys[order], scores[order]
+
+            # Plateaus can leave several peaks in one window, keep the strongest one
+            keep = np.ones(len(xs), dtype=bool)
+            for i in range(len(xs)):
+                if not keep[i]:
+                    continue
+                overlap = (np.abs(xs[i + 1:] - xs[i]) < w) & (np.abs(ys[i + 1:] - ys[i]) < h)
+                keep[i + 1:] &= ~overlap
+
+            xs, ys, scores = xs[keep], ys[keep], scores[keep]
+            if max_results is not None:
+                xs, ys, scores = xs[:max_results], ys[:max_results], scores[:max_results]
+
+            ax, ay = template_img.anchor
+            hits = [(int(x + ax), int(y + ay), float(s)) for x, y, s in zip(xs, ys, scores)]
+            logger.debug(f"find_all {template}: {len(hits)} hit(s) above {threshold}")
+            return hits
+
+        except Exception as e:
+            error_msg = f"Error in find_all for template {template}: {e}"
+            logger.error(error_msg)
+            logger.error(traceback.format_exc())
+            return []
+
+    def wait_until_found(self, device, template, threshold=0.9, timeout=10, step=None):
         """
         Chờ cho đến khi tìm thấy đối tượng trong ảnh.
         :param device: Device ID.
         :param template: Mẫu cần tìm (string).
         :param threshold: Ngưỡng tương đồng để xác định vị trí.
-        :param timeout: Thời gian chờ tối đa (giây).
+        :param timeout: Thời gian chờ tối đa (giây), mặc định khi chưa học được timeout.
+        :param step: (task, step) để học timeout thích ứng, ví dụ ("explore", "cave_explore").
         :return: Vị trí tâm (x, y) tròn chính giữa của đối tượng nếu tìm thấy, ngược lại None.
         """
         try:
+            if step is not None and self.latency_tracker is not None:
+                timeout = self.latency_tracker.timeout_for(device, *step, default=timeout)
+
             logger.info(f"Waiting for object {template} on device {device} (timeout: {timeout}s)")
             
-            start_time = cv2.getTickCount()
+            start_time = self.clock.monotonic()
             attempts = 0
             
             while True:
@@ -226,29 +465,40 @@ class Detect:
                     img = self.adb.capture(device)
                     if img is None:
                         logger.warning(f"Failed to capture screenshot on attempt {attempts}")
-                        time.sleep(0.5)
-                        continue
-                    
-                    # Try to find object
-                    position = self.find_object_position(img, template, threshold)
-                    if position is not None:
-                        elapsed = (cv2.getTickCount() - start_time) / cv2.getTickFrequency()
-                        logger.info(f"Object {template} found after {elapsed:.2f}s ({attempts} attempts)")
-                        return position
-                    
-                    # Check timeout
-                    elapsed = (cv2.getTickCount() - start_time) / cv2.getTickFrequency()
-                    if elapsed > timeout:
-                        logger.warning(f"Timeout waiting for object {template} after {elapsed:.2f}s")
-                        return None
-                    
-                    # Wait before next attempt
-                    time.sleep(0.5)
-                    
+                    else:
+                        # Try to find object
+                        try:
+                            position = self.find_object_position(img, template, threshold, device)
+                        finally:
+                            self.adb.release_frame(device, img)
+                        if position is not None:
+                            elapsed = self.clock.monotonic() - start_time
+                            logger.info(f"Object {template} found after {elapsed:.2f}s ({attempts} attempts)")
+                            if step is not None and self.latency_tracker is not None:
+                                self.latency_tracker.record(device, *step, elapsed)
+                            return position
                 except Exception as e:
                     logger.warning(f"Error in attempt {attempts}: {e}")
-                    time.sleep(0.5)
-                    continue
+                
+                # Check timeout, also after failed captures
+                elapsed = self.clock.monotonic() - start_time
+                if elapsed > timeout:
+                    logger.warning(f"Timeout waiting for object {template} after {elapsed:.2f}s")
+                    if step is not None and self.latency_tracker is not None:
+                        self.latency_tracker.record(device, *step, elapsed, timed_out=True)
+                    get_screenshot_archiver().dump(device, f"timeout_{os.path.splitext(os.path.basename(template))[0]}")
+                    return None
+                
+                # Circuit open for longer than the time left: the template cannot show up in time.
+                # Not recorded as a latency sample, the device failed rather than the screen being slow.
+                retry_in = self.adb.health.breaker(device).retry_in()
+                if retry_in > timeout - elapsed:
+                    logger.warning(f"Stop waiting for {template}: device {device} unavailable "
+                                   f"for {retry_in:.1f}s, {timeout - elapsed:.1f}s left")
+                    return None
+                
+                # Wait before next attempt
+                self.clock.sleep(0.5)
                     
         except Exception as e:
             error_msg = f"Error in wait_until_found for template {template}: {e}"
@@ -0,0 +1,164 @@
+"""
+adb server sharding for Rise of Kingdoms Tool
+Runs one adb server per port in config.ADB_SERVER_PORTS and routes every device
+command through the server that owns the device (`adb -P <port> -s <serial> ...`),
+so screenshot traffic is spread over several servers and restarting one of them
+leaves the devices of the others alone.
+
+Ownership comes from config.ADB_DEVICE_SERVERS, otherwise emulators (emulator-5554)
+are spread by a stable hash of the serial; every server discovers them on its own.
+Network devices (127.0.0.1:5555) are `adb connect`ed to their owning server only,
+so unlisted ones stay on the first server, where other tools connect them.
+
+    python -m utils.adb_servers bench SERIAL [SERIAL ...] [--servers 4] [--seconds 20]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import zlib
+import logging
+from typing import Dict, Iterable, List
+
+import config
+from utils.clock import system_clock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADB_PORT = 5037
+
+
+class AdbServers:
+    """Device-to-server routing and per-server lifecycle"""
+
+    def __init__(self, adb_path: str = None, ports: Iterable[int] = None, assignments: Dict[str, int] = None):
+        self.adb_path = adb_path or config.ADB_PATH
+        self.ports: List[int] = list(ports or config.ADB_SERVER_PORTS)
+        self.assignments = dict(config.ADB_DEVICE_SERVERS if assignments is None else assignments)
+        self._restart_locks = {port: threading.Lock() for port in self.ports}
+        self._last_restart: Dict[int, float] = {}  # port -> monotonic time of the last restart
+
+    def port_for(self, device_id: str) -> int:
+        """Server port owning a device"""
+        port = self.assignments.get(device_id)
+        if port in self.ports:
+            return port
+        if ":" in device_id:
+            return self.ports[0]
+        return self.ports[zlib.crc32(device_id.encode("utf-8")) % len(self.ports)]
+
+    def server_command(self, port: int, *args) -> List[str]:
+        """adb command line for one server"""
+        if port == DEFAULT_ADB_PORT:
+            return [self.adb_path, *args]
+        return [self.adb_path, "-P", str(port), *args]
+
+    def command(self, device_id: str, *args) -> List[str]:
+        """adb command line for a device, through its owning server"""
+        return self.server_command(self.port_for(device_id), "-s", device_id, *args)
+
+    def start(self, port: int, devices: Iterable[str] = ()):
+        """Start a server and attach the network devices it owns"""
+        subprocess.run(self.server_command(port, "start-server"), capture_output=True, timeout=config.ADB_TIMEOUT)
+        for device_id in devices:
+            if ":" in device_id and self.port_for(device_id) == port:
+                subprocess.run(self.server_command(port, "connect", device_id),
+                               capture_output=True, timeout=config.ADB_TIMEOUT)
+
+    def start_all(self, devices: Iterable[str] = ()):
+        devices = list(devices) + [d for d in self.assignments if d not in devices]
+        for port in self.ports:
+            self.start(port, devices)
+
+    def restart(self, port: int, devices: Iterable[str] = (), clock=None, force: bool = False) -> bool:
+        """
+        Restart one server; devices owned by the other servers are not touched.
+        Restarts asked for by failing devices are skipped within ADB_SERVER_RESTART_INTERVAL
+        of the last one, so one bad device cannot keep knocking its neighbours off.
+        """
+        clock = clock or system_clock
+        lock = self._restart_locks.setdefault(port, threading.Lock())
+        if not lock.acquire(blocking=False):
+            logger.info(f"adb server on port {port} is already restarting")
+            return False
+        try:
+            last = self._last_restart.get(port)
+            if not force and last is not None and clock.monotonic() - last < config.ADB_SERVER_RESTART_INTERVAL:
+                logger.info(f"adb server on port {port} was restarted {clock.monotonic() - last:.0f}s ago, not again")
+                return False
+            self._last_restart[port] = clock.monotonic()
+            logger.info(f"Restarting adb server on port {port}")
+            subprocess.run(self.server_command(port, "kill-server"), capture_output=True, timeout=10)
+            clock.sleep(2)
+            owned = [d for d in list(devices) + list(self.assignments) if self.port_for(d) == port]
+            self.start(port, owned)
+            clock.sleep(3)
+            logger.info(f"adb server on port {port} restarted")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to restart adb server on port {port}: {e}")
+            return False
+        finally:
+            lock.release()
+
+
+_default_servers = None
+_default_servers_lock = threading.Lock()
+
+
+def get_adb_servers() -> AdbServers:
+    """Process-wide server routing"""
+    global _default_servers
+    if _default_servers is None:
+        with _default_servers_lock:
+            if _default_servers is None:
+                _default_servers = AdbServers()
+    return _default_servers
+
+
+def _capture_rate(servers: AdbServers, devices: List[str], seconds: float) -> Dict[str, float]:
+    """Captures per second per device while every device captures concurrently"""
+    counts = {device: 0 for device in devices}
+    deadline = time.monotonic() + seconds
+
+    def loop(device):
+        while time.monotonic() < deadline:
+            result = subprocess.run(servers.command(device, "exec-out", "screencap", "-p"), capture_output=True)
+            if result.returncode == 0 and result.stdout:
+                counts[device] += 1
+
+    threads = [threading.Thread(target=loop, args=(device,)) for device in devices]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {device: count / seconds for device, count in counts.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="adb server sharding tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="capture throughput with 1 vs N adb servers")
+    bench.add_argument("devices", nargs="+", help="device serials")
+    bench.add_argument("--servers", type=int, default=4, help="number of servers for the sharded run")
+    bench.add_argument("--base-port", type=int, default=DEFAULT_ADB_PORT)
+    bench.add_argument("--seconds", type=float, default=20.0, help="duration of each run")
+    args = parser.parse_args(argv)
+
+    ports = [args.base_port + i for i in range(args.servers)]
+    for label, run_ports in (("1 server", ports[:1]), (f"{args.servers} servers", ports)):
+        assignments = {device: run_ports[i % len(run_ports)] for i, device in enumerate(args.devices)}
+        servers = AdbServers(ports=run_ports, assignments=assignments)
+        servers.start_all(args.devices)
+        rates = _capture_rate(servers, args.devices, args.seconds)
+        total = sum(rates.values())
+        print(f"{label:>10}: {total:6.2f} captures/s total, "
+              f"{statistics.mean(rates.values()):5.2f}/s per device (min {min(rates.values()):.2f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Army status detector for Rise of Kingdoms Tool
+Reads the march slot indicators in one cropped region instead of matching every
+slot template against the full frame on each tick
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+import config
+from utils.Detect import Detect
+
+logger = logging.getLogger(__name__)
+
+ARMY_SLOT_TEMPLATES = [
+    "./images/armies/army_1.png",
+    "./images/armies/army_2.png",
+    "./images/armies/army_3.png",
+    "./images/armies/army_4.png",
+]
+
+
+class ArmyStatus:
+    """Busy/free/unknown state of every march slot; slot numbers start at 1"""
+
+    def __init__(self, slots: List[str]):
+        self.slots = slots
+
+    @property
+    def busy(self) -> int:
+        return sum(1 for state in self.slots if state == "busy")
+
+    @property
+    def free(self) -> int:
+        return sum(1 for state in self.slots if state == "free")
+
+    def is_free(self, slot: int) -> bool:
+        return 1 <= slot <= len(self.slots) and self.slots[slot - 1] == "free"
+
+    def __repr__(self):
+        return f"ArmyStatus(busy={self.busy}, free={self.free}, slots={self.slots})"
+
+
+class ArmyStatusDetector:
+    """
+    Matches the march slot templates inside a small region of interest.
+
+    The region comes from config.ARMY_STATUS_ROI, or is calibrated from full-frame
+    hits: it grows to cover every slot icon seen so far and is re-checked against
+    the full frame every ARMY_STATUS_RECALIBRATE_TICKS calls so a moved panel is
+    picked up again. A calibrated crop only answers for slots whose icon was seen
+    inside it; other slots, and crops too small for the icon, use the full frame.
+    """
+
+    def __init__(self, detect: Detect, templates: List[str] = None,
+                 roi: Optional[Tuple[int, int, int, int]] = None, threshold: float = None):
+        self.detect = detect
+        self.templates = templates or ARMY_SLOT_TEMPLATES
+        self.base_roi = roi or config.ARMY_STATUS_ROI  # in base-resolution coordinates
+        self.roi = None  # in device coordinates
+        self.threshold = threshold or config.TEMPLATE_MATCHING_THRESHOLD
+        self.margin = config.ARMY_STATUS_ROI_MARGIN
+        self._ticks = 0
+        # Slots whose icon was seen inside the region; a configured region covers them all
+        self._covered = set(range(len(self.templates))) if self.base_roi is not None else set()
+
+    def detect_status(self, image) -> Optional[ArmyStatus]:
+        """Read every slot, from one crop of the frame where the region covers it"""
+        crop, origin = self._crop(image)
+        if crop is None:
+            return None
+
+        slots = []
+        for index in range(len(self.templates)):
+            busy = self._slot_busy(image, crop, origin, index)
+            slots.append("unknown" if busy is None else "busy" if busy else "free")
+
+        status = ArmyStatus(slots)
+        logger.debug(f"Army status: {status}")
+        return status
+
+    def is_slot_free(self, image, slot: int) -> bool:
+        """
+        Check a single slot with one ROI match.
+        Slots without an indicator template, or that cannot be read, are treated as unavailable.
+        """
+        if not 1 <= slot <= len(self.templates):
+            return False
+
+        crop, origin = self._crop(image)
+        if crop is None:
+            return False
+        return self._slot_busy(image, crop, origin, slot - 1) is False
+
+    def _slot_busy(self, image, crop, origin, index: int) -> Optional[bool]:
+        """True/False for a busy/free slot, None if the frame cannot show its icon"""
+        template = self.templates[index]
+        template_img = self.detect._load_template(template)
+        if template_img is None:
+            return None
+        h, w = template_img.shape[:2]
+        if origin is not None and (index not in self._covered or crop.shape[0] < h or crop.shape[1] < w):
+            # The region may not hold this icon: a miss there would read as "free"
+            crop, origin = image, None
+        if crop.shape[0] < h or crop.shape[1] < w:
+            return None
+
+        pos = self.detect.find_object_position(crop, template, self.threshold)
+        if pos is not None and origin is None:
+            self._calibrate(pos, index)
+        return pos is not None
+
+    def _crop(self, image):
+        """Return (crop, origin); origin is None when the full frame is used"""
+        if image is None:
+            return None, None
+
+        self._ticks += 1
+        if self.roi is None and self.base_roi is not None:
+            self.roi = self.detect.screen.rect(self.base_roi)
+        recalibrate = self._ticks % config.ARMY_STATUS_RECALIBRATE_TICKS == 0
+        if self.roi is None or recalibrate:
+            return image, None
+
+        x, y, w, h = self.roi
+        height, width = image.shape[:2]
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(width, x + w), min(height, y + h)
+        if x1 <= x0 or y1 <= y0:
+            return image, None
+        return image[y0:y1, x0:x1], (x0, y0)
+
+    def _calibrate(self, center: Tuple[int, int], index: int):
+        """Grow the slot region to cover a full-frame hit, so it holds every slot icon seen"""
+        mx, my = self.detect.screen.point(*self.margin)
+        hit = (center[0] - mx, center[1] - my, center[0] + mx, center[1] + my)
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            if x <= center[0] < x + w and y <= center[1] < y + h:
+                self._covered.add(index)
+                return
+            hit = (min(hit[0], x), min(hit[1], y), max(hit[2], x + w), max(hit[3], y + h))
+        roi = (hit[0], hit[1], hit[2] - hit[0], hit[3] - hit[1])
+        logger.info(f"Army status region calibrated from {self.templates[index]}: {roi}")
+        self.roi = roi
+        self._covered.add(index)
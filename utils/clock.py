@@ -0,0 +1,124 @@
+"""
+Clock abstraction for Rise of Kingdoms Tool
+All sleeps, timeouts and deadlines in the task flows go through a Clock so that
+tests and the simulator can swap in a VirtualClock and run faster than real time.
+A CancellableClock wraps either one so every sleep of a device worker ends as soon
+as the device is paused, stopped or its task is disabled
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+import config
+from utils.executor import CancelToken, TaskCancelled
+
+
+class Clock:
+    """Real clock backed by the time module"""
+
+    def time(self) -> float:
+        """Wall clock timestamp in seconds"""
+        return time.time()
+
+    def monotonic(self) -> float:
+        """Monotonic timestamp in seconds, used for timeouts and deadlines"""
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        """Block the calling thread for `seconds`"""
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, seconds: float, token: CancelToken) -> bool:
+        """Sleep up to `seconds`, returning True early once the token is cancelled"""
+        return token.wait(max(0.0, seconds))
+
+    def check_cancelled(self):
+        """Raise TaskCancelled if the work using this clock was cancelled"""
+
+
+class VirtualClock(Clock):
+    """
+    Simulated clock whose time only moves when a thread sleeps or advance() is called.
+    Sleeping returns immediately after moving the clock forward, so a farm cycle that
+    takes minutes of wall time completes in milliseconds.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self._now = float(start)
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        with self._lock:
+            return self._now
+
+    def monotonic(self) -> float:
+        with self._lock:
+            return self._now
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            self.advance(seconds)
+
+    def wait(self, seconds: float, token: CancelToken) -> bool:
+        if not token.cancelled:
+            self.sleep(seconds)
+        return token.cancelled
+
+    def advance(self, seconds: float):
+        """Move the clock forward without sleeping"""
+        with self._lock:
+            self._now += seconds
+
+
+class CancellableClock(Clock):
+    """
+    Clock of one device worker. Sleeps wake up immediately when the token is
+    cancelled and raise TaskCancelled; conditions pushed with stop_when() (e.g.
+    "this task was disabled") are checked every CANCEL_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, base: Clock, token: CancelToken, poll_interval: float = None):
+        self.base = base
+        self.token = token
+        self.poll_interval = poll_interval or config.CANCEL_POLL_INTERVAL
+        self._conditions = ()
+
+    def time(self) -> float:
+        return self.base.time()
+
+    def monotonic(self) -> float:
+        return self.base.monotonic()
+
+    @contextmanager
+    def stop_when(self, condition: Callable[[], bool]):
+        """Cancel the work inside the block once `condition()` becomes true"""
+        previous = self._conditions
+        self._conditions = previous + (condition,)
+        try:
+            yield
+        finally:
+            self._conditions = previous
+
+    def check_cancelled(self):
+        if self.token.cancelled or any(condition() for condition in self._conditions):
+            raise TaskCancelled()
+
+    def sleep(self, seconds: float):
+        self.check_cancelled()
+        deadline = self.base.monotonic() + seconds
+        while True:
+            remaining = deadline - self.base.monotonic()
+            if remaining <= 0:
+                return
+            self.base.wait(min(remaining, self.poll_interval), self.token)
+            self.check_cancelled()
+
+    def wait(self, seconds: float, token: CancelToken) -> bool:
+        return self.base.wait(seconds, token)
+
+
+# Shared real clock used when no clock is injected
+system_clock = Clock()
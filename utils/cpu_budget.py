@@ -0,0 +1,208 @@
+"""
+CPU budget for Rise of Kingdoms Tool
+Keeps the matching threads from oversubscribing the host. Device workers and the
+cpu pool already run one match per thread, so OpenCV's own parallel_for and the
+BLAS/OpenMP pools behind numpy default to a single thread each (OPENCV_THREADS,
+BLAS_THREADS). The process, or single pools, can also be pinned to core sets
+(CPU_AFFINITY, POOL_AFFINITY).
+
+BLAS thread counts are read from the environment when numpy loads, so
+configure_environment() must run before cv2/numpy are imported (top of main.py).
+cv2.setNumThreads is process-wide, not per thread.
+
+    python -m utils.cpu_budget bench [--threads 1 2 4] [--workers 1 2 4 8] [--core-sets 0-3 0-7]
+
+BLAS threads are fixed once numpy is loaded; compare them by running the bench
+under different OMP_NUM_THREADS values.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Iterable, List, Optional, Union
+
+import config
+
+logger = logging.getLogger(__name__)
+
+BLAS_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                 "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+
+CoreSpec = Union[None, str, Iterable[int]]
+
+
+def parse_cores(spec: CoreSpec) -> Optional[List[int]]:
+    """Core list from "0-3,6" or an iterable of ints; None means every core"""
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        cores = []
+        for part in spec.split(","):
+            part = part.strip()
+            if "-" in part:
+                first, last = part.split("-", 1)
+                cores.extend(range(int(first), int(last) + 1))
+            elif part:
+                cores.append(int(part))
+        return sorted(set(cores))
+    return sorted(set(int(core) for core in spec))
+
+
+def available_cores() -> int:
+    """Cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def configure_environment(blas_threads: int = None):
+    """Cap the BLAS/OpenMP pools; a value already set in the environment wins"""
+    threads = config.BLAS_THREADS if blas_threads is None else blas_threads
+    if not threads:
+        return
+    if "numpy" in sys.modules:
+        logger.warning("numpy is already loaded, BLAS_THREADS only applies to new processes")
+    for var in BLAS_ENV_VARS:
+        os.environ.setdefault(var, str(threads))
+
+
+def apply_opencv_threads(threads: int = None):
+    """cv2.setNumThreads for the whole process (None keeps OpenCV's default)"""
+    import cv2
+
+    threads = config.OPENCV_THREADS if threads is None else threads
+    if threads is None:
+        return
+    # setNumThreads(0) also means one thread: matching runs on the calling thread
+    cv2.setNumThreads(max(0, threads))
+    logger.info(f"OpenCV threads: {cv2.getNumThreads()}")
+
+
+def set_process_affinity(cores: CoreSpec) -> bool:
+    """Pin the whole process to a core set (psutil is used where os.sched_setaffinity is missing)"""
+    cores = parse_cores(cores)
+    if cores is None:
+        return False
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        else:
+            try:
+                import psutil
+            except ImportError:
+                logger.warning("CPU_AFFINITY needs psutil on this platform (pip install psutil)")
+                return False
+            psutil.Process().cpu_affinity(cores)
+        logger.info(f"Process pinned to cores {cores}")
+        return True
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot pin the process to cores {cores}: {e}")
+        return False
+
+
+def pin_current_thread(cores: CoreSpec) -> bool:
+    """Pin the calling thread to a core set (Linux only, other platforms pin processes)"""
+    cores = parse_cores(cores)
+    if cores is None:
+        return False
+    if not hasattr(os, "sched_setaffinity"):
+        logger.warning("Pinning single threads is only supported on Linux; use CPU_AFFINITY instead")
+        return False
+    try:
+        os.sched_setaffinity(threading.get_native_id(), cores)
+        return True
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot pin {threading.current_thread().name} to cores {cores}: {e}")
+        return False
+
+
+def apply_cpu_budget():
+    """Startup settings that can still change after numpy/cv2 are loaded"""
+    apply_opencv_threads()
+    if config.CPU_AFFINITY is not None:
+        set_process_affinity(config.CPU_AFFINITY)
+
+
+def _bench_frame_and_templates():
+    import cv2
+    import numpy as np
+
+    w, h = config.BASE_RESOLUTION
+    noise = np.random.default_rng(0).integers(0, 255, (h, w, 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(noise, (5, 5), 0)
+    templates = []
+    for side in (32, 64, 128):
+        y, x = (h - side) // 3, (w - side) // 3
+        templates.append(frame[y:y + side, x:x + side].copy())
+    return frame, templates
+
+
+def _run_matches(frame, templates, workers: int, seconds: float) -> float:
+    """Matches per second with `workers` threads matching concurrently"""
+    import cv2
+
+    counts = [0] * workers
+    deadline = time.perf_counter() + seconds
+
+    def loop(index):
+        i = 0
+        while time.perf_counter() < deadline:
+            cv2.matchTemplate(frame, templates[i % len(templates)], cv2.TM_CCOEFF_NORMED)
+            counts[index] += 1
+            i += 1
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU budget tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="sweep OpenCV threads x workers (x core sets)")
+    cores = available_cores()
+    bench.add_argument("--threads", type=int, nargs="+", default=sorted({1, 2, cores}),
+                       help="cv2.setNumThreads values")
+    bench.add_argument("--workers", type=int, nargs="+", default=sorted({1, max(1, cores // 2), cores, cores * 2}),
+                       help="threads matching concurrently (≈ busy devices)")
+    bench.add_argument("--core-sets", nargs="+", default=[None],
+                       help='core sets to pin the process to, e.g. "0-3" "0-7" (Linux/psutil)')
+    bench.add_argument("--seconds", type=float, default=3.0, help="duration of each run")
+    args = parser.parse_args(argv)
+
+    import cv2
+
+    frame, templates = _bench_frame_and_templates()
+    default_threads = cv2.getNumThreads()
+    print(f"{available_cores()} cores available, OpenCV default {default_threads} threads")
+    print(f"{'cores':>8} {'cv2 thr':>7} {'workers':>7} {'match/s':>9} {'per core':>9}")
+    results = []
+    for core_set in args.core_sets:
+        if core_set is not None and not set_process_affinity(core_set):
+            continue
+        n_cores = len(parse_cores(core_set)) if core_set is not None else available_cores()
+        for threads in args.threads:
+            cv2.setNumThreads(threads)
+            for workers in args.workers:
+                rate = _run_matches(frame, templates, workers, args.seconds)
+                per_core = rate / n_cores
+                results.append((per_core, rate, core_set, threads, workers))
+                print(f"{core_set or 'all':>8} {threads:>7} {workers:>7} {rate:>9.1f} {per_core:>9.2f}")
+    cv2.setNumThreads(default_threads)
+
+    if results:
+        per_core, rate, core_set, threads, workers = max(results)
+        print(f"Best per core: OPENCV_THREADS = {threads} with {workers} workers"
+              f"{'' if core_set is None else f' on cores {core_set}'} ({rate:.1f} match/s, {per_core:.2f}/core)")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
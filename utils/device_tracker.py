@@ -0,0 +1,225 @@
+"""
+Device tracker for Rise of Kingdoms Tool
+Keeps one `host:track-devices` stream open to the adb server and mirrors its device
+table in memory, so connection checks are dictionary lookups and device workers
+hear about a dropped emulator right away instead of after failed captures.
+
+The adb server pushes the full device list on every change:
+    <4 hex digits length><serial>\\t<state>\\n...
+When the server cannot be reached the tracker falls back to polling `adb devices`
+every DEVICE_CHECK_INTERVAL seconds and keeps trying to reopen the stream.
+With several adb servers (config.ADB_SERVER_PORTS) there is one stream per server;
+a device's state is taken from the server that owns it.
+"""
+
+import logging
+import socket
+import subprocess
+import threading
+import traceback
+from typing import Callable, Dict, List, Optional
+
+import config
+from utils.adb_servers import AdbServers, get_adb_servers
+from utils.executor import CancelToken, get_executor, stop_token
+
+logger = logging.getLogger(__name__)
+
+# callback(serial, old_state, new_state); a state of None means the device is gone
+DeviceListener = Callable[[str, Optional[str], Optional[str]], None]
+
+
+def parse_device_list(text: str) -> Dict[str, str]:
+    """{serial: state} from `adb devices` / track-devices output"""
+    devices = {}
+    for line in text.splitlines():
+        parts = line.strip().split()
+        if len(parts) >= 2 and not line.startswith(("*", "List of devices")):
+            devices[parts[0]] = parts[1]
+    return devices
+
+
+class DeviceTracker:
+    """In-memory device table fed by the adb server"""
+
+    def __init__(self, servers: AdbServers = None):
+        self.servers = servers or get_adb_servers()
+        self.modes: Dict[int, str] = {}  # port -> "stream", "polling" or "stopped"
+        self._tables: Dict[int, Dict[str, str]] = {}  # port -> that server's device list
+        self._devices: Dict[str, str] = {}  # merged view
+        self._listeners: List[DeviceListener] = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._token: Optional[CancelToken] = None
+
+    # ---------------- queries ----------------
+
+    @property
+    def mode(self) -> str:
+        """Tracking mode, e.g. "stream" or "5037:stream, 5038:polling" with several servers"""
+        if len(self.modes) <= 1:
+            return next(iter(self.modes.values()), "stopped")
+        return ", ".join(f"{port}:{mode}" for port, mode in sorted(self.modes.items()))
+
+    @property
+    def ready(self) -> bool:
+        """True once every server has sent its first device list"""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def devices(self) -> Dict[str, str]:
+        """Snapshot of {serial: state}"""
+        with self._lock:
+            return dict(self._devices)
+
+    def connected_devices(self) -> List[str]:
+        """Serials in the "device" state (online and authorized)"""
+        with self._lock:
+            return [serial for serial, state in self._devices.items() if state == "device"]
+
+    def is_connected(self, serial: str) -> Optional[bool]:
+        """Whether a device is online; None while the tracker has no data yet"""
+        if not self._ready.is_set():
+            return None
+        return self._devices.get(serial) == "device"
+
+    def is_known(self, serial: str) -> Optional[bool]:
+        """Whether a server lists the device at all, in any state (offline included); None without data yet"""
+        if not self._ready.is_set():
+            return None
+        return serial in self._devices
+
+    # ---------------- subscriptions ----------------
+
+    def subscribe(self, listener: DeviceListener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: DeviceListener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    # ---------------- lifecycle ----------------
+
+    def start(self):
+        """Run one long-lived tracking job per adb server on the io pool"""
+        if self._token is not None and not self._token.cancelled:
+            return
+        self._token = stop_token.child()
+        for port in self.servers.ports:
+            get_executor().submit("io", self._run, self._token, port, token=self._token,
+                                  thread_name=f"device-tracker-{port}")
+
+    def stop(self):
+        if self._token is not None:
+            self._token.cancel()
+
+    def _run(self, token: CancelToken, port: int):
+        started_server = False
+        while not token.cancelled:
+            try:
+                self._stream(token, port)
+            except ConnectionRefusedError:
+                if not started_server:
+                    # No server yet: start it once, the stream is retried right away
+                    started_server = True
+                    self._start_server(port)
+                    continue
+                logger.warning(f"adb server {port} refused the track-devices stream, polling instead")
+            except Exception as e:
+                logger.warning(f"Device tracking stream of adb server {port} lost ({e}), polling instead")
+                logger.debug(traceback.format_exc())
+            if token.cancelled:
+                break
+            self.modes[port] = "polling"
+            self._poll(port)
+            token.wait(config.DEVICE_CHECK_INTERVAL)
+        self.modes[port] = "stopped"
+
+    def _stream(self, token: CancelToken, port: int):
+        """Hold the track-devices stream open until it breaks or the token is cancelled"""
+        request = b"host:track-devices"
+        with socket.create_connection((config.ADB_SERVER_HOST, port), timeout=5) as sock:
+            sock.sendall(b"%04x%s" % (len(request), request))
+            status = sock.recv(4)
+            if status != b"OKAY":
+                raise ConnectionError(f"adb server answered {status!r} to track-devices")
+            self.modes[port] = "stream"
+            logger.info(f"Tracking devices through the stream of adb server {port}")
+
+            sock.settimeout(1.0)  # wake up to notice cancellation
+            buffer = b""
+            while not token.cancelled:
+                try:
+                    chunk = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    raise ConnectionError("adb server closed the stream")
+                buffer += chunk
+                while len(buffer) >= 4:
+                    size = int(buffer[:4], 16)
+                    if len(buffer) < 4 + size:
+                        break
+                    payload, buffer = buffer[4:4 + size], buffer[4 + size:]
+                    self._apply(port, parse_device_list(payload.decode("utf-8", "replace")))
+
+    def _poll(self, port: int):
+        try:
+            result = subprocess.run(self.servers.server_command(port, "devices"), capture_output=True, text=True,
+                                    timeout=config.ADB_TIMEOUT)
+            if result.returncode == 0:
+                self._apply(port, parse_device_list(result.stdout))
+        except Exception as e:
+            logger.error(f"Polling adb server {port} failed: {e}")
+
+    def _start_server(self, port: int):
+        try:
+            self.servers.start(port, self.servers.assignments)
+        except Exception as e:
+            logger.error(f"Failed to start adb server {port}: {e}")
+
+    def _apply(self, port: int, table: Dict[str, str]):
+        """Replace one server's table and notify listeners of every changed device"""
+        with self._lock:
+            self._tables[port] = table
+            devices = {}
+            for server, server_table in self._tables.items():
+                for serial, state in server_table.items():
+                    # Emulators show up on every server; the owner's view wins
+                    if serial not in devices or server == self.servers.port_for(serial):
+                        devices[serial] = state
+            old = self._devices
+            self._devices = devices
+            listeners = list(self._listeners)
+            complete = len(self._tables) >= len(self.servers.ports)
+        if complete:
+            self._ready.set()
+
+        for serial in sorted(set(old) | set(devices)):
+            before, after = old.get(serial), devices.get(serial)
+            if before == after:
+                continue
+            logger.info(f"Device {serial}: {before or 'absent'} -> {after or 'absent'}")
+            for listener in listeners:
+                try:
+                    listener(serial, before, after)
+                except Exception as e:
+                    logger.error(f"Device listener failed for {serial}: {e}")
+
+
+_default_tracker = None
+_default_tracker_lock = threading.Lock()
+
+
+def get_device_tracker() -> DeviceTracker:
+    """Process-wide device tracker (not started until start() is called)"""
+    global _default_tracker
+    if _default_tracker is None:
+        with _default_tracker_lock:
+            if _default_tracker is None:
+                _default_tracker = DeviceTracker()
+    return _default_tracker
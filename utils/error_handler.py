@@ -1,26 +1,174 @@
 """
 Error handling utilities for Rise of Kingdoms Tool
-Provides centralized error handling, retry mechanisms, and error recovery
+Provides centralized error handling, retry mechanisms, and error recovery.
+
+Every adb call of a device goes through that device's CircuitBreaker (see
+AdbProcess): after CIRCUIT_FAILURE_THRESHOLD consecutive failures the circuit
+opens and calls fail immediately without spawning adb, one probe call is let
+through after the reset timeout, and the timeout doubles (with jitter) each time
+the probe fails. Recovery (reconnect, adb server restart) runs once per trip.
 """
 
 import logging
+import random
+import threading
 import traceback
-import time
 import config
-from typing import Callable, Any, Optional
+from typing import Callable, Any, Dict, Optional
+
+from utils.clock import Clock, system_clock
 
 logger = logging.getLogger(__name__)
 
+
+def backoff_delay(attempt: int, base: float = None, cap: float = None) -> float:
+    """
+    Exponential backoff with jitter: half of min(cap, base * 2**attempt) plus a random
+    share of the other half, so devices failing together do not retry in lockstep.
+    """
+    base = config.ERROR_RETRY_DELAY if base is None else base
+    cap = config.ADB_BACKOFF_MAX if cap is None else cap
+    delay = min(cap, base * (2 ** max(0, attempt)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def classify_adb_error(message: str) -> str:
+    """"offline", "server", "timeout" or "other" from an adb error message"""
+    text = message.lower()
+    if any(s in text for s in ("daemon", "adb server", "protocol fault", "cannot connect", "connection refused")):
+        return "server"
+    if any(s in text for s in ("not found", "offline", "no devices", "unauthorized", "closed")):
+        return "offline"
+    if "timeout" in text or "timed out" in text:
+        return "timeout"
+    return "other"
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one device"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None,
+                 max_reset_timeout: float = None, clock: Clock = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or config.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or config.CIRCUIT_RESET_TIMEOUT
+        self.max_reset_timeout = max_reset_timeout or config.CIRCUIT_MAX_RESET_TIMEOUT
+        self.clock = clock or system_clock
+        self.state = self.CLOSED
+        self.failures = 0  # consecutive failed calls
+        self._trips = 0  # consecutive trips without a success in between
+        self._opened_at = 0.0
+        self._open_for = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "trips": 0}
+
+    def allow(self) -> bool:
+        """Whether a call may go through now; False costs nothing but a lock"""
+        with self._lock:
+            if self.state == self.OPEN and self.clock.monotonic() - self._opened_at >= self._open_for:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+                self.stats["rejected"] += 1
+                return False
+            if self.state == self.HALF_OPEN:
+                self._probing = True  # a single probe at a time
+            self.stats["calls"] += 1
+            return True
+
+    def cancel_probe(self):
+        """Give back a half-open probe whose call ended without a verdict (cancelled half way)"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit of {self.name} closed again")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trips = 0
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """Count a failed call; returns True when this failure opened the circuit"""
+        with self._lock:
+            self.failures += 1
+            self.stats["failures"] += 1
+            if self.state != self.HALF_OPEN and self.failures < self.failure_threshold:
+                return False
+            self.state = self.OPEN
+            self._probing = False
+            self._opened_at = self.clock.monotonic()
+            self._open_for = backoff_delay(self._trips, self.reset_timeout, self.max_reset_timeout)
+            self._trips += 1
+            self.stats["trips"] += 1
+            return True
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe is allowed, 0 when the circuit is not open"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._open_for - self.clock.monotonic())
+
+    def snapshot(self) -> Dict[str, Any]:
+        retry_in = self.retry_in()
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures,
+                    "retry_in": round(retry_in, 1), **self.stats}
+
+
+class DeviceHealth:
+    """Circuit breakers of every device, shared by all AdbProcess instances"""
+
+    def __init__(self, clock: Clock = None):
+        self.clock = clock or system_clock
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, device_id: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(device_id)
+            if breaker is None:
+                breaker = self._breakers[device_id] = CircuitBreaker(device_id, clock=self.clock)
+            return breaker
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {device: breaker.snapshot() for device, breaker in breakers.items()}
+
+
+_default_health = None
+_default_health_lock = threading.Lock()
+
+
+def get_device_health() -> DeviceHealth:
+    """Process-wide device circuit breakers"""
+    global _default_health
+    if _default_health is None:
+        with _default_health_lock:
+            if _default_health is None:
+                _default_health = DeviceHealth()
+    return _default_health
+
+
 class ErrorHandler:
     """Centralized error handling with retry mechanisms"""
     
-    def __init__(self, max_retries: int = None, retry_delay: float = None):
+    def __init__(self, max_retries: int = None, retry_delay: float = None, clock: Clock = None):
         self.max_retries = max_retries or config.MAX_ERROR_RETRIES
         self.retry_delay = retry_delay or config.ERROR_RETRY_DELAY
+        self.clock = clock or system_clock
     
     def retry_operation(self, operation: Callable, *args, **kwargs) -> Optional[Any]:
         """
-        Retry an operation with exponential backoff
+        Retry an operation with jittered exponential backoff
         
         Args:
             operation: Function to retry
@@ -40,10 +188,10 @@ class ErrorHandler:
                 
             except Exception as e:
                 if attempt < self.max_retries:
-                    wait_time = self.retry_delay * (2 ** attempt)  # Exponential backoff
+                    wait_time = backoff_delay(attempt, self.retry_delay)
                     logger.warning(f"Operation failed on attempt {attempt + 1}/{self.max_retries + 1}: {e}")
                     logger.info(f"Retrying in {wait_time:.2f} seconds...")
-                    time.sleep(wait_time)
+                    self.clock.sleep(wait_time)
                 else:
                     logger.error(f"Operation failed after {self.max_retries + 1} attempts. Final error: {e}")
         
@@ -68,7 +216,7 @@ class ErrorHandler:
             logger.error(traceback.format_exc())
             return None
     
-    def handle_device_error(self, device_id: str, error: Exception, operation: str) -> bool:
+    def handle_device_error(self, device_id: str, error: Exception, operation: str, adb_process=None) -> bool:
         """
         Handle device-specific errors with recovery attempts
         
@@ -76,6 +224,7 @@ class ErrorHandler:
             device_id: ID of the device that encountered the error
             error: The error that occurred
             operation: Description of the operation that failed
+            adb_process: AdbProcess used for recovery (reconnect, server restart)
             
         Returns:
             True if error was handled/recovered, False otherwise
@@ -84,17 +233,17 @@ class ErrorHandler:
         logger.error(error_msg)
         
         # Try to recover based on error type
-        if "device not found" in str(error).lower():
+        kind = classify_adb_error(str(error))
+        if kind == "offline":
             logger.info(f"Attempting to reconnect to device {device_id}")
-            # Could implement reconnection logic here
-            return False
-        elif "timeout" in str(error).lower():
+            return adb_process is not None and adb_process.reconnect_device(device_id)
+        elif kind == "timeout":
             logger.info(f"Timeout error for device {device_id}, will retry")
             return True
-        elif "adb server" in str(error).lower():
+        elif kind == "server":
             logger.info(f"ADB server error for device {device_id}, attempting server restart")
-            # Could implement ADB server restart here
-            return False
+            # Only the server owning the device; concurrent restarts of it are skipped
+            return adb_process is not None and adb_process.restart_adb_server(device_id)
         
         return False
 
@@ -0,0 +1,258 @@
+"""
+Shared executor service for Rise of Kingdoms Tool
+Named, bounded thread pools that live for the whole process, so running a task
+never creates a thread:
+
+    device  one long-running worker per started device (run_device_tasks)
+    cpu     template matching fan-out (cv2 releases the GIL while matching)
+    io      ADB and disk side work
+
+Jobs can carry a CancelToken; a job whose token is cancelled before it starts is
+skipped, and running jobs check the token themselves (device loops through a
+CancellableClock, see utils/clock.py). Every device token is a child of the global
+stop token, cancelled when the application closes. Pool counters (active,
+queued, peaks, rejections, threads created) are exposed for the debug dialog.
+"""
+
+import logging
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+import config
+from utils.cpu_budget import pin_current_thread
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturatedError(RuntimeError):
+    """Raised when a pool's queue is full"""
+
+
+class TaskCancelled(BaseException):
+    """
+    Raised inside a worker when its token is cancelled.
+    A BaseException, like KeyboardInterrupt, so the `except Exception` recovery
+    blocks of the tasks do not swallow it and retry.
+    """
+
+
+class CancelToken:
+    """
+    Cooperative cancellation flag; cancelling a token also cancels its children.
+    A parent only holds its children weakly and forgets them once cancelled, so a
+    long-lived token (the global stop token) does not collect finished device jobs.
+    """
+
+    def __init__(self, parent: "CancelToken" = None):
+        self._event = threading.Event()
+        self._children = weakref.WeakSet()
+        self._parent = parent
+        self._lock = threading.Lock()
+        if parent is not None:
+            parent._adopt(self)
+
+    def _adopt(self, child: "CancelToken"):
+        with self._lock:
+            self._children.add(child)
+            cancelled = self._event.is_set()
+        if cancelled:
+            child.cancel()
+
+    def _forget(self, child: "CancelToken"):
+        with self._lock:
+            self._children.discard(child)
+
+    def child(self) -> "CancelToken":
+        """Token cancelled together with this one, but cancellable on its own"""
+        return CancelToken(self)
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            children, self._children = list(self._children), weakref.WeakSet()
+        for child in children:
+            child.cancel()
+        if self._parent is not None:
+            self._parent._forget(self)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Sleep up to `timeout` seconds; returns True as soon as the token is cancelled"""
+        return self._event.wait(timeout)
+
+
+class NamedPool:
+    """
+    Bounded set of daemon worker threads fed from a bounded queue.
+    Workers start on demand up to max_workers and then live for the whole process;
+    being daemons, a device loop still running never blocks the application exit.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._workers = []
+        self._idle = 0
+        self._shutdown = False
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0,
+            "active": 0, "peak_active": 0, "peak_queued": 0, "threads_created": 0,
+        }
+        self._busy_since = None  # when every worker became busy
+        self._saturated_seconds = 0.0
+
+    def submit(self, fn: Callable, *args, token: CancelToken = None, thread_name: str = None,
+               **kwargs) -> Future:
+        """
+        Queue a job. `thread_name` renames the worker while the job runs (the profiler
+        finds device workers by name). Raises PoolSaturatedError when the queue is full.
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError(f"{self.name} pool is shut down")
+            try:
+                self._queue.put_nowait((future, fn, args, kwargs, token, thread_name))
+            except queue.Full:
+                self._stats["rejected"] += 1
+                raise PoolSaturatedError(f"{self.name} pool queue is full ({self.max_queue} jobs)")
+            self._stats["submitted"] += 1
+            self._stats["peak_queued"] = max(self._stats["peak_queued"], self._queue.qsize())
+            if self._idle < self._queue.qsize() and len(self._workers) < self.max_workers:
+                self._start_worker()
+        return future
+
+    def ensure_capacity(self, jobs: int = 1):
+        """Raise max_workers so `jobs` more jobs start right away (jobs that never return, like device loops)"""
+        with self._lock:
+            needed = self._stats["active"] + self._queue.qsize() + jobs
+            if needed > self.max_workers:
+                logger.info(f"{self.name} pool grows from {self.max_workers} to {needed} workers")
+                self.max_workers = needed
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._work, name=f"pool-{self.name}-{len(self._workers)}", daemon=True)
+        self._workers.append(worker)
+        self._stats["threads_created"] += 1
+        worker.start()
+
+    def _work(self):
+        thread = threading.current_thread()
+        pool_name = thread.name
+        cores = config.POOL_AFFINITY.get(self.name)
+        if cores is not None:
+            pin_current_thread(cores)
+        while True:
+            with self._lock:
+                self._idle += 1
+            item = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            if item is None:
+                return
+            future, fn, args, kwargs, token, thread_name = item
+            if (token is not None and token.cancelled) or not future.set_running_or_notify_cancel():
+                with self._lock:
+                    self._stats["cancelled"] += 1
+                if not future.done():
+                    future.cancel()
+                    future.set_running_or_notify_cancel()
+                continue
+
+            with self._lock:
+                self._stats["active"] += 1
+                self._stats["peak_active"] = max(self._stats["peak_active"], self._stats["active"])
+                if self._stats["active"] == self.max_workers:
+                    self._busy_since = time.monotonic()
+            if thread_name:
+                thread.name = thread_name
+            failed = False
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                failed = True
+                future.set_exception(e)
+            finally:
+                thread.name = pool_name
+                with self._lock:
+                    if self._busy_since is not None:
+                        self._saturated_seconds += time.monotonic() - self._busy_since
+                        self._busy_since = None
+                    self._stats["active"] -= 1
+                    self._stats["failed" if failed else "completed"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._stats)
+            saturated = self._saturated_seconds
+            if self._busy_since is not None:
+                saturated += time.monotonic() - self._busy_since
+            metrics["workers"] = self.max_workers
+            metrics["threads"] = len(self._workers)
+        metrics["queued"] = self._queue.qsize()
+        metrics["saturated_seconds"] = round(saturated, 1)
+        return metrics
+
+    def shutdown(self):
+        """Stop idle workers once the queue drains; running jobs are left to their tokens"""
+        with self._lock:
+            self._shutdown = True
+            workers = len(self._workers)
+        for _ in range(workers):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break  # daemon workers still busy are dropped at exit anyway
+
+
+class ExecutorService:
+    """The process-wide set of named pools"""
+
+    def __init__(self, pool_sizes: Dict[str, int] = None, max_queue: int = None):
+        pool_sizes = pool_sizes or config.EXECUTOR_POOLS
+        max_queue = max_queue or config.EXECUTOR_MAX_QUEUE
+        self.pools = {name: NamedPool(name, size, max_queue) for name, size in pool_sizes.items()}
+
+    def pool(self, name: str) -> NamedPool:
+        return self.pools[name]
+
+    def submit(self, pool: str, fn: Callable, *args, **kwargs) -> Future:
+        return self.pools[pool].submit(fn, *args, **kwargs)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.metrics() for name, pool in self.pools.items()}
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown()
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+# Parent of every device token; cancelled once on shutdown
+stop_token = CancelToken()
+
+
+def get_executor() -> ExecutorService:
+    """Process-wide executor service"""
+    global _default_executor
+    if _default_executor is None:
+        with _default_executor_lock:
+            if _default_executor is None:
+                _default_executor = ExecutorService()
+    return _default_executor
@@ -0,0 +1,219 @@
+"""
+Frequency-domain template matching for Rise of Kingdoms Tool
+Computes TM_CCOEFF_NORMED through the frame's DFT, which is taken once per frame and
+reused by every large template matched against it in the same tick. Window energies
+come from integral images, so a template costs one spectrum product per channel and
+one inverse DFT regardless of its size.
+
+Detect uses it for unmasked full-frame matches of templates whose area is at least
+config.FFT_MATCH_MIN_TEMPLATE_AREA; smaller templates stay on direct matchTemplate.
+Pick the threshold for the machine with
+
+    python -m utils.fft_matcher bench [--frame shot.png] [images ...]
+"""
+
+import argparse
+import statistics
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+from utils.template_store import Template
+
+# Template spectra depend only on the template and the DFT size, so they are shared
+# by every device running at the same resolution. Each one is frame-sized (several MB),
+# hence the LRU bound.
+_template_spectra: "OrderedDict[tuple, Tuple[List[np.ndarray], float]]" = OrderedDict()
+_template_spectra_lock = threading.Lock()
+
+
+def _template_spectrum(template: Template, dft_size: Tuple[int, int]) -> Tuple[List[np.ndarray], float]:
+    """Per-channel spectra of the zero-mean template and its energy"""
+    key = (template.path, template.size, dft_size)
+    with _template_spectra_lock:
+        cached = _template_spectra.get(key)
+        if cached is not None:
+            _template_spectra.move_to_end(key)
+            return cached
+
+    th, tw = template.shape[:2]
+    spectra = []
+    energy = 0.0
+    for channel in cv2.split(template.image):
+        centered = channel.astype(np.float32) - float(channel.mean())
+        energy += float(np.dot(centered.ravel(), centered.ravel()))
+        padded = np.zeros(dft_size, np.float32)
+        padded[:th, :tw] = centered
+        spectra.append(cv2.dft(padded))
+
+    with _template_spectra_lock:
+        _template_spectra[key] = (spectra, energy)
+        while len(_template_spectra) > config.FFT_SPECTRUM_CACHE_SIZE:
+            _template_spectra.popitem(last=False)
+    return spectra, energy
+
+
+class FrameSpectrum:
+    """DFT and integral images of one frame"""
+
+    def __init__(self, frame: np.ndarray):
+        height, width = frame.shape[:2]
+        self.shape = (height, width)
+        self.dft_size = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+        channels = cv2.split(frame)
+        self.spectra = []
+        self.integrals = []
+        for channel in channels:
+            padded = np.zeros(self.dft_size, np.float32)
+            # Centering keeps float32 products small; it does not change CCOEFF scores
+            padded[:height, :width] = channel
+            padded[:height, :width] -= float(channel.mean())
+            self.spectra.append(cv2.dft(padded))
+            self.integrals.append(cv2.integral2(channel, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F))
+        self._energies: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def window_energy(self, th: int, tw: int) -> np.ndarray:
+        """Sum over channels of each window's variance times its pixel count"""
+        energy = self._energies.get((th, tw))
+        if energy is not None:
+            return energy
+        height, width = self.shape
+        rh, rw = height - th + 1, width - tw + 1
+        count = float(th * tw)
+        energy = np.zeros((rh, rw), np.float64)
+        for sums, squares in self.integrals:
+            s = sums[th:th + rh, tw:tw + rw] - sums[:rh, tw:tw + rw] - sums[th:th + rh, :rw] + sums[:rh, :rw]
+            q = (squares[th:th + rh, tw:tw + rw] - squares[:rh, tw:tw + rw]
+                 - squares[th:th + rh, :rw] + squares[:rh, :rw])
+            energy += q - s * s / count
+        self._energies[(th, tw)] = energy
+        return energy
+
+
+class FFTMatcher:
+    """Per-detector FFT matcher; keeps the spectrum of the frame it last saw"""
+
+    def __init__(self, min_template_area: int = None):
+        self.min_template_area = config.FFT_MATCH_MIN_TEMPLATE_AREA if min_template_area is None else min_template_area
+        self._frame = None
+        self._spectrum: Optional[FrameSpectrum] = None
+        self._lock = threading.Lock()  # directory checks match templates on the cpu pool
+
+    def wants(self, template: Template) -> bool:
+        """Whether a template is matched faster in the frequency domain"""
+        return template.mask is None and template.shape[0] * template.shape[1] >= self.min_template_area
+
+    def invalidate(self, frame: np.ndarray = None):
+        """Forget the cached frame (only if it is `frame`, when given); needed when a frame buffer is refilled in place"""
+        with self._lock:
+            if frame is not None and self._frame is not frame:
+                return
+            self._frame = None
+            self._spectrum = None
+
+    def spectrum(self, image: np.ndarray) -> FrameSpectrum:
+        with self._lock:
+            if self._frame is not image:
+                self._spectrum = FrameSpectrum(image)
+                self._frame = image
+            return self._spectrum
+
+    def match(self, image: np.ndarray, template: Template) -> np.ndarray:
+        """TM_CCOEFF_NORMED result matrix, same shape and meaning as cv2.matchTemplate"""
+        frame = self.spectrum(image)
+        th, tw = template.shape[:2]
+        height, width = frame.shape
+        spectra, template_energy = _template_spectrum(template, frame.dft_size)
+
+        product = None
+        for frame_channel, template_channel in zip(frame.spectra, spectra):
+            channel = cv2.mulSpectrums(frame_channel, template_channel, 0, conjB=True)
+            product = channel if product is None else cv2.add(product, channel)
+        correlation = cv2.idft(product, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)
+        correlation = correlation[:height - th + 1, :width - tw + 1]
+
+        denominator = np.sqrt(np.maximum(frame.window_energy(th, tw), 0.0) * template_energy)
+        result = np.zeros(correlation.shape, np.float32)
+        # Flat windows (or a flat template) have no defined score; matchTemplate reports ~0 too
+        valid = denominator > 1e-3 * max(template_energy, 1.0)
+        np.divide(correlation, denominator, out=result, where=valid)
+        np.clip(result, -1.0, 1.0, out=result)
+        return result
+
+
+def _time(function, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    # Imported here so the matcher itself does not depend on the template tools
+    from utils.template_store import TemplateStore
+    from utils.template_tools import iter_templates
+
+    parser = argparse.ArgumentParser(description="Direct vs FFT template matching benchmark")
+    parser.add_argument("sub", choices=["bench"])
+    parser.add_argument("paths", nargs="*", default=["images"], help="template files or directories")
+    parser.add_argument("--frame", help="screenshot to match against (random frame by default)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per template and path")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[24, 48, 64, 96, 128, 160, 200, 256],
+                        help="side lengths of extra synthetic square templates")
+    args = parser.parse_args(argv)
+
+    frame = cv2.imread(args.frame) if args.frame else None
+    if frame is None:
+        w, h = config.BASE_RESOLUTION
+        noise = np.random.default_rng(0).integers(0, 255, (h, w, 3), dtype=np.uint8)
+        frame = cv2.GaussianBlur(noise, (5, 5), 0)
+
+    store = TemplateStore()
+    templates = [t for t in (store.get(p) for p in iter_templates(args.paths)) if t is not None and t.mask is None]
+    for side in args.sizes:
+        y, x = (frame.shape[0] - side) // 3, (frame.shape[1] - side) // 3
+        templates.append(Template(f"<synthetic {side}x{side}>", frame[y:y + side, x:x + side].copy()))
+    templates = [t for t in templates if t.shape[0] <= frame.shape[0] and t.shape[1] <= frame.shape[1]]
+    templates.sort(key=lambda t: t.shape[0] * t.shape[1])
+
+    matcher = FFTMatcher(min_template_area=0)
+    frame_cost = _time(lambda: FrameSpectrum(frame), args.repeat)
+    print(f"Frame {frame.shape[1]}x{frame.shape[0]}: spectrum {frame_cost * 1000:.1f} ms once per tick")
+    print(f"{'area':>8} {'direct ms':>10} {'fft ms':>8} {'max diff':>9}  template")
+
+    rows = []
+    for template in templates:
+        direct = cv2.matchTemplate(frame, template.image, cv2.TM_CCOEFF_NORMED)
+        fft = matcher.match(frame, template)  # also warms the spectrum caches
+        diff = float(np.abs(direct - fft).max())
+        direct_cost = _time(lambda: cv2.matchTemplate(frame, template.image, cv2.TM_CCOEFF_NORMED), args.repeat)
+        fft_cost = _time(lambda: matcher.match(frame, template), args.repeat)
+        area = template.shape[0] * template.shape[1]
+        rows.append((area, direct_cost, fft_cost))
+        print(f"{area:>8} {direct_cost * 1000:>10.2f} {fft_cost * 1000:>8.2f} {diff:>9.4f}  {template.path}")
+
+    # Smallest area from which the FFT path wins for (almost) every larger template
+    crossover = None
+    for i, (area, _, _) in enumerate(rows):
+        larger = rows[i:]
+        if sum(1 for _, d, f in larger if f < d) >= 0.9 * len(larger):
+            crossover = area
+            break
+    if crossover is None:
+        print("FFT path never wins here; set FFT_MATCHING_ENABLED = False")
+    else:
+        print(f"Suggested FFT_MATCH_MIN_TEMPLATE_AREA = {crossover} "
+              f"(assumes several templates per frame share the {frame_cost * 1000:.0f} ms spectrum)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+Flow engine for Rise of Kingdoms Tool
+Runs task flows declared as data files (data/flows/*.json) instead of hand-written
+capture -> find -> tap -> sleep loops
+
+A flow is a list of steps. A step may have:
+    name       step name used in logs and timings
+    template   template path (may use {param} placeholders), or a list of paths
+               where the first is the primary and the rest are fallbacks
+    threshold  matching threshold (default: flow or config threshold)
+    timeout    seconds to wait for the template (default: flow or config timeout)
+    action     "tap" (tap the match, default), "wait" (no tap) or {"tap": [x, y]}
+               (fixed points use config.BASE_RESOLUTION coordinates)
+    sleep      seconds to sleep after the action (default: flow delay)
+    optional   if true a missing template does not abort the flow
+    branches   list of {"name", "steps"}; the first step of every branch is polled on
+               the same frame and only the branch that matches first is run
+"""
+
+import json
+import os
+import logging
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import config
+from utils.AdbProcess import AdbProcess
+from utils.Detect import Detect
+from utils.clock import Clock
+from utils.executor import TaskCancelled
+
+logger = logging.getLogger(__name__)
+
+_flow_cache: Dict[str, Dict[str, Any]] = {}
+
+
+def load_flow(name: str, flow_dir: str = None) -> Dict[str, Any]:
+    """Load a flow definition by name, cached after the first read"""
+    flow_dir = flow_dir or config.FLOW_DIRECTORY
+    path = os.path.join(flow_dir, f"{name}.json")
+    if path not in _flow_cache:
+        with open(path, "r", encoding="utf-8") as f:
+            flow = json.load(f)
+        flow.setdefault("name", name)
+        if not isinstance(flow.get("steps"), list):
+            raise ValueError(f"Flow {path} has no step list")
+        _flow_cache[path] = flow
+    return _flow_cache[path]
+
+
+class StepTiming:
+    """Outcome and duration of one executed step"""
+
+    def __init__(self, flow: str, step: str, status: str, elapsed: float):
+        self.flow = flow
+        self.step = step
+        self.status = status
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f"StepTiming({self.flow}.{self.step}, {self.status}, {self.elapsed:.2f}s)"
+
+
+class FlowResult:
+    """Result of a flow run"""
+
+    def __init__(self, flow: str):
+        self.flow = flow
+        self.success = False
+        self.branches: List[str] = []
+        self.timings: List[StepTiming] = []
+
+    def __bool__(self):
+        return self.success
+
+
+class FlowEngine:
+    """Executes flow definitions against one device"""
+
+    def __init__(self, adb_process: AdbProcess, detect: Detect, clock: Clock = None, poll_interval: float = 0.5):
+        self.adb_process = adb_process
+        self.detect = detect
+        self.clock = clock or detect.clock
+        self.poll_interval = poll_interval
+        self.latest_frame = None  # frame shared by every pending check until the next action
+        self._owns_frame = False  # latest_frame was captured here, so it is released here
+        self.step_listeners: List[Callable[[str, StepTiming], None]] = []
+
+    def run(self, flow, device_id: str, params: Dict[str, Any] = None, frame=None) -> FlowResult:
+        """
+        Run a flow on a device.
+        :param flow: Flow name (loaded from the flow directory) or an already loaded definition.
+        :param device_id: Device ID.
+        :param params: Values for {placeholders} in templates, e.g. {"resource": "food"}.
+        :param frame: Optional screenshot that is still current, used for the first check.
+        :return: FlowResult, truthy if every required step completed.
+        """
+        if isinstance(flow, str):
+            flow = load_flow(flow)
+
+        result = FlowResult(flow["name"])
+        self.latest_frame, self._owns_frame = frame, False  # the caller's frame stays the caller's
+        ctx = {
+            "device_id": device_id,
+            "params": params or {},
+            "flow": flow,
+            "result": result,
+        }
+        try:
+            result.success = self._run_steps(flow["steps"], ctx)
+        except TaskCancelled:
+            logger.info(f"Flow {flow['name']} on {device_id}: cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Flow {flow['name']} failed on {device_id}: {e}")
+            logger.error(traceback.format_exc())
+            result.success = False
+        finally:
+            self._drop_latest_frame(device_id)
+
+        total = sum(t.elapsed for t in result.timings)
+        logger.info(f"Flow {flow['name']} on {device_id}: {'done' if result.success else 'aborted'} in {total:.2f}s")
+        return result
+
+    def _run_steps(self, steps: List[Dict[str, Any]], ctx: Dict[str, Any], prefix: str = "") -> bool:
+        for index, step in enumerate(steps):
+            key = self._step_key(steps, index, prefix)
+            if "branches" in step:
+                if not self._run_branches(step, ctx, key):
+                    return False
+                continue
+
+            start = self.clock.monotonic()
+            position = None
+            if "template" in step:
+                threshold = self._setting(step, ctx, "threshold")
+                candidates = [(None, path, threshold) for path in self._templates(step, ctx)]
+                _, position = self._wait_for_any(ctx, candidates, self._timeout(step, ctx, key), step, key)
+                if position is None:
+                    self._emit(ctx, step, "timeout", start)
+                    if step.get("optional"):
+                        continue
+                    return False
+
+            self._perform(step, ctx, position)
+            self._emit(ctx, step, "ok", start)
+        return True
+
+    @staticmethod
+    def _step_key(steps: List[Dict[str, Any]], index: int, prefix: str) -> str:
+        """
+        Latency key of a step: its path through the branches ("dispatch/gather/home"),
+        so waits reusing a step name in several places are learned apart.
+        """
+        name = steps[index].get("name", str(index))
+        if any(other.get("name") == name for other in steps[:index]):
+            name = f"{name}#{index}"
+        return prefix + name
+
+    def _run_branches(self, step: Dict[str, Any], ctx: Dict[str, Any], key: str) -> bool:
+        """Poll the first step of every branch on the same frame, then run the winner"""
+        start = self.clock.monotonic()
+        candidates = []
+        for index, branch in enumerate(step["branches"]):
+            trigger = branch["steps"][0]
+            threshold = self._setting(trigger, ctx, "threshold")
+            for path in self._templates(trigger, ctx):
+                candidates.append((index, path, threshold))
+
+        winner, position = self._wait_for_any(ctx, candidates, self._timeout(step, ctx, key), step, key)
+        if winner is None:
+            self._emit(ctx, step, "timeout", start)
+            return bool(step.get("optional"))
+
+        branch = step["branches"][winner]
+        ctx["result"].branches.append(branch["name"])
+        trigger = branch["steps"][0]
+        self._perform(trigger, ctx, position)
+        self._emit(ctx, {"name": f"{step.get('name', 'branch')}:{branch['name']}"}, "ok", start)
+        return self._run_steps(branch["steps"][1:], ctx, f"{key}/{branch['name']}/")
+
+    def _wait_for_any(self, ctx, candidates: List[Tuple[Any, str, float]], timeout: float, step: Dict[str, Any],
+                      key: str):
+        """
+        Wait until one of the candidate templates is found.
+        Every candidate is checked against the same frame before a new one is captured.
+        The wait duration is fed to the latency tracker under `key`; a required step that
+        times out is recorded as a censored sample (it would have taken longer).
+        :return: (key, position) of the first match, or (None, None) on timeout.
+        """
+        device_id = ctx["device_id"]
+        start = self.clock.monotonic()
+        while True:
+            frame = self.latest_frame
+            if frame is None:
+                frame = self.adb_process.capture(device_id)
+                self.latest_frame, self._owns_frame = frame, frame is not None
+
+            if frame is not None:
+                for candidate, path, threshold in candidates:
+                    position = self.detect.find_object_position(frame, path, threshold, device_id)
+                    if position is not None:
+                        tracker = self.detect.latency_tracker
+                        if tracker is not None:
+                            tracker.record(device_id, ctx["flow"]["name"], key, self.clock.monotonic() - start)
+                        return candidate, position
+
+            elapsed = self.clock.monotonic() - start
+            if elapsed > timeout:
+                tracker = self.detect.latency_tracker
+                if tracker is not None and not step.get("optional"):
+                    tracker.record(device_id, ctx["flow"]["name"], key, elapsed, timed_out=True)
+                return None, None
+
+            self._drop_latest_frame(device_id)
+            self.clock.sleep(self.poll_interval)
+
+    def _perform(self, step: Dict[str, Any], ctx: Dict[str, Any], position: Optional[Tuple[int, int]]):
+        """Run the step action and its trailing sleep"""
+        action = step.get("action", "tap" if "template" in step else "wait")
+        tapped = False
+        if isinstance(action, dict) and "tap" in action:
+            # Fixed coordinates are authored for the base resolution
+            self.adb_process.tap(ctx["device_id"], *self.detect.screen.point(*action["tap"]))
+            tapped = True
+        elif action == "tap" and position is not None:
+            self.adb_process.tap(ctx["device_id"], *position)
+            tapped = True
+
+        if tapped:
+            # The screen is about to change, the shared frame is stale
+            self._drop_latest_frame(ctx["device_id"])
+            self.clock.sleep(self._setting(step, ctx, "sleep"))
+        elif "sleep" in step:
+            self.clock.sleep(step["sleep"])
+
+    def _drop_latest_frame(self, device_id: str):
+        """Forget the shared frame, handing it back to the frame pool if it was captured here"""
+        frame, owned = self.latest_frame, self._owns_frame
+        self.latest_frame, self._owns_frame = None, False
+        if owned:
+            self.adb_process.release_frame(device_id, frame)
+
+    def _templates(self, step: Dict[str, Any], ctx: Dict[str, Any]) -> List[str]:
+        templates = step["template"]
+        if isinstance(templates, str):
+            templates = [templates]
+        templates = templates + step.get("fallbacks", [])
+        return [t.format(**ctx["params"]) for t in templates]
+
+    def _timeout(self, step: Dict[str, Any], ctx: Dict[str, Any], key: str) -> float:
+        """Step timeout, replaced by the learned value once the tracker has enough samples"""
+        timeout = self._setting(step, ctx, "timeout")
+        tracker = self.detect.latency_tracker
+        if tracker is None:
+            return timeout
+        return tracker.timeout_for(ctx["device_id"], ctx["flow"]["name"], key, timeout)
+
+    def _setting(self, step: Dict[str, Any], ctx: Dict[str, Any], key: str):
+        """Resolve a step setting from the step, then the flow defaults, then config"""
+        if key in step:
+            return step[key]
+        defaults = ctx["flow"].get("defaults", {})
+        if key == "sleep":
+            return defaults.get("delay", 0)
+        if key in defaults:
+            return defaults[key]
+        if key == "threshold":
+            return config.TEMPLATE_MATCHING_THRESHOLD
+        if key == "timeout":
+            return config.TEMPLATE_SEARCH_TIMEOUT
+        raise KeyError(key)
+
+    def _emit(self, ctx: Dict[str, Any], step: Dict[str, Any], status: str, start: float):
+        """Record the step timing and notify listeners"""
+        timing = StepTiming(ctx["flow"]["name"], step.get("name", "?"), status, self.clock.monotonic() - start)
+        ctx["result"].timings.append(timing)
+        logger.debug(f"Flow {timing.flow} step {timing.step} on {ctx['device_id']}: {status} in {timing.elapsed:.2f}s")
+        for listener in self.step_listeners:
+            try:
+                listener(ctx["device_id"], timing)
+            except Exception as e:
+                logger.warning(f"Step listener failed: {e}")
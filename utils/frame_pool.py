@@ -0,0 +1,303 @@
+"""
+Frame buffer pool for Rise of Kingdoms Tool
+Screenshots are captured as raw `screencap` output (no PNG encode on the device,
+no decode on the host) straight into a preallocated read buffer, then converted
+into a pooled BGR frame with cv2.cvtColor(dst=...). Read buffers are shared by
+all devices (only a few captures are in flight at once), frames are per device.
+A device loop allocates nothing per capture once the pools are warm:
+
+    frame = adb.capture(device)        # acquire: a free pooled frame is refilled
+    ...match...
+    adb.release_frame(device, frame)   # release: the frame may be refilled next
+
+Only the owner of a frame releases it, and only once nothing uses it any more.
+A frame that is never released is simply garbage collected; the pool allocates a
+new one. Released frames are announced to listeners first, so caches keyed by
+frame identity (FFTMatcher) drop them before the buffer is refilled in place.
+
+    python -m utils.frame_pool bench [--devices 50] [--seconds 10] [--frame screenshot.png]
+"""
+
+import argparse
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+
+# screencap pixel formats (android.graphics.PixelFormat) -> conversion to BGR
+RAW_FORMATS = {
+    1: cv2.COLOR_RGBA2BGR,  # RGBA_8888
+    2: cv2.COLOR_RGBA2BGR,  # RGBX_8888
+    5: cv2.COLOR_BGRA2BGR,  # BGRA_8888
+}
+RAW_HEADER_SIZE = 12  # width, height, format; newer Android adds a 4-byte color space
+RAW_BUFFERS_KEPT = 4  # idle read buffers kept for the next captures
+
+_raw_buffers: List[np.ndarray] = []
+_raw_buffers_lock = threading.Lock()
+_raw_stats = {"allocated": 0}
+
+
+def _read_into(stream, view: memoryview) -> int:
+    """Fill `view` from a binary stream; returns the byte count (short at end of stream)"""
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+class FramePool:
+    """Reusable BGR frames and the raw read buffer of one device"""
+
+    def __init__(self, capacity: int = None):
+        self.capacity = config.FRAME_POOL_SIZE if capacity is None else capacity
+        self._header = bytearray(RAW_HEADER_SIZE)
+        self._free: List[np.ndarray] = []
+        # Frames handed out and not released yet. Weak: a frame that is never released is
+        # collected, and a new array that gets its id is not mistaken for it
+        self._out: "weakref.WeakValueDictionary[int, np.ndarray]" = weakref.WeakValueDictionary()
+        self._listeners: List[Callable[[np.ndarray], None]] = []
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "reused": 0, "allocated": 0, "released": 0}
+
+    def add_release_listener(self, listener: Callable[[np.ndarray], None]):
+        """Called with every released frame, before it can be refilled"""
+        self._listeners.append(listener)
+
+    def acquire(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """A frame of `shape`, reused when one is free"""
+        with self._lock:
+            self._stats["acquired"] += 1
+            for i, frame in enumerate(self._free):
+                if frame.shape == shape:
+                    del self._free[i]
+                    self._out[id(frame)] = frame
+                    self._stats["reused"] += 1
+                    return frame
+            self._stats["allocated"] += 1
+        frame = np.empty(shape, np.uint8)
+        with self._lock:
+            self._out[id(frame)] = frame
+        return frame
+
+    def release(self, frame: Optional[np.ndarray]):
+        """Give a frame back; frames not from this pool and second releases are ignored"""
+        if frame is None:
+            return
+        with self._lock:
+            if self._out.get(id(frame)) is not frame:
+                return
+            del self._out[id(frame)]
+            self._stats["released"] += 1
+            keep = len(self._free) < self.capacity
+        for listener in self._listeners:
+            listener(frame)
+        if keep:
+            with self._lock:
+                self._free.append(frame)
+
+    @contextmanager
+    def read_raw(self, stream) -> Iterator[Optional[Tuple[np.ndarray, int]]]:
+        """
+        Read one raw screencap from a binary stream into a shared read buffer.
+        Yields (RGBA pixels of shape (h, w, 4), format), or None for a short or bad
+        stream; the pixels are only valid inside the block.
+        """
+        if _read_into(stream, memoryview(self._header)) < RAW_HEADER_SIZE:
+            yield None
+            return
+        width, height, fmt = struct.unpack_from("<III", self._header)
+        size = width * height * 4
+        if size == 0:
+            yield None
+            return
+        buffer = _take_raw_buffer(size + 4)
+        try:
+            count = _read_into(stream, memoryview(buffer)[:size + 4])
+            if count == size + 4:
+                pixels = buffer[4:size + 4]  # skip the color space word
+            elif count == size:
+                pixels = buffer[:size]
+            else:
+                pixels = None
+            yield None if pixels is None else (pixels.reshape(height, width, 4), fmt)
+        finally:
+            _give_back_raw_buffer(buffer)
+
+    def to_bgr(self, pixels: np.ndarray, fmt: int) -> Optional[np.ndarray]:
+        """Convert raw pixels into a pooled BGR frame; None for an unknown pixel format"""
+        code = RAW_FORMATS.get(fmt)
+        if code is None:
+            return None
+        frame = self.acquire((pixels.shape[0], pixels.shape[1], 3))
+        cv2.cvtColor(pixels, code, dst=frame)
+        return frame
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics["free"] = len(self._free)
+            metrics["out"] = len(self._out)
+        return metrics
+
+
+def _take_raw_buffer(size: int) -> np.ndarray:
+    with _raw_buffers_lock:
+        for i, buffer in enumerate(_raw_buffers):
+            if buffer.size >= size:
+                return _raw_buffers.pop(i)
+        _raw_stats["allocated"] += 1
+    return np.empty(size, np.uint8)
+
+
+def _give_back_raw_buffer(buffer: np.ndarray):
+    with _raw_buffers_lock:
+        if len(_raw_buffers) < RAW_BUFFERS_KEPT:
+            _raw_buffers.append(buffer)
+
+
+# ---------------- benchmark ----------------
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _bench_frame(path: Optional[str]) -> np.ndarray:
+    frame = cv2.imread(path) if path else None
+    if frame is None:
+        w, h = config.BASE_RESOLUTION
+        # Smooth synthetic frame: compresses roughly like a game screenshot
+        x = np.linspace(0, 255, w, dtype=np.float32)
+        y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+        frame = np.dstack([(x + y) / 2, np.abs(x - y), 255 - (x + y) / 2]).astype(np.uint8)
+        for i in range(40):
+            cv2.rectangle(frame, (i * 31 % w, i * 17 % h), (i * 31 % w + 60, i * 17 % h + 40), (i * 6 % 255, 80, 200), -1)
+    return frame
+
+
+def _run_mode(mode: str, devices: int, seconds: float, rate: float, frame_path: Optional[str]) -> Dict[str, Any]:
+    """Capture loop of `devices` threads fed from in-memory screencap output"""
+    import io
+    from utils.governor import TokenBucket
+
+    admission = TokenBucket("captures", rate, config.GOVERNOR_CAPTURE_BURST)
+
+    frame = _bench_frame(frame_path)
+    h, w = frame.shape[:2]
+    png = cv2.imencode(".png", frame)[1].tobytes()
+    rgba = cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
+    raw = struct.pack("<IIII", w, h, 1, 0) + rgba.tobytes()
+
+    pools = [FramePool() for _ in range(devices)]
+    counts = [0] * devices
+    deadline = 0.0
+
+    def capture(index):
+        if mode == "png":
+            data = bytes(memoryview(png))  # subprocess.run output: a new bytes object
+            return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        pool = pools[index]
+        with pool.read_raw(io.BytesIO(raw)) as read:
+            return pool.to_bgr(*read)
+
+    def loop(index):
+        while time.perf_counter() < deadline:
+            admission.acquire(index)
+            if time.perf_counter() >= deadline:
+                break
+            img = capture(index)
+            cv2.matchTemplate(img[:64, :64], img[:8, :8], cv2.TM_CCOEFF_NORMED)  # touch the frame
+            if mode == "raw":
+                pools[index].release(img)
+            counts[index] += 1
+
+    # Bytes allocated by one capture, measured on a warm pool
+    img = capture(0)
+    if mode == "raw":
+        pools[0].release(img)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    img = capture(0)
+    per_capture = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    if mode == "raw":
+        pools[0].release(img)
+
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(devices)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    allocated = sum(pool.metrics()["allocated"] for pool in pools) + _raw_stats["allocated"]
+    captures_per_s = sum(counts) / seconds
+    return {"mode": mode, "captures_per_s": captures_per_s, "bytes_per_capture": per_capture,
+            "alloc_mb_per_s": captures_per_s * per_capture / 1e6, "rss_mb": (_rss_bytes() or 0) / 1e6,
+            "buffers_allocated": allocated}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Frame pool tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="allocation rate and RSS, PNG decode vs pooled raw frames")
+    bench.add_argument("--devices", type=int, default=50)
+    bench.add_argument("--seconds", type=float, default=10.0)
+    bench.add_argument("--rate", type=float, default=config.GOVERNOR_CAPTURES_PER_SECOND,
+                       help="fleet captures per second as admitted by the governor, 0 = unthrottled")
+    bench.add_argument("--frame", help="screenshot used as the device screen (synthetic by default)")
+    run = sub.add_parser("run")  # one mode in a fresh process, so RSS is not shared
+    run.add_argument("mode", choices=["png", "raw"])
+    run.add_argument("devices", type=int)
+    run.add_argument("seconds", type=float)
+    run.add_argument("rate", type=float)
+    run.add_argument("--frame")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        print(json.dumps(_run_mode(args.mode, args.devices, args.seconds, args.rate, args.frame)))
+        return 0
+
+    print(f"{args.devices} simulated devices, {args.seconds:g}s per mode, "
+          f"{'unthrottled' if args.rate <= 0 else f'{args.rate:g} captures/s admitted'}")
+    print(f"{'mode':>5} {'capt/s':>8} {'KB/capture':>11} {'alloc MB/s':>11} {'RSS MB':>8} {'buffers alloc':>14}")
+    for mode in ("png", "raw"):
+        command = [sys.executable, "-m", "utils.frame_pool", "run", mode, str(args.devices), str(args.seconds),
+                   str(args.rate)]
+        if args.frame:
+            command += ["--frame", args.frame]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"{mode:>5} failed: {result.stderr.strip()}")
+            continue
+        r = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:>5} {r['captures_per_s']:>8.1f} {r['bytes_per_capture'] / 1024:>11.1f} "
+              f"{r['alloc_mb_per_s']:>11.1f} {r['rss_mb']:>8.1f} {r['buffers_allocated']:>14}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+Fleet governor for Rise of Kingdoms Tool
+Admission control shared by every device worker, so a fleet of devices does not
+hit `adb exec-out screencap` and cv2.matchTemplate in the same instant:
+
+    captures  token bucket, GOVERNOR_CAPTURES_PER_SECOND with a small burst
+    decodes   concurrent PNG decodes of captured frames
+    matches   concurrent template matches (a directory fan-out holds one slot per match)
+
+Permits are handed out round-robin by device: a device waiting for a slot is served
+before a device that just had one, however many requests the latter queued. Waits
+go through the worker's clock, so a stopped device leaves the queue right away.
+A limit of 0 disables that limiter.
+"""
+
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable
+
+import config
+from utils.clock import Clock
+
+
+class _Ticket:
+    __slots__ = ("key", "granted")
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.granted = False
+
+
+class FairLimiter:
+    """Base of the limiters: permits go to the waiting keys in turn"""
+
+    def __init__(self, name: str, limit: float):
+        self.name = name
+        self.limit = limit
+        self._cond = threading.Condition()
+        self._waiting: "OrderedDict[Hashable, deque]" = OrderedDict()  # key -> tickets, in turn order
+        self._waits = deque(maxlen=500)  # recent wait times for the percentiles
+        self._stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "max_wait": 0.0, "peak_waiting": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def _has_permit(self) -> bool:
+        raise NotImplementedError
+
+    def _take_permit(self):
+        raise NotImplementedError
+
+    def _give_back(self):
+        """Undo _take_permit for a ticket granted while its waiter was being cancelled"""
+
+    def _next_permit_in(self) -> float:
+        """Seconds until a permit may free up without a release (token refill)"""
+        return config.CANCEL_POLL_INTERVAL
+
+    def acquire(self, key: Hashable, clock: Clock = None) -> float:
+        """Block until `key` gets a permit; returns the seconds spent waiting"""
+        if not self.enabled:
+            return 0.0
+        start = time.monotonic()
+        ticket = _Ticket(key)
+        with self._cond:
+            self._waiting.setdefault(key, deque()).append(ticket)
+            self._grant()
+            try:
+                while not ticket.granted:
+                    self._stats["peak_waiting"] = max(self._stats["peak_waiting"], self._waiting_count())
+                    self._cond.wait(min(self._next_permit_in(), config.CANCEL_POLL_INTERVAL))
+                    if clock is not None:
+                        clock.check_cancelled()
+                    self._grant()
+            except BaseException:
+                if ticket.granted:
+                    self._give_back()
+                    self._grant()
+                else:
+                    self._drop(ticket)
+                raise
+            waited = time.monotonic() - start
+            self._stats["acquired"] += 1
+            if waited > 0.001:
+                self._stats["waited"] += 1
+                self._stats["wait_seconds"] += waited
+                self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+            self._waits.append(waited)
+        return waited
+
+    def _grant(self):
+        """Hand out free permits, one per key in turn; caller holds the condition"""
+        granted = False
+        while self._waiting and self._has_permit():
+            key, tickets = next(iter(self._waiting.items()))
+            ticket = tickets.popleft()
+            del self._waiting[key]
+            if tickets:
+                self._waiting[key] = tickets  # back of the line for its next request
+            self._take_permit()
+            ticket.granted = True
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _drop(self, ticket: _Ticket):
+        tickets = self._waiting.get(ticket.key)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._waiting[ticket.key]
+
+    def _waiting_count(self) -> int:
+        return sum(len(tickets) for tickets in self._waiting.values())
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            metrics = dict(self._stats)
+            waits = sorted(self._waits)
+            metrics["waiting"] = self._waiting_count()
+        metrics["limit"] = self.limit
+        metrics["wait_seconds"] = round(metrics["wait_seconds"], 2)
+        metrics["max_wait"] = round(metrics["max_wait"], 3)
+        metrics["p50_wait"] = round(statistics.median(waits), 3) if waits else 0.0
+        metrics["p95_wait"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0
+        return metrics
+
+
+class FairSemaphore(FairLimiter):
+    """At most `limit` holders at a time"""
+
+    def __init__(self, name: str, limit: int):
+        super().__init__(name, limit)
+        self._in_use = 0
+
+    def _has_permit(self) -> bool:
+        return self._in_use < self.limit
+
+    def _take_permit(self):
+        self._in_use += 1
+
+    def _give_back(self):
+        self._in_use -= 1
+
+    def release(self):
+        if not self.enabled:
+            return
+        with self._cond:
+            self._in_use -= 1
+            self._grant()
+
+    @contextmanager
+    def slot(self, key: Hashable, clock: Clock = None):
+        """Hold a permit for the duration of the block"""
+        self.acquire(key, clock)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics = super().metrics()
+        with self._cond:
+            metrics["in_use"] = self._in_use
+        return metrics
+
+
+class TokenBucket(FairLimiter):
+    """`limit` permits per second with bursts of up to `burst`"""
+
+    def __init__(self, name: str, rate: float, burst: float):
+        super().__init__(name, rate)
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.limit)
+        self._updated = now
+
+    def _has_permit(self) -> bool:
+        self._refill()
+        return self._tokens >= 1.0
+
+    def _take_permit(self):
+        self._tokens -= 1.0
+
+    def _give_back(self):
+        self._tokens += 1.0
+
+    def _next_permit_in(self) -> float:
+        return max(0.001, (1.0 - self._tokens) / self.limit)
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics = super().metrics()
+        with self._cond:
+            self._refill()
+            metrics["tokens"] = round(self._tokens, 1)
+        return metrics
+
+
+class Governor:
+    """The fleet-wide limiters"""
+
+    def __init__(self, captures_per_second: float = None, capture_burst: float = None,
+                 max_decodes: int = None, max_matches: int = None):
+        self.captures = TokenBucket(
+            "captures",
+            config.GOVERNOR_CAPTURES_PER_SECOND if captures_per_second is None else captures_per_second,
+            config.GOVERNOR_CAPTURE_BURST if capture_burst is None else capture_burst)
+        self.decodes = FairSemaphore("decodes", config.GOVERNOR_MAX_DECODES if max_decodes is None else max_decodes)
+        self.matches = FairSemaphore("matches", config.GOVERNOR_MAX_MATCHES if max_matches is None else max_matches)
+
+    def admit_capture(self, device: Hashable, clock: Clock = None) -> float:
+        """Wait for the device's turn to take a screenshot"""
+        return self.captures.acquire(device, clock)
+
+    def decode(self, device: Hashable, clock: Clock = None):
+        return self.decodes.slot(device, clock)
+
+    def match(self, device: Hashable, clock: Clock = None):
+        return self.matches.slot(device, clock)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {limiter.name: limiter.metrics() for limiter in (self.captures, self.decodes, self.matches)}
+
+
+_default_governor = None
+_default_governor_lock = threading.Lock()
+
+
+def get_governor() -> Governor:
+    """Process-wide fleet governor"""
+    global _default_governor
+    if _default_governor is None:
+        with _default_governor_lock:
+            if _default_governor is None:
+                _default_governor = Governor()
+    return _default_governor
@@ -0,0 +1,57 @@
+"""
+Input latency benchmark for Rise of Kingdoms Tool
+Compares a gesture group sent as separate `adb shell input` calls with the same
+group sent as one input script (AdbProcess.run_input_script).
+
+    python -m utils.input_bench DEVICE [--taps 2] [--runs 10] [--x 640 --y 20]
+
+Pick a point where taps are harmless (the default is the top edge of the screen).
+Host-side sleeps are skipped so only the adb round-trips are measured.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+import config
+from utils.AdbProcess import AdbProcess
+from utils.clock import VirtualClock
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sequential taps vs one input script")
+    parser.add_argument("device", help="device serial")
+    parser.add_argument("--taps", type=int, default=2, help="taps per gesture group")
+    parser.add_argument("--runs", type=int, default=10, help="gesture groups per mode")
+    parser.add_argument("--x", type=int, default=config.BASE_RESOLUTION[0] // 2)
+    parser.add_argument("--y", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    # A virtual clock turns the post-tap settle sleeps into no-ops
+    adb = AdbProcess(adb_path=config.ADB_PATH, clock=VirtualClock())
+    group = [("tap", args.x, args.y)] * args.taps
+
+    sequential, scripted = [], []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        for _, x, y in group:
+            adb.tap(args.device, x, y)
+        sequential.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        if not adb.run_input_script(args.device, group, settle=0):
+            print("Input script failed, see the log")
+            return 1
+        scripted.append(time.perf_counter() - start)
+
+    seq_ms = statistics.median(sequential) * 1000
+    script_ms = statistics.median(scripted) * 1000
+    print(f"{args.taps} taps per group, median of {args.runs}:")
+    print(f"  sequential taps: {seq_ms:7.1f} ms")
+    print(f"  input script:    {script_ms:7.1f} ms ({seq_ms / script_ms:.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
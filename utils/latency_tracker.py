@@ -0,0 +1,146 @@
+"""
+Latency tracker for Rise of Kingdoms Tool
+Learns how long each (task, step) wait really takes per device and derives adaptive
+timeouts from it, so dead ends are abandoned quickly while slow devices keep enough time.
+Waits that timed out are kept as censored samples (the real wait was longer): when
+they reach the percentile the timeout grows instead of staying biased low.
+"""
+
+import json
+import os
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Per-device history of successful wait durations with percentile based timeouts"""
+
+    def __init__(self, path: str = None, percentile: float = None, factor: float = None,
+                 floor: float = None, min_samples: int = None, max_scale: float = None,
+                 history_size: int = None):
+        self.path = path or config.LATENCY_FILE_PATH
+        self.percentile = percentile or config.ADAPTIVE_TIMEOUT_PERCENTILE
+        self.factor = factor or config.ADAPTIVE_TIMEOUT_FACTOR
+        self.floor = floor if floor is not None else config.ADAPTIVE_TIMEOUT_FLOOR
+        self.min_samples = min_samples or config.ADAPTIVE_TIMEOUT_MIN_SAMPLES
+        self.max_scale = max_scale or config.ADAPTIVE_TIMEOUT_MAX_SCALE
+        self.history_size = history_size or config.LATENCY_HISTORY_SIZE
+
+        self._samples: Dict[str, Dict[str, deque]] = {}
+        self._learned: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # every device thread saves to the same file
+        self._dirty = 0
+        self.load()
+
+    @staticmethod
+    def step_key(task: str, step: str) -> str:
+        return f"{task}.{step}"
+
+    def record(self, device_id: str, task: str, step: str, elapsed: float, timed_out: bool = False):
+        """Record the duration of a wait that found its target, or that gave up after `elapsed`"""
+        key = self.step_key(task, step)
+        with self._lock:
+            history = self._samples.setdefault(device_id, {}).setdefault(
+                key, deque(maxlen=self.history_size))
+            history.append((round(elapsed, 3), timed_out))
+            if len(history) >= self.min_samples:
+                self._learned.setdefault(device_id, {})[key] = self._percentile(history) * self.factor
+            self._dirty += 1
+            should_save = self._dirty >= config.LATENCY_SAVE_INTERVAL
+
+        if should_save:
+            self.save()
+
+    def timeout_for(self, device_id: str, task: str, step: str, default: float) -> float:
+        """
+        Timeout to use for a wait.
+        Falls back to `default` until enough samples exist, never goes below the floor
+        and never above `default * max_scale`.
+        """
+        with self._lock:
+            learned = self._learned.get(device_id, {}).get(self.step_key(task, step))
+        if learned is None:
+            return default
+        return min(max(learned, self.floor), default * self.max_scale)
+
+    def _percentile(self, history) -> float:
+        """
+        Percentile of (elapsed, timed_out) samples; a timed-out sample ranks above every
+        completed one. Landing on one gives its elapsed time, a lower bound that the
+        factor then grows.
+        """
+        ordered = sorted(history, key=lambda sample: (sample[1], sample[0]))
+        index = min(len(ordered) - 1, int(round(self.percentile / 100.0 * (len(ordered) - 1))))
+        if ordered[index][1]:
+            return max(sample[0] for sample in ordered[index:])
+        return ordered[index][0]
+
+    def load(self) -> bool:
+        """Load learned histories from disk"""
+        try:
+            if not os.path.exists(self.path):
+                return False
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self._lock:
+                for device_id, steps in data.get("devices", {}).items():
+                    for key, entry in steps.items():
+                        timed_out = set(entry.get("timed_out", []))
+                        history = deque(((elapsed, i in timed_out) for i, elapsed in enumerate(entry.get("samples", []))),
+                                        maxlen=self.history_size)
+                        self._samples.setdefault(device_id, {})[key] = history
+                        if len(history) >= self.min_samples:
+                            self._learned.setdefault(device_id, {})[key] = self._percentile(history) * self.factor
+            logger.info(f"Step latencies loaded from {self.path}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load step latencies: {e}")
+            return False
+
+    def save(self) -> bool:
+        """Persist histories and the derived timeouts"""
+        try:
+            with self._lock:
+                data = {
+                    "last_updated": datetime.now().isoformat(),
+                    "devices": {
+                        device_id: {
+                            key: {
+                                "samples": [elapsed for elapsed, _ in history],
+                                "timed_out": [i for i, (_, timed_out) in enumerate(history) if timed_out],
+                                "timeout": self._learned.get(device_id, {}).get(key),
+                            }
+                            for key, history in steps.items()
+                        }
+                        for device_id, steps in self._samples.items()
+                    }
+                }
+                self._dirty = 0
+
+            # Whole file or nothing: write a temporary file and swap it in
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with self._save_lock:
+                temp_path = f"{self.path}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                os.replace(temp_path, self.path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save step latencies: {e}")
+            return False
+
+    def get_summary(self, device_id: str) -> Dict[str, Optional[float]]:
+        """Learned timeout per step for a device (None while still learning)"""
+        with self._lock:
+            return {
+                key: self._learned.get(device_id, {}).get(key)
+                for key in self._samples.get(device_id, {})
+            }
@@ -0,0 +1,224 @@
+"""
+March schedule for Rise of Kingdoms Tool
+Remembers every gathering march the farm task sends (when, and to which resource)
+and learns per device and resource how long a march takes to gather and come back.
+The device loop only reads the army slots once a march is due back:
+
+    due      dispatch time + MARCH_DUE_FACTOR x the MARCH_ESTIMATE_PERCENTILE of the
+             learned durations; set a little early, so a march that comes back
+             sooner than usual still lowers the estimate
+    overdue  and marches with no learned duration yet: checked every MARCH_POLL_INTERVAL
+    unknown  fewer marches on record than the farm keeps out: checked every tick while
+             the slot is free, every MARCH_POLL_INTERVAL while armies sent before the
+             tool started hold it
+
+A learned duration is the time from dispatch to the check that found the slot
+free, so it is at most one poll interval late.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import config
+from utils.clock import Clock, system_clock
+
+logger = logging.getLogger(__name__)
+
+
+class March:
+    __slots__ = ("resource", "dispatched_at", "due_at")
+
+    def __init__(self, resource: str, dispatched_at: float, due_at: float):
+        self.resource = resource
+        self.dispatched_at = dispatched_at
+        self.due_at = due_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"resource": self.resource, "dispatched_at": self.dispatched_at, "due_at": self.due_at}
+
+
+class MarchSchedule:
+    """Pending marches and learned march durations of every device"""
+
+    def __init__(self, path: str = None, clock: Clock = None, enabled: bool = None):
+        self.path = path or config.MARCH_FILE_PATH
+        self.clock = clock or system_clock
+        self.enabled = config.MARCH_TRACKING if enabled is None else enabled
+        self._marches: Dict[str, List[March]] = {}
+        self._durations: Dict[str, Dict[str, deque]] = {}  # device -> resource -> seconds
+        self._next_check: Dict[str, float] = {}  # device -> earliest check while nothing is due
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # every device thread saves to the same file
+        self._stats = {"checks": 0, "skipped": 0, "dispatched": 0, "returned": 0, "expired": 0}
+        if self.enabled:
+            self.load()
+
+    def estimate(self, device: str, resource: str) -> Optional[float]:
+        """Expected seconds from dispatch to the slot being free again (None while learning)"""
+        with self._lock:
+            return self._estimate(device, resource)
+
+    def _estimate(self, device: str, resource: str) -> Optional[float]:
+        history = self._durations.get(device, {}).get(resource)
+        if not history or len(history) < config.MARCH_MIN_SAMPLES:
+            return None
+        ordered = sorted(history)
+        index = min(len(ordered) - 1, int(round(config.MARCH_ESTIMATE_PERCENTILE / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def dispatched(self, device: str, resource: str):
+        """Record a march that just left"""
+        if not self.enabled:
+            return
+        now = self.clock.time()
+        with self._lock:
+            estimate = self._estimate(device, resource)
+            due = now + (estimate * config.MARCH_DUE_FACTOR if estimate is not None else config.MARCH_POLL_INTERVAL)
+            self._marches.setdefault(device, []).append(March(resource, now, due))
+            self._next_check.pop(device, None)
+            self._stats["dispatched"] += 1
+        logger.info(f"March to {resource} sent on {device}, "
+                    f"{'due back in %.0fs' % (due - now) if estimate is not None else 'duration not learned yet'}")
+        self.save()
+
+    def check_due(self, device: str, armies: int) -> bool:
+        """
+        True if the army slots of the device should be read on this tick.
+        :param armies: marches the farm task keeps out; with fewer on record a slot is
+            free right away (or taken by armies sent before the tool started).
+        """
+        if not self.enabled:
+            return True
+        now = self.clock.time()
+        with self._lock:
+            self._expire(device, now)
+            marches = self._marches.get(device, [])
+            if len(marches) < armies:
+                due = self._next_check.get(device, now)
+            else:
+                due = min(march.due_at for march in marches)
+            if now >= due:
+                self._stats["checks"] += 1
+                return True
+            self._stats["skipped"] += 1
+            return False
+
+    def observed(self, device: str, armies: int, slot_free: bool):
+        """Result of a slot check made because check_due() said so"""
+        if not self.enabled:
+            return
+        now = self.clock.time()
+        learned = None
+        with self._lock:
+            marches = self._marches.get(device, [])
+            if slot_free:
+                self._next_check.pop(device, None)
+                if marches and len(marches) >= armies:
+                    # Every march was out, so one came back: the one expected back first
+                    march = min(marches, key=lambda m: m.due_at)
+                    marches.remove(march)
+                    learned = (march.resource, now - march.dispatched_at)
+                    history = self._durations.setdefault(device, {}).setdefault(
+                        march.resource, deque(maxlen=config.MARCH_HISTORY_SIZE))
+                    history.append(round(learned[1], 1))
+                    self._stats["returned"] += 1
+            elif len(marches) < armies:
+                self._next_check[device] = now + config.MARCH_POLL_INTERVAL
+            else:
+                for march in marches:
+                    if march.due_at <= now:
+                        march.due_at = now + config.MARCH_POLL_INTERVAL
+        if learned is not None:
+            logger.info(f"March to {learned[0]} on {device} back after {learned[1]:.0f}s")
+            self.save()
+
+    def _expire(self, device: str, now: float):
+        """Forget marches that never showed up as returned (recalled, or sent by hand meanwhile)"""
+        marches = self._marches.get(device)
+        if not marches:
+            return
+        kept = [march for march in marches if now - march.dispatched_at < config.MARCH_MAX_AGE]
+        if len(kept) != len(marches):
+            self._stats["expired"] += len(marches) - len(kept)
+            self._marches[device] = kept
+
+    def pending(self, device: str) -> List[Dict[str, Any]]:
+        """Marches still out, with the seconds until each is due back"""
+        now = self.clock.time()
+        with self._lock:
+            return [{"resource": march.resource, "due_in": round(march.due_at - now, 1)}
+                    for march in sorted(self._marches.get(device, []), key=lambda m: m.due_at)]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics["pending"] = sum(len(marches) for marches in self._marches.values())
+        return metrics
+
+    def load(self) -> bool:
+        """Load learned durations and the marches still out from disk"""
+        try:
+            if not os.path.exists(self.path):
+                return False
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self._lock:
+                for device, entry in data.get("devices", {}).items():
+                    for resource, samples in entry.get("durations", {}).items():
+                        self._durations.setdefault(device, {})[resource] = deque(
+                            samples, maxlen=config.MARCH_HISTORY_SIZE)
+                    self._marches[device] = [March(m["resource"], m["dispatched_at"], m["due_at"])
+                                             for m in entry.get("marches", [])]
+            logger.info(f"March durations loaded from {self.path}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load march durations: {e}")
+            return False
+
+    def save(self) -> bool:
+        """Persist learned durations and pending marches"""
+        try:
+            with self._lock:
+                devices = set(self._durations) | set(self._marches)
+                data = {
+                    "last_updated": datetime.now().isoformat(),
+                    "devices": {
+                        device: {
+                            "durations": {resource: list(history)
+                                          for resource, history in self._durations.get(device, {}).items()},
+                            "marches": [march.to_dict() for march in self._marches.get(device, [])],
+                        }
+                        for device in devices
+                    }
+                }
+
+            # Whole file or nothing: write a temporary file and swap it in
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with self._save_lock:
+                temp_path = f"{self.path}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                os.replace(temp_path, self.path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save march durations: {e}")
+            return False
+
+
+_default_schedule = None
+_default_schedule_lock = threading.Lock()
+
+
+def get_march_schedule() -> MarchSchedule:
+    """Process-wide march schedule"""
+    global _default_schedule
+    if _default_schedule is None:
+        with _default_schedule_lock:
+            if _default_schedule is None:
+                _default_schedule = MarchSchedule()
+    return _default_schedule
@@ -0,0 +1,146 @@
+"""
+Pixel probes for Rise of Kingdoms Tool
+First-tier presence checks that sample a handful of pixels or small patches straight
+from the frame; template matching only runs when a probe is inconclusive
+
+Probes live in the probe manifest (images/probes.json), keyed by template path:
+    {
+        "images/built/check_build.png": {
+            "resolution": [1280, 720],
+            "tolerance": 30,
+            "points": [[x, y, b, g, r], ...],
+            "patches": [{"box": [x, y, w, h], "mean": [b, g, r], "tolerance": 20}],
+            "present": 0.9,
+            "absent": 0.5
+        }
+    }
+A probe says "present" when at least `present` of its samples match, "absent" when
+at most `absent` match, and is inconclusive in between.
+Use `python -m utils.template_tools derive-probe` to build entries from screenshots.
+"""
+
+import json
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+import config
+from utils.template_store import normalize_path
+
+logger = logging.getLogger(__name__)
+
+
+class Probe:
+    """Compiled probe: sample coordinates and expected colors as arrays"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.resolution = tuple(spec.get("resolution", (1280, 720)))
+        self.tolerance = spec.get("tolerance", 30)
+        self.present = spec.get("present", 0.9)
+        self.absent = spec.get("absent", 0.5)
+
+        points = np.asarray(spec.get("points", []), dtype=np.int32).reshape(-1, 5)
+        self.xs = points[:, 0]
+        self.ys = points[:, 1]
+        self.colors = points[:, 2:5].astype(np.int16)
+        self.patches = [
+            (tuple(p["box"]), np.asarray(p["mean"], dtype=np.float32), p.get("tolerance", self.tolerance))
+            for p in spec.get("patches", [])
+        ]
+        self.sample_count = len(self.xs) + len(self.patches)
+        self._scaled = {}
+
+    def _points_for(self, width: int, height: int):
+        """Sample coordinates for a frame size, rescaled once per resolution"""
+        if (width, height) == self.resolution:
+            return self.xs, self.ys, self.patches
+        scaled = self._scaled.get((width, height))
+        if scaled is None:
+            sx = width / float(self.resolution[0])
+            sy = height / float(self.resolution[1])
+            xs = np.clip(np.round(self.xs * sx).astype(np.int32), 0, width - 1)
+            ys = np.clip(np.round(self.ys * sy).astype(np.int32), 0, height - 1)
+            patches = [
+                ((int(round(x * sx)), int(round(y * sy)), max(1, int(round(w * sx))), max(1, int(round(h * sy)))),
+                 mean, tolerance)
+                for (x, y, w, h), mean, tolerance in self.patches
+            ]
+            scaled = self._scaled[(width, height)] = (xs, ys, patches)
+        return scaled
+
+    def evaluate(self, image: np.ndarray) -> Optional[bool]:
+        """True = present, False = absent, None = inconclusive"""
+        if self.sample_count == 0 or image is None or image.ndim != 3:
+            return None
+
+        xs, ys, patches = self._points_for(image.shape[1], image.shape[0])
+        matched = 0
+        if len(xs):
+            diff = np.abs(image[ys, xs, :3].astype(np.int16) - self.colors).max(axis=1)
+            matched += int(np.count_nonzero(diff <= self.tolerance))
+        for (x, y, w, h), mean, tolerance in patches:
+            patch_mean = image[y:y + h, x:x + w, :3].reshape(-1, 3).mean(axis=0)
+            if np.abs(patch_mean - mean).max() <= tolerance:
+                matched += 1
+
+        ratio = matched / self.sample_count
+        if ratio >= self.present:
+            return True
+        if ratio <= self.absent:
+            return False
+        return None
+
+
+class ProbeSet:
+    """All probes of the manifest with decision counters"""
+
+    def __init__(self, manifest_path: str = None):
+        self.manifest_path = manifest_path or config.PROBE_MANIFEST_PATH
+        self.specs: Dict[str, Dict[str, Any]] = {}
+        self.probes: Dict[str, Probe] = {}
+        self.stats = {"decided": 0, "inconclusive": 0}
+        self.load()
+
+    def load(self):
+        """(Re)load the probe manifest"""
+        try:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    self.specs = {normalize_path(k): v for k, v in json.load(f).items()}
+            self.probes = {key: Probe(spec) for key, spec in self.specs.items()}
+            if self.probes:
+                logger.info(f"Loaded {len(self.probes)} pixel probe(s) from {self.manifest_path}")
+        except Exception as e:
+            logger.error(f"Failed to load probe manifest {self.manifest_path}: {e}")
+            self.probes = {}
+
+    def save(self):
+        """Write the probe manifest"""
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(self.specs.items())), f, indent=4, ensure_ascii=False)
+
+    def check(self, image: np.ndarray, template: str) -> Optional[bool]:
+        """Probe verdict for a template, None if there is no probe or it is inconclusive"""
+        probe = self.probes.get(normalize_path(template))
+        if probe is None:
+            return None
+        verdict = probe.evaluate(image)
+        self.stats["inconclusive" if verdict is None else "decided"] += 1
+        return verdict
+
+
+_default_probes = None
+_default_probes_lock = threading.Lock()
+
+
+def get_probe_set() -> ProbeSet:
+    """Process-wide probe set"""
+    global _default_probes
+    if _default_probes is None:
+        with _default_probes_lock:
+            if _default_probes is None:
+                _default_probes = ProbeSet()
+    return _default_probes
@@ -0,0 +1,170 @@
+"""
+Sampling profiler for Rise of Kingdoms Tool
+Samples the stack of a chosen worker thread and writes collapsed stacks for flame graphs
+"""
+
+import os
+import sys
+import threading
+import time
+import logging
+import traceback
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileSession:
+    """A single sampling window attached to one thread"""
+
+    def __init__(self, thread_name: str, duration: float, sample_rate: float):
+        self.thread_name = thread_name
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.samples = Counter()
+        self.sample_count = 0
+        self.stop_event = threading.Event()
+        self.output_path = None
+
+
+class SamplingProfiler:
+    """
+    On-demand stack sampler.
+
+    Nothing runs while no session is active: a sampler thread only exists for the
+    duration of a requested window, so the profiled workers pay no cost when it is off.
+    Output uses the collapsed-stack format ("frame;frame;frame count") understood by
+    flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, output_dir: str = None, sample_rate: float = None, duration: float = None):
+        self.output_dir = output_dir or config.PROFILE_DIRECTORY
+        self.sample_rate = sample_rate or config.PROFILER_SAMPLE_RATE
+        self.duration = duration or config.PROFILER_DURATION
+        self._sessions: Dict[str, ProfileSession] = {}
+        self._pending: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def request(self, thread_name: str, duration: float = None) -> bool:
+        """
+        Profile a thread now, or as soon as it starts if it is not running yet.
+        Returns True if sampling started immediately.
+        """
+        duration = duration or self.duration
+        if self._find_thread(thread_name) is None:
+            with self._lock:
+                self._pending[thread_name] = duration
+            logger.info(f"Profiler armed for thread {thread_name} ({duration}s)")
+            return False
+        return self.start(thread_name, duration)
+
+    def notify_thread_started(self, thread_name: str):
+        """Start a pending profiling request once its thread is alive"""
+        with self._lock:
+            duration = self._pending.pop(thread_name, None)
+        if duration is not None:
+            self.start(thread_name, duration)
+
+    def start(self, thread_name: str, duration: float = None) -> bool:
+        """Start sampling the named thread for `duration` seconds"""
+        with self._lock:
+            if thread_name in self._sessions:
+                logger.warning(f"Profiler already running for thread {thread_name}")
+                return False
+            session = ProfileSession(thread_name, duration or self.duration, self.sample_rate)
+            self._sessions[thread_name] = session
+
+        sampler = threading.Thread(target=self._run, args=(session,),
+                                   name=f"profiler-{thread_name}", daemon=True)
+        sampler.start()
+        logger.info(f"Profiling thread {thread_name} for {session.duration}s at {session.sample_rate}Hz")
+        return True
+
+    def stop(self, thread_name: str):
+        """Stop a running session early; collected samples are still written"""
+        with self._lock:
+            session = self._sessions.get(thread_name)
+            self._pending.pop(thread_name, None)
+        if session:
+            session.stop_event.set()
+
+    def is_running(self, thread_name: str) -> bool:
+        """Check whether a session is active for the thread"""
+        with self._lock:
+            return thread_name in self._sessions
+
+    def _find_thread(self, thread_name: str) -> Optional[threading.Thread]:
+        for thread in threading.enumerate():
+            if thread.name == thread_name:
+                return thread
+        return None
+
+    def _run(self, session: ProfileSession):
+        """Sampler loop; reads the target frame without interrupting the thread"""
+        try:
+            target = self._find_thread(session.thread_name)
+            if target is None:
+                logger.warning(f"Thread {session.thread_name} not found, nothing to profile")
+                return
+
+            interval = 1.0 / session.sample_rate
+            deadline = time.monotonic() + session.duration
+            while time.monotonic() < deadline and target.is_alive():
+                frame = sys._current_frames().get(target.ident)
+                # Pooled workers outlive their job and get renamed back: the device job is over
+                if target.name != session.thread_name:
+                    logger.info(f"Thread {session.thread_name} finished its job, profiling stopped")
+                    break
+                if frame is not None:
+                    session.samples[self._collapse(frame)] += 1
+                    session.sample_count += 1
+                del frame
+                if session.stop_event.wait(interval):
+                    break
+
+            session.output_path = self._write(session)
+        except Exception as e:
+            logger.error(f"Profiler failed for thread {session.thread_name}: {e}")
+            logger.error(traceback.format_exc())
+        finally:
+            with self._lock:
+                self._sessions.pop(session.thread_name, None)
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        """Turn a frame chain into a root-first, semicolon separated stack"""
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        parts.reverse()
+        return ";".join(parts)
+
+    def _write(self, session: ProfileSession) -> Optional[str]:
+        """Write collapsed stacks to the profile directory"""
+        if not session.samples:
+            logger.warning(f"No samples collected for thread {session.thread_name}")
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in session.thread_name)
+        path = os.path.join(
+            self.output_dir,
+            f"{safe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in session.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        logger.info(f"Profile for {session.thread_name} written to {path} ({session.sample_count} samples)")
+        return path
+
+
+def device_thread_name(device_id: str) -> str:
+    """Name given to the worker thread of a device"""
+    return f"device-{device_id}"
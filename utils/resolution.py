@@ -0,0 +1,81 @@
+"""
+Screen resolution profiles for Rise of Kingdoms Tool
+Templates and coordinate constants are authored for config.BASE_RESOLUTION (1280x720).
+A ScreenProfile maps them to a device's real resolution once; rescaled templates are
+cached per profile by the template store so no resizing happens per match
+"""
+
+import threading
+from typing import Dict, Optional, Tuple
+
+import config
+
+
+class ScreenProfile:
+    """Scale factors from the base resolution to one device resolution"""
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        base_w, base_h = config.BASE_RESOLUTION
+        self.sx = width / float(base_w)
+        self.sy = height / float(base_h)
+
+    @property
+    def is_base(self) -> bool:
+        return (self.width, self.height) == tuple(config.BASE_RESOLUTION)
+
+    @property
+    def key(self) -> Optional[Tuple[int, int]]:
+        """Template cache key, None for the base resolution"""
+        return None if self.is_base else (self.width, self.height)
+
+    def point(self, x: float, y: float) -> Tuple[int, int]:
+        """Map a base-resolution coordinate to this screen"""
+        if self.is_base:
+            return int(x), int(y)
+        return int(round(x * self.sx)), int(round(y * self.sy))
+
+    def rect(self, rect: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        """Map a base-resolution (x, y, w, h) rectangle to this screen"""
+        x, y, w, h = rect
+        if self.is_base:
+            return x, y, w, h
+        return (int(round(x * self.sx)), int(round(y * self.sy)),
+                int(round(w * self.sx)), int(round(h * self.sy)))
+
+    def __repr__(self):
+        return f"ScreenProfile({self.width}x{self.height}, scale={self.sx:.3f}x{self.sy:.3f})"
+
+
+_profiles: Dict[Tuple[int, int], ScreenProfile] = {}
+_device_profiles: Dict[str, ScreenProfile] = {}
+_lock = threading.Lock()
+
+
+def get_profile(width: int, height: int) -> ScreenProfile:
+    """Shared profile for a resolution"""
+    with _lock:
+        profile = _profiles.get((width, height))
+        if profile is None:
+            profile = _profiles[(width, height)] = ScreenProfile(width, height)
+        return profile
+
+
+def base_profile() -> ScreenProfile:
+    return get_profile(*config.BASE_RESOLUTION)
+
+
+def set_device_resolution(device_id: str, width: int, height: int) -> ScreenProfile:
+    """Remember the resolution detected for a device"""
+    profile = get_profile(width, height)
+    with _lock:
+        _device_profiles[device_id] = profile
+    return profile
+
+
+def get_device_profile(device_id: str) -> ScreenProfile:
+    """Profile of a device, the base profile until its resolution is known"""
+    with _lock:
+        profile = _device_profiles.get(device_id)
+    return profile or base_profile()
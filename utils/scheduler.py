@@ -0,0 +1,158 @@
+"""
+Fleet scheduler for Rise of Kingdoms Tool
+Spreads the device loops over the capture interval instead of letting them tick
+in lockstep (all workers started together, or the same task ticked on several
+devices at once, would otherwise capture and match in bursts).
+
+    ticks           every running device gets its own phase in the interval: with
+                    n devices, phase i starts at i/n of IMAGE_CAPTURE_DELAY, plus
+                    up to SCHEDULER_JITTER of the slot as random jitter
+    expensive flows farm search and explore run on at most SCHEDULER_MAX_EXPENSIVE_FLOWS
+                    devices at once; a device turned away skips the flow for this
+                    pass and is first in line on its next try
+"""
+
+import logging
+import random
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import config
+from utils.clock import Clock, system_clock
+
+logger = logging.getLogger(__name__)
+
+
+class FleetScheduler:
+    """Tick phases and the expensive-flow limit of the running devices"""
+
+    def __init__(self, interval: float = None, jitter: float = None, max_expensive: int = None,
+                 clock: Clock = None):
+        self.interval = config.IMAGE_CAPTURE_DELAY if interval is None else interval
+        self.jitter = config.SCHEDULER_JITTER if jitter is None else jitter
+        self.max_expensive = config.SCHEDULER_MAX_EXPENSIVE_FLOWS if max_expensive is None else max_expensive
+        self.clock = clock or system_clock
+        self._devices: List[str] = []  # registration order = phase order
+        self._running: Dict[str, str] = {}  # device -> expensive flow it is in
+        self._turned_away: "OrderedDict[str, float]" = OrderedDict()  # device -> last refusal, in line order
+        self._last_tick: Dict[str, float] = {}  # device -> time of its latest scheduled tick
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "turned_away": 0, "peak_running": 0}
+
+    # ---------------- tick phases ----------------
+
+    def register(self, device: str):
+        with self._lock:
+            if device not in self._devices:
+                self._devices.append(device)
+
+    def unregister(self, device: str):
+        with self._lock:
+            if device in self._devices:
+                self._devices.remove(device)
+            self._running.pop(device, None)
+            self._turned_away.pop(device, None)
+            self._last_tick.pop(device, None)
+
+    def phase(self, device: str) -> float:
+        """Offset of the device's ticks within the interval (0 for an unknown device)"""
+        with self._lock:
+            if device not in self._devices:
+                return 0.0
+            return self._devices.index(device) * self.interval / len(self._devices)
+
+    def next_tick_delay(self, device: str) -> float:
+        """Seconds until the device's next tick: its phase in the interval plus jitter"""
+        if self.interval <= 0:
+            return 0.0
+        with self._lock:
+            slot = self.interval / max(1, len(self._devices))
+        now = self.clock.monotonic()
+        target = now - now % self.interval + self.phase(device)
+        target += random.uniform(0, self.jitter * slot)
+        # Fresh jitter each pass: a pass that ends before it would tick twice in one interval
+        with self._lock:
+            last = self._last_tick.get(device)
+        earliest = now if last is None else max(now, last + self.interval - self.jitter * slot)
+        while target <= earliest:
+            target += self.interval
+        with self._lock:
+            self._last_tick[device] = target
+        return target - now
+
+    def wait_for_tick(self, device: str, clock: Clock = None):
+        """Sleep until the device's next tick (through the worker's clock, so it stays cancellable)"""
+        (clock or self.clock).sleep(self.next_tick_delay(device))
+
+    # ---------------- expensive flows ----------------
+
+    def try_enter(self, device: str, flow: str) -> bool:
+        """Claim one of the expensive-flow slots; False means skip the flow this pass"""
+        if self.max_expensive <= 0:
+            return True
+        with self._lock:
+            now = self.clock.monotonic()
+            for other, refused_at in list(self._turned_away.items()):
+                # A device that stopped asking (stopped, or the task was unticked) loses its place
+                if other != device and now - refused_at > config.SCHEDULER_TURN_TIMEOUT:
+                    del self._turned_away[other]
+            if device in self._running:
+                return True
+
+            free = self.max_expensive - len(self._running)
+            ahead = 0
+            for other in self._turned_away:
+                if other == device:
+                    break
+                ahead += 1
+            if free > ahead:
+                self._turned_away.pop(device, None)
+                self._running[device] = flow
+                self._stats["admitted"] += 1
+                self._stats["peak_running"] = max(self._stats["peak_running"], len(self._running))
+                return True
+
+            if device not in self._turned_away:
+                logger.debug(f"{device} waits for an expensive-flow slot ({flow}), running: {self._running}")
+            self._turned_away[device] = now  # an existing entry keeps its place in line
+            self._stats["turned_away"] += 1
+            return False
+
+    def leave(self, device: str):
+        with self._lock:
+            self._running.pop(device, None)
+
+    @contextmanager
+    def expensive_flow(self, device: str, flow: str):
+        """`with scheduler.expensive_flow(device, "farm") as admitted:` run the flow only if admitted"""
+        admitted = self.try_enter(device, flow)
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.leave(device)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics["devices"] = len(self._devices)
+            metrics["running"] = dict(self._running)
+            metrics["waiting"] = list(self._turned_away)
+        metrics["limit"] = self.max_expensive
+        return metrics
+
+
+_default_scheduler: Optional[FleetScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FleetScheduler:
+    """Process-wide fleet scheduler"""
+    global _default_scheduler
+    if _default_scheduler is None:
+        with _default_scheduler_lock:
+            if _default_scheduler is None:
+                _default_scheduler = FleetScheduler()
+    return _default_scheduler
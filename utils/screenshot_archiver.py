@@ -0,0 +1,155 @@
+"""
+Screenshot archiver for Rise of Kingdoms Tool
+Keeps the last SCREENSHOT_RING_SIZE frames of every device in memory and writes
+them to SCREENSHOT_DIRECTORY only when asked: after an error in the device loop,
+when wait_until_found times out, or from the GUI. Enabled by SAVE_SCREENSHOTS.
+
+Recording costs one copy into a preallocated ring slot plus a fingerprint of a
+subsampled frame; a frame identical to the previous one only refreshes its time.
+Encoding and writing run on the io pool, at most once per device every
+SCREENSHOT_MIN_DUMP_INTERVAL seconds.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+import config
+from utils.executor import PoolSaturatedError, get_executor
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(frame: np.ndarray) -> int:
+    """Cheap frame hash: every 8th pixel of every 8th row"""
+    return zlib.crc32(np.ascontiguousarray(frame[::8, ::8]).data)
+
+
+class _DeviceRing:
+    """Ring of frame copies of one device"""
+
+    def __init__(self, size: int):
+        self.slots: List[Optional[np.ndarray]] = [None] * size
+        self.times = [0.0] * size
+        self.hashes: List[Optional[int]] = [None] * size
+        self.next = 0
+        self.count = 0
+        self.last_dump = float("-inf")
+        self.lock = threading.Lock()
+
+    def ordered(self) -> List[int]:
+        """Slot indexes, oldest first"""
+        size = len(self.slots)
+        return [(self.next - self.count + i) % size for i in range(self.count)]
+
+
+class ScreenshotArchiver:
+    """Per-device crash ring buffers written out on demand"""
+
+    def __init__(self, enabled: bool = None, ring_size: int = None, directory: str = None,
+                 min_dump_interval: float = None):
+        self.enabled = config.SAVE_SCREENSHOTS if enabled is None else enabled
+        self.ring_size = config.SCREENSHOT_RING_SIZE if ring_size is None else ring_size
+        self.directory = directory or config.SCREENSHOT_DIRECTORY
+        self.min_dump_interval = config.SCREENSHOT_MIN_DUMP_INTERVAL if min_dump_interval is None else min_dump_interval
+        self._rings: Dict[str, _DeviceRing] = {}
+        self._lock = threading.Lock()
+        self._stats = {"recorded": 0, "duplicates": 0, "dumps": 0, "rate_limited": 0, "dropped": 0, "written": 0}
+
+    def _ring(self, device: str) -> _DeviceRing:
+        with self._lock:
+            ring = self._rings.get(device)
+            if ring is None:
+                ring = self._rings[device] = _DeviceRing(self.ring_size)
+            return ring
+
+    def record(self, device: str, frame: np.ndarray):
+        """Keep a copy of a captured frame (no-op when archiving is off)"""
+        if not self.enabled or frame is None or self.ring_size <= 0:
+            return
+        fingerprint = _fingerprint(frame)
+        ring = self._ring(device)
+        with ring.lock:
+            last = (ring.next - 1) % self.ring_size
+            if ring.count and ring.hashes[last] == fingerprint:
+                ring.times[last] = time.time()
+                self._stats["duplicates"] += 1
+                return
+            slot = ring.slots[ring.next]
+            if slot is None or slot.shape != frame.shape:
+                slot = ring.slots[ring.next] = np.empty_like(frame)
+            np.copyto(slot, frame)
+            ring.times[ring.next] = time.time()
+            ring.hashes[ring.next] = fingerprint
+            ring.next = (ring.next + 1) % self.ring_size
+            ring.count = min(ring.count + 1, self.ring_size)
+            self._stats["recorded"] += 1
+
+    def dump(self, device: str, reason: str, force: bool = False) -> int:
+        """
+        Write the device's recent frames in the background.
+        :param force: ignore SCREENSHOT_MIN_DUMP_INTERVAL (on-demand dumps).
+        :return: number of frames queued for writing.
+        """
+        if not self.enabled:
+            return 0
+        ring = self._ring(device)
+        with ring.lock:
+            now = time.monotonic()
+            if not force and now - ring.last_dump < self.min_dump_interval:
+                self._stats["rate_limited"] += 1
+                return 0
+            # Copies: the slots keep being overwritten while the io pool writes
+            frames = [(ring.times[i], ring.slots[i].copy()) for i in ring.ordered()]
+            if not frames:
+                return 0
+            ring.last_dump = now
+        try:
+            get_executor().submit("io", self._write, device, reason, frames, thread_name="screenshot-archiver")
+        except PoolSaturatedError as e:
+            self._stats["dropped"] += 1
+            logger.warning(f"Screenshots of {device} not saved: {e}")
+            return 0
+        self._stats["dumps"] += 1
+        return len(frames)
+
+    def _write(self, device: str, reason: str, frames):
+        folder = os.path.join(self.directory, re.sub(r"[^\w.-]", "_", device))
+        os.makedirs(folder, exist_ok=True)
+        tag = re.sub(r"[^\w.-]", "_", reason)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        for i, (captured_at, frame) in enumerate(frames):
+            age = frames[-1][0] - captured_at
+            path = os.path.join(folder, f"{stamp}_{tag}_{i:02d}_-{age:.1f}s.png")
+            if cv2.imwrite(path, frame, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+                self._stats["written"] += 1
+            else:
+                logger.error(f"Failed to write screenshot {path}")
+        logger.info(f"Saved {len(frames)} screenshots of {device} ({reason}) to {folder}")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            devices = len(self._rings)
+        return {"enabled": self.enabled, "devices": devices, **self._stats}
+
+
+_default_archiver = None
+_default_archiver_lock = threading.Lock()
+
+
+def get_screenshot_archiver() -> ScreenshotArchiver:
+    """Process-wide screenshot archiver"""
+    global _default_archiver
+    if _default_archiver is None:
+        with _default_archiver_lock:
+            if _default_archiver is None:
+                _default_archiver = ScreenshotArchiver()
+    return _default_archiver
@@ -0,0 +1,213 @@
+"""
+Precompiled template pack for Rise of Kingdoms Tool
+Packs every template (image, mask, grayscale copy and the rescaled variants for
+config.TEMPLATE_PACK_RESOLUTIONS) into one file that is memory-mapped read-only,
+so startup does not decode ~90 PNGs and every worker shares the same pages.
+
+    python -m utils.template_pack build [images ...]
+    python -m utils.template_pack bench [--frame shot.png] [--runs 5]
+
+Layout: 8-byte magic, uint64 index length, JSON index padded to 64 bytes, then the
+raw uint8 arrays, each aligned to 64 bytes. The index maps template paths (as in the
+template manifest) to their source file stamp and per-resolution array offsets,
+relative to the start of the data section:
+    {"images/home.png": {"source": [size, mtime_ns],
+                         "variants": {"base": {"image": [offset, shape], "mask": null, "gray": [...]},
+                                      "1920x1080": {...}}}}
+Entries whose source file changed after the build are ignored, so a stale pack
+never hides an edited template; rebuild with `make templates`.
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+from utils.template_store import TemplateStore, normalize_path
+
+logger = logging.getLogger(__name__)
+
+PACK_MAGIC = b"RTPACK01"
+ALIGNMENT = 64
+BASE_VARIANT = "base"
+
+
+def variant_name(screen_key: Optional[Tuple[int, int]]) -> str:
+    """Index name of a resolution variant (ScreenProfile.key, None for the base)"""
+    return BASE_VARIANT if screen_key is None else f"{screen_key[0]}x{screen_key[1]}"
+
+
+def source_stamp(path: str) -> Optional[list]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class TemplatePack:
+    """Read-only view of a template pack; arrays are slices of one shared memory map"""
+
+    def __init__(self, path: str):
+        self.path = path
+        # A frozen build extracts images with fresh mtimes; its bundle cannot change anyway
+        self.check_sources = not getattr(sys, "frozen", False)
+        with open(path, "rb") as f:
+            if f.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                raise ValueError(f"{path} is not a template pack")
+            (index_size,) = struct.unpack("<Q", f.read(8))
+            self.index: Dict[str, dict] = json.loads(f.read(index_size).decode("utf-8"))
+        # Array offsets are relative to the data section right after the (padded) index
+        self._map = np.memmap(path, dtype=np.uint8, mode="r", offset=len(PACK_MAGIC) + 8 + index_size)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _array(self, ref) -> Optional[np.ndarray]:
+        if ref is None:
+            return None
+        offset, shape = ref
+        count = int(np.prod(shape))
+        return self._map[offset:offset + count].reshape(shape)
+
+    def arrays(self, path: str, screen_key=None) -> Optional[Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]]:
+        """(image, mask, gray) of a template variant, None if not packed or stale"""
+        entry = self.index.get(normalize_path(path))
+        if entry is None:
+            return None
+        variant = entry["variants"].get(variant_name(screen_key))
+        if variant is None:
+            return None
+        if self.check_sources and source_stamp(path) != entry["source"]:
+            logger.debug(f"Template pack entry for {path} is stale, reading the file")
+            return None
+        return self._array(variant["image"]), self._array(variant["mask"]), self._array(variant["gray"])
+
+
+def build_pack(paths, output: str, resolutions=None) -> Tuple[int, int]:
+    """Write a pack of the templates under `paths`; returns (template count, file size)"""
+    # Imported here: template_tools pulls in the probe module, which the pack reader does not need
+    from utils.resolution import get_profile
+    from utils.template_tools import iter_templates
+
+    resolutions = config.TEMPLATE_PACK_RESOLUTIONS if resolutions is None else resolutions
+    store = TemplateStore(use_pack=False)
+    index: Dict[str, dict] = {}
+    blobs = []
+    offset = 0
+
+    def add(array: Optional[np.ndarray]):
+        nonlocal offset
+        if array is None:
+            return None
+        data = np.ascontiguousarray(array, dtype=np.uint8)
+        ref = [offset, list(data.shape)]
+        padding = -data.nbytes % ALIGNMENT
+        blobs.append(data.tobytes() + b"\0" * padding)
+        offset += data.nbytes + padding
+        return ref
+
+    for path in iter_templates(paths):
+        base = store.get(path)
+        if base is None:
+            continue
+        variants = {}
+        screens = [None] + [get_profile(w, h) for w, h in resolutions]
+        for screen in screens:
+            if screen is not None and screen.is_base:
+                continue
+            template = store.get(path, screen)
+            variants[variant_name(screen.key if screen else None)] = {
+                "image": add(template.image),
+                "mask": add(template.mask),
+                "gray": add(template.gray),
+            }
+        index[normalize_path(path)] = {"source": source_stamp(path), "variants": variants}
+
+    header = json.dumps(index, separators=(",", ":")).encode("utf-8")
+    header += b" " * (-(len(PACK_MAGIC) + 8 + len(header)) % ALIGNMENT)
+
+    tmp = output + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(PACK_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, output)
+    return len(index), os.path.getsize(output)
+
+
+def measure_startup(use_pack: bool, frame_path: Optional[str]) -> Dict[str, float]:
+    """Time from a fresh store to all templates loaded and the first match done"""
+    from utils.template_tools import iter_templates
+
+    start = time.perf_counter()
+    store = TemplateStore(use_pack=use_pack)
+    templates = [store.get(path) for path in iter_templates(["images"])]
+    loaded = time.perf_counter()
+
+    frame = cv2.imread(frame_path) if frame_path else None
+    if frame is None:
+        w, h = config.BASE_RESOLUTION
+        frame = np.random.default_rng(0).integers(0, 255, (h, w, 3), dtype=np.uint8)
+    first = next(t for t in templates if t is not None)
+    frame_ready = time.perf_counter()
+    cv2.minMaxLoc(cv2.matchTemplate(frame, first.image, cv2.TM_CCOEFF_NORMED))
+    matched = time.perf_counter()
+    return {"load": loaded - start, "first_match": (loaded - start) + (matched - frame_ready)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Template pack tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="pack the templates into one memory-mappable file")
+    build.add_argument("paths", nargs="*", default=["images"], help="template files or directories")
+    build.add_argument("--output", default=config.TEMPLATE_PACK_PATH, help="pack file to write")
+
+    bench = sub.add_parser("bench", help="compare cold start to first match with and without the pack")
+    bench.add_argument("--frame", help="screenshot to match against (random frame by default)")
+    bench.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+
+    startup = sub.add_parser("startup", help=argparse.SUPPRESS)
+    startup.add_argument("--no-pack", action="store_true")
+    startup.add_argument("--frame")
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        count, size = build_pack(args.paths, args.output)
+        print(f"Packed {count} templates into {args.output} ({size / 1024:.0f} KiB)")
+    elif args.command == "startup":
+        print(json.dumps(measure_startup(not args.no_pack, args.frame)))
+    elif args.command == "bench":
+        if not os.path.exists(config.TEMPLATE_PACK_PATH):
+            print(f"{config.TEMPLATE_PACK_PATH} not found, run `python -m utils.template_pack build` first")
+            return 1
+        for label, flags in (("imread", ["--no-pack"]), ("pack", [])):
+            runs = []
+            for _ in range(args.runs):
+                # Each run is a fresh interpreter so nothing is cached in-process
+                command = [sys.executable, "-m", "utils.template_pack", "startup"] + flags
+                if args.frame:
+                    command += ["--frame", args.frame]
+                out = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+                runs.append(json.loads(out.strip().splitlines()[-1]))
+            load = statistics.median(r["load"] for r in runs) * 1000
+            first = statistics.median(r["first_match"] for r in runs) * 1000
+            print(f"{label:>7}: load {load:7.1f} ms, cold start to first match {first:7.1f} ms (median of {args.runs})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Template store for Rise of Kingdoms Tool
+Loads template images once, together with their match masks and the per-template
+metadata kept in the template manifest (images/templates.json)
+
+Masks come from the PNG alpha channel when it has transparent pixels, or from a
+sidecar file next to the template (<name>.mask.png, white = compared, black = ignored).
+Templates for devices that do not run at config.BASE_RESOLUTION are rescaled once per
+resolution and cached next to the originals.
+When a template pack (config.TEMPLATE_PACK_PATH, see utils/template_pack.py) exists,
+images, masks and prebuilt resolution variants are taken from its memory map instead
+of decoding the PNG files.
+Manifest entries are keyed by template path relative to the tool directory:
+    {"images/home.png": {"anchor": [25, 26]}}
+    anchor  tap point measured from the template's top-left corner; set by the trim
+            tool so a trimmed template still taps the center of the original one
+"""
+
+import json
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_path(path: str) -> str:
+    """Canonical manifest key for a template path ("./images/a.png" -> "images/a.png")"""
+    return os.path.normpath(path).replace("\\", "/")
+
+
+TEMPLATE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def is_template_file(filename: str) -> bool:
+    """Image file that is a template itself, not a <name>.mask.png sidecar"""
+    return filename.lower().endswith(TEMPLATE_EXTENSIONS) and ".mask." not in filename.lower()
+
+
+def mask_path_for(path: str) -> str:
+    """Sidecar mask file of a template"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.mask{ext}"
+
+
+class Template:
+    """A loaded template image with its optional mask and tap anchor"""
+
+    __slots__ = ("path", "image", "mask", "anchor", "_gray")
+
+    def __init__(self, path: str, image: np.ndarray, mask: Optional[np.ndarray] = None,
+                 anchor: Optional[Tuple[float, float]] = None, gray: Optional[np.ndarray] = None):
+        self.path = path
+        self.image = image
+        self.mask = mask
+        h, w = image.shape[:2]
+        self.anchor = anchor if anchor is not None else (w / 2, h / 2)
+        self._gray = gray
+
+    @property
+    def gray(self) -> np.ndarray:
+        """Grayscale copy, converted on first use unless it came from the pack"""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height)"""
+        return self.image.shape[1], self.image.shape[0]
+
+
+class TemplateStore:
+    """Thread-safe cache of templates shared by every Detect instance"""
+
+    def __init__(self, manifest_path: str = None, use_pack: bool = None):
+        self.manifest_path = manifest_path or config.TEMPLATE_MANIFEST_PATH
+        self._templates: Dict[Tuple[str, Optional[Tuple[int, int]]], Template] = {}
+        self._lock = threading.Lock()
+        self.manifest = self._load_manifest()
+        self.pack = self._open_pack() if (config.TEMPLATE_PACK_ENABLED if use_pack is None else use_pack) else None
+
+    @staticmethod
+    def _open_pack():
+        if not os.path.exists(config.TEMPLATE_PACK_PATH):
+            return None
+        try:
+            from utils.template_pack import TemplatePack
+            pack = TemplatePack(config.TEMPLATE_PACK_PATH)
+            logger.info(f"Using template pack {config.TEMPLATE_PACK_PATH} ({len(pack)} templates)")
+            return pack
+        except Exception as e:
+            logger.error(f"Failed to open template pack {config.TEMPLATE_PACK_PATH}: {e}")
+            return None
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    return {normalize_path(k): v for k, v in json.load(f).items()}
+        except Exception as e:
+            logger.error(f"Failed to load template manifest {self.manifest_path}: {e}")
+        return {}
+
+    def save_manifest(self):
+        """Write the manifest back to disk"""
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(self.manifest.items())), f, indent=4, ensure_ascii=False)
+
+    def entry(self, path: str) -> Dict[str, Any]:
+        """Manifest entry of a template (empty dict if none)"""
+        return self.manifest.get(normalize_path(path), {})
+
+    def get(self, path: str, screen=None) -> Optional[Template]:
+        """
+        Load a template, cached after the first read.
+        :param screen: ScreenProfile of the device; templates are rescaled for non-base resolutions.
+        """
+        key = (path, screen.key if screen is not None else None)
+        template = self._templates.get(key)
+        if template is not None:
+            return template
+
+        template = self._from_pack(path, screen) if self.pack is not None else None
+        if template is None and key[1] is None:
+            template = self._read(path)
+        elif template is None:
+            base = self.get(path)
+            template = self._rescale(base, screen) if base is not None else None
+
+        if template is not None:
+            with self._lock:
+                self._templates[key] = template
+        return template
+
+    def _from_pack(self, path: str, screen) -> Optional[Template]:
+        """Template variant backed by the pack's memory map, None if not packed"""
+        key = screen.key if screen is not None else None
+        arrays = self.pack.arrays(path, key)
+        if arrays is None:
+            return None
+        image, mask, gray = arrays
+        # Anchors come from the live manifest so re-anchoring does not need a rebuild
+        anchor = self.entry(path).get("anchor")
+        if key is not None:
+            if anchor is None:
+                # Same as _rescale: the base template's center, scaled
+                base = self.pack.arrays(path)
+                if base is not None:
+                    anchor = (base[0].shape[1] / 2, base[0].shape[0] / 2)
+            if anchor is not None:
+                anchor = (anchor[0] * screen.sx, anchor[1] * screen.sy)
+        return Template(path, image, mask, tuple(anchor) if anchor else None, gray=gray)
+
+    @staticmethod
+    def _rescale(template: Template, screen) -> Template:
+        """Resize a base-resolution template for another screen"""
+        w, h = template.size
+        size = (max(1, int(round(w * screen.sx))), max(1, int(round(h * screen.sy))))
+        interpolation = cv2.INTER_AREA if screen.sx < 1 else cv2.INTER_LINEAR
+        image = cv2.resize(template.image, size, interpolation=interpolation)
+        mask = None
+        if template.mask is not None:
+            mask = cv2.resize(template.mask, size, interpolation=cv2.INTER_NEAREST)
+        anchor = (template.anchor[0] * screen.sx, template.anchor[1] * screen.sy)
+        logger.debug(f"Rescaled template {template.path} to {size[0]}x{size[1]} for {screen}")
+        return Template(template.path, image, mask, anchor)
+
+    def _read(self, path: str) -> Optional[Template]:
+        if not os.path.exists(path):
+            logger.error(f"Template file not found: {path}")
+            return None
+
+        raw = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if raw is None:
+            logger.error(f"Failed to load template image: {path}")
+            return None
+
+        mask = None
+        if raw.ndim == 2:
+            image = cv2.cvtColor(raw, cv2.COLOR_GRAY2BGR)
+        elif raw.shape[2] == 4:
+            image = np.ascontiguousarray(raw[:, :, :3])
+            alpha = raw[:, :, 3]
+            if alpha.min() < 255:
+                mask = alpha
+        else:
+            image = raw
+
+        sidecar = mask_path_for(path)
+        if mask is None and os.path.exists(sidecar):
+            mask = cv2.imread(sidecar, cv2.IMREAD_GRAYSCALE)
+            if mask is not None and mask.shape != image.shape[:2]:
+                logger.warning(f"Ignoring mask {sidecar}: size {mask.shape} != template {image.shape[:2]}")
+                mask = None
+
+        if mask is not None:
+            # matchTemplate wants a mask with the template's channel count
+            mask = cv2.merge([mask, mask, mask])
+
+        anchor = self.entry(path).get("anchor")
+        return Template(path, image, mask, tuple(anchor) if anchor else None)
+
+    def clear(self):
+        """Drop cached templates, e.g. after templates were rewritten on disk"""
+        with self._lock:
+            self._templates.clear()
+        self.manifest = self._load_manifest()
+        if self.pack is not None:
+            self.pack = self._open_pack()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_template_store() -> TemplateStore:
+    """Process-wide template store"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = TemplateStore()
+    return _default_store
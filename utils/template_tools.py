@@ -0,0 +1,221 @@
+"""
+Template maintenance tools for Rise of Kingdoms Tool
+
+    python -m utils.template_tools trim images/home.png images/farm [--write] [--mask]
+    python -m utils.template_tools derive-probe images/built/check_build.png \
+        --positive shots/build_1.png shots/build_2.png --negative shots/idle.png [--write]
+
+trim  crops each template to its informative core (the rows/columns that hold edges),
+      records the tap anchor in the template manifest so taps still land on the center
+      of the original template, and with --mask writes a sidecar mask that ignores
+      flat background pixels inside the crop. Without --write it only reports.
+
+derive-probe  locates the template in screenshots where it is visible, keeps the pixels
+      whose color is stable across them and differs most on screenshots where it is
+      not visible, and stores them as a pixel probe in the probe manifest.
+"""
+
+import argparse
+import os
+import sys
+from typing import Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.probe import Probe, ProbeSet
+from utils.template_store import TEMPLATE_EXTENSIONS, TemplateStore, is_template_file, mask_path_for, normalize_path
+
+
+def iter_templates(paths: Iterable[str]) -> List[str]:
+    """Expand directories into the template files they contain"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if is_template_file(name):
+                        found.append(os.path.join(root, name))
+        elif path.lower().endswith(TEMPLATE_EXTENSIONS):
+            found.append(path)
+    return found
+
+
+def informative_map(image: np.ndarray, edge_threshold: float) -> np.ndarray:
+    """Boolean map of pixels that carry edge information"""
+    gray = cv2.cvtColor(image[:, :, :3], cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    return cv2.magnitude(gx, gy) > edge_threshold
+
+
+def core_box(informative: np.ndarray, min_fraction: float, padding: int) -> Optional[Tuple[int, int, int, int]]:
+    """(x0, y0, x1, y1) of the rows and columns that hold enough informative pixels"""
+    rows = np.flatnonzero(informative.mean(axis=1) >= min_fraction)
+    cols = np.flatnonzero(informative.mean(axis=0) >= min_fraction)
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+    h, w = informative.shape
+    return (max(0, cols[0] - padding), max(0, rows[0] - padding),
+            min(w, cols[-1] + 1 + padding), min(h, rows[-1] + 1 + padding))
+
+
+def trim_template(store: TemplateStore, path: str, write: bool, make_mask: bool,
+                  edge_threshold: float, min_fraction: float, padding: int, min_size: int) -> str:
+    """Trim one template; returns a one-line report"""
+    raw = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if raw is None:
+        return f"{path}: cannot read"
+
+    h, w = raw.shape[:2]
+    informative = informative_map(raw, edge_threshold)
+    box = core_box(informative, min_fraction, padding)
+    if box is None:
+        return f"{path}: no informative pixels, skipped"
+
+    x0, y0, x1, y1 = box
+    if x1 - x0 < min_size or y1 - y0 < min_size:
+        return f"{path}: core {x1 - x0}x{y1 - y0} too small, skipped"
+
+    trimmed = (x0, y0, x1, y1) != (0, 0, w, h)
+    mask = None
+    if make_mask:
+        core = informative[y0:y1, x0:x1].astype(np.uint8) * 255
+        mask = cv2.dilate(core, np.ones((5, 5), np.uint8))
+        if (mask == 0).mean() < 0.1:
+            mask = None  # almost everything is informative, a mask would only cost time
+
+    saved = 1.0 - (x1 - x0) * (y1 - y0) / float(w * h)
+    report = (f"{path}: {w}x{h} -> {x1 - x0}x{y1 - y0} ({saved:.0%} fewer pixels)"
+              f"{', masked' if mask is not None else ''}")
+    if not write or (not trimmed and mask is None):
+        return report
+
+    key = normalize_path(path)
+    entry = store.manifest.setdefault(key, {})
+    old_anchor = entry.get("anchor", [w / 2, h / 2])
+    if trimmed:
+        cv2.imwrite(path, raw[y0:y1, x0:x1])
+        entry["anchor"] = [round(old_anchor[0] - x0, 1), round(old_anchor[1] - y0, 1)]
+
+    sidecar = mask_path_for(path)
+    if mask is not None:
+        cv2.imwrite(sidecar, mask)
+    elif trimmed and os.path.exists(sidecar):
+        old_mask = cv2.imread(sidecar, cv2.IMREAD_GRAYSCALE)
+        if old_mask is not None and old_mask.shape == (h, w):
+            cv2.imwrite(sidecar, old_mask[y0:y1, x0:x1])
+
+    return report + " [written]"
+
+
+def derive_probe(template_path: str, positives: List[str], negatives: List[str], count: int,
+                 tolerance: int, spacing: int) -> Tuple[Optional[dict], str]:
+    """Build a probe spec for a template that sits at a fixed spot; returns (spec, report)"""
+    template = cv2.imread(template_path, cv2.IMREAD_COLOR)
+    if template is None:
+        return None, f"{template_path}: cannot read"
+    th, tw = template.shape[:2]
+
+    shots = [cv2.imread(p, cv2.IMREAD_COLOR) for p in positives]
+    if any(shot is None for shot in shots):
+        return None, "cannot read a positive screenshot"
+    height, width = shots[0].shape[:2]
+
+    # The template must be at the same spot on every positive screenshot
+    locations = []
+    for shot in shots:
+        _, score, _, loc = cv2.minMaxLoc(cv2.matchTemplate(shot, template, cv2.TM_CCOEFF_NORMED))
+        if score < 0.9:
+            return None, f"template not visible in a positive screenshot (best {score:.2f})"
+        locations.append(loc)
+    xs, ys = zip(*locations)
+    if max(xs) - min(xs) > 2 or max(ys) - min(ys) > 2:
+        return None, f"template moves between screenshots {locations}, a probe needs a fixed spot"
+    x0, y0 = locations[0]
+
+    stack = np.stack([shot[y0:y0 + th, x0:x0 + tw].astype(np.int16) for shot in shots])
+    mean = stack.mean(axis=0)
+    stable = (stack.max(axis=0) - stack.min(axis=0)).max(axis=2) <= tolerance // 2
+
+    # Score = smallest difference to any negative screenshot (higher = more discriminative)
+    score = np.full((th, tw), 255.0, dtype=np.float32)
+    for path in negatives:
+        negative = cv2.imread(path, cv2.IMREAD_COLOR)
+        if negative is None or negative.shape[:2] != (height, width):
+            return None, f"cannot use negative screenshot {path}"
+        region = negative[y0:y0 + th, x0:x0 + tw].astype(np.float32)
+        score = np.minimum(score, np.abs(region - mean).max(axis=2))
+    if not negatives:
+        score = informative_map(template, 40.0).astype(np.float32)
+    score[~stable] = -1
+
+    # Greedy pick of the best pixels, kept `spacing` apart so they cover the template
+    chosen = []
+    for flat in np.argsort(-score, axis=None):
+        py, px = divmod(int(flat), tw)
+        if score[py, px] < 0 or len(chosen) >= count:
+            break
+        if all(abs(px - cx) >= spacing or abs(py - cy) >= spacing for cx, cy in chosen):
+            chosen.append((px, py))
+    if len(chosen) < 3:
+        return None, "not enough stable pixels for a probe"
+
+    points = [[x0 + px, y0 + py] + [int(round(c)) for c in mean[py, px]] for px, py in chosen]
+    spec = {"resolution": [width, height], "tolerance": tolerance, "points": points,
+            "present": 0.9, "absent": 0.5}
+
+    probe = Probe(spec)
+    wrong = [p for p in positives if probe.evaluate(cv2.imread(p)) is False]
+    wrong += [p for p in negatives if probe.evaluate(cv2.imread(p)) is True]
+    report = f"{template_path}: {len(points)} points at ({x0}, {y0})"
+    if wrong:
+        report += f", misclassified: {', '.join(wrong)}"
+    return spec, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Template maintenance tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    trim = sub.add_parser("trim", help="crop templates to their informative core")
+    trim.add_argument("paths", nargs="+", help="template files or directories")
+    trim.add_argument("--write", action="store_true", help="rewrite templates and the manifest")
+    trim.add_argument("--mask", action="store_true", help="also write <name>.mask.png sidecar masks")
+    trim.add_argument("--edge-threshold", type=float, default=40.0, help="gradient magnitude counted as an edge")
+    trim.add_argument("--min-fraction", type=float, default=0.05, help="edge share a row/column needs to be kept")
+    trim.add_argument("--padding", type=int, default=2, help="pixels kept around the core")
+    trim.add_argument("--min-size", type=int, default=8, help="never trim below this width/height")
+
+    derive = sub.add_parser("derive-probe", help="derive a pixel probe from sample screenshots")
+    derive.add_argument("template", help="template the probe stands in for")
+    derive.add_argument("--positive", nargs="+", required=True, help="screenshots where the template is visible")
+    derive.add_argument("--negative", nargs="*", default=[], help="screenshots where it is not")
+    derive.add_argument("--points", type=int, default=12, help="number of pixels to sample")
+    derive.add_argument("--tolerance", type=int, default=30, help="per-channel color tolerance")
+    derive.add_argument("--spacing", type=int, default=4, help="minimum distance between sampled pixels")
+    derive.add_argument("--write", action="store_true", help="store the probe in the probe manifest")
+
+    args = parser.parse_args(argv)
+    store = TemplateStore()
+    if args.command == "trim":
+        for path in iter_templates(args.paths):
+            print(trim_template(store, path, args.write, args.mask, args.edge_threshold,
+                                args.min_fraction, args.padding, args.min_size))
+        if args.write:
+            store.save_manifest()
+    elif args.command == "derive-probe":
+        spec, report = derive_probe(args.template, args.positive, args.negative,
+                                    args.points, args.tolerance, args.spacing)
+        print(report)
+        if spec is None:
+            return 1
+        if args.write:
+            probes = ProbeSet()
+            probes.specs[normalize_path(args.template)] = spec
+            probes.save()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())